@@ -1,9 +1,12 @@
+from app.utils import startup
+
 from flask import Flask
 from app.config import Config
 from app.utils.logger import setup_logging
 
 # Настройка логирования
 setup_logging()
+startup.mark("config_and_logging")
 
 def create_app():
     app = Flask(__name__)
@@ -13,6 +16,7 @@ def create_app():
     from app.routes import bp as main_bp
     app.register_blueprint(main_bp)
 
+    startup.mark("flask_app")
     return app
 
 app = create_app()
@@ -6,3 +6,138 @@ class Config:
     HUGGING_CHAT_API_KEY = os.environ.get('HUGGING_CHAT_API_KEY', 'your_api_key_here')
     # Дополнительные настройки
     DEBUG = True
+
+    # Параметры OCR: параллельный запуск движков и таймауты (секунды)
+    OCR_CONCURRENT = os.environ.get('OCR_CONCURRENT', '1') == '1'
+    OCR_MAX_WORKERS = int(os.environ.get('OCR_MAX_WORKERS', max(3, os.cpu_count() or 1)))
+    OCR_ENGINE_TIMEOUTS = {
+        'docTR': float(os.environ.get('OCR_TIMEOUT_DOCTR', 120)),
+        'easyocr': float(os.environ.get('OCR_TIMEOUT_EASYOCR', 120)),
+        'shiftlab': float(os.environ.get('OCR_TIMEOUT_SHIFTLAB', 180)),
+    }
+
+    # Пакетный режим docTR/EasyOCR: размер пакета и лимит памяти на пакет
+    OCR_BATCHED = os.environ.get('OCR_BATCHED', '1') == '1'
+    OCR_BATCH_SIZE = int(os.environ.get('OCR_BATCH_SIZE', 16))
+    OCR_BATCH_MEMORY_MB = int(os.environ.get('OCR_BATCH_MEMORY_MB', 512))
+    DOCTR_DET_BATCH_SIZE = int(os.environ.get('DOCTR_DET_BATCH_SIZE', 4))
+    DOCTR_RECO_BATCH_SIZE = int(os.environ.get('DOCTR_RECO_BATCH_SIZE', 128))
+    EASYOCR_RECOGNITION_BATCH = int(os.environ.get('EASYOCR_RECOGNITION_BATCH', 8))
+
+    # Пул процессов-обработчиков для OCR страниц (Flask и Gradio): модели загружаются
+    # в родителе и разделяются copy-on-write, блоки передаются через общую память.
+    # WORKER_POOL_SIZE=0 — по числу ядер
+    WORKER_POOL = os.environ.get('WORKER_POOL', '0') == '1'
+    WORKER_POOL_SIZE = int(os.environ.get('WORKER_POOL_SIZE', 0))
+
+    # Инференс на CPU: потоки torch (0 — ядра, поделённые на число параллельно работающих
+    # движков и процессов) и модели с динамическим квантованием int8 (через запятую:
+    # docTR — распознаватель CRNN, easyocr — собственное квантование EasyOCR, включено и по умолчанию)
+    TORCH_INTRA_THREADS = int(os.environ.get('TORCH_INTRA_THREADS', 0))
+    TORCH_INTEROP_THREADS = int(os.environ.get('TORCH_INTEROP_THREADS', 1))
+    OCR_QUANTIZE = frozenset(filter(None, os.environ.get('OCR_QUANTIZE', 'easyocr').split(',')))
+
+    # Каскад движков OCR: движки запускаются по очереди (OCR_CASCADE_ORDER, самый быстрый
+    # первым), следующий — только для блоков, где у какой-то строки уверенность ниже порога
+    OCR_CASCADE = os.environ.get('OCR_CASCADE', '0') == '1'
+    OCR_CASCADE_ORDER = tuple(os.environ.get('OCR_CASCADE_ORDER', 'docTR,easyocr,shiftlab').split(','))
+    OCR_CASCADE_THRESHOLD = float(os.environ.get('OCR_CASCADE_THRESHOLD', 0.85))
+
+    # Разбиение страницы на блоки: "detect" — только детекция EasyOCR,
+    # "full" — детекция и распознавание. OCR_REUSE_SPLIT_RESULTS включает
+    # "full" и переиспользует тексты первого прохода вместо повторного EasyOCR.
+    SPLIT_MODE = os.environ.get('SPLIT_MODE', 'detect')
+    OCR_REUSE_SPLIT_RESULTS = os.environ.get('OCR_REUSE_SPLIT_RESULTS', '0') == '1'
+
+    # Передавать блоки между препроцессингом и OCR в памяти (np.ndarray), без PNG в /tmp
+    PIPELINE_IN_MEMORY = os.environ.get('PIPELINE_IN_MEMORY', '1') == '1'
+
+    # Загружать модели реестра заранее, до приёма первого запроса
+    MODELS_WARMUP = os.environ.get('MODELS_WARMUP', '1') == '1'
+
+    # Кэш результатов этапов (нормализация, OCR по движкам, анализ) по хэшу входа
+    # и конфигурации: LRU в памяти и на диске с ограничением размера
+    CACHE_ENABLED = os.environ.get('CACHE_ENABLED', '1') == '1'
+    CACHE_DIR = os.environ.get('CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'doc2text'))
+    CACHE_MEMORY_MB = int(os.environ.get('CACHE_MEMORY_MB', 256))
+    CACHE_DISK_MB = int(os.environ.get('CACHE_DISK_MB', 2048))
+
+    # LLM: бэкенд ("hugchat" или "stub" — локальная заглушка для офлайн-тестов),
+    # пул сессий HuggingChat, время жизни входа (секунды) и параллельные вызовы
+    LLM_BACKEND = os.environ.get('LLM_BACKEND', 'hugchat')
+    LLM_POOL_SIZE = int(os.environ.get('LLM_POOL_SIZE', 4))
+    LLM_SESSION_TTL = float(os.environ.get('LLM_SESSION_TTL', 3600))
+    LLM_CONCURRENT = os.environ.get('LLM_CONCURRENT', '1') == '1'
+
+    # Анализ длинных документов: разбиение на фрагменты (по страницам и абзацам),
+    # параллельный анализ фрагментов и объединение результатов
+    ANALYSIS_CHUNKED = os.environ.get('ANALYSIS_CHUNKED', '1') == '1'
+    ANALYSIS_CHUNK_CHARS = int(os.environ.get('ANALYSIS_CHUNK_CHARS', 2000))
+    ANALYSIS_MAX_WORKERS = int(os.environ.get('ANALYSIS_MAX_WORKERS', 4))
+
+    # Веса движков при построчном объединении результатов OCR (голосование по словам)
+    OCR_ENGINE_WEIGHTS = {
+        'docTR': float(os.environ.get('OCR_WEIGHT_DOCTR', 1.0)),
+        'easyocr': float(os.environ.get('OCR_WEIGHT_EASYOCR', 1.0)),
+        'shiftlab': float(os.environ.get('OCR_WEIGHT_SHIFTLAB', 0.7)),
+    }
+
+    # PDF: потоковый рендеринг страниц (DPI, потоки, максимум страниц в памяти)
+    # и быстрый путь для страниц с текстовым слоем (без рендеринга и OCR)
+    PDF_DPI = int(os.environ.get('PDF_DPI', 200))
+    PDF_RENDER_THREADS = int(os.environ.get('PDF_RENDER_THREADS', 2))
+    PDF_MAX_PAGES_IN_MEMORY = int(os.environ.get('PDF_MAX_PAGES_IN_MEMORY', 4))
+    PDF_TEXT_LAYER = os.environ.get('PDF_TEXT_LAYER', '1') == '1'
+    PDF_TEXT_MIN_CHARS = int(os.environ.get('PDF_TEXT_MIN_CHARS', 100))
+    PDF_TEXT_TIMEOUT = float(os.environ.get('PDF_TEXT_TIMEOUT', 60))
+
+    # Профиль препроцессинга блоков по умолчанию: "fast", "balanced" или "max-quality"
+    PREPROCESS_PROFILE = os.environ.get('PREPROCESS_PROFILE', 'balanced')
+
+    # Нормализация разрешения: страница масштабируется так, чтобы медианная высота символов
+    # была RESOLUTION_TEXT_HEIGHT px. Оценка — медианная высота компонент, то есть высота
+    # строчных букв (x-height): 16 px соответствуют прописным ~22 px; 10-12pt при 200 dpi
+    # (14-17 px) не меняются, сканы 300+ dpi и фото уменьшаются. По умолчанию только
+    # уменьшение (RESOLUTION_MAX_UPSCALE=1.0), длинная сторона не меньше RESOLUTION_MIN_SIDE,
+    # отклонения до RESOLUTION_TOLERANCE не исправляются
+    RESOLUTION_NORMALIZE = os.environ.get('RESOLUTION_NORMALIZE', '1') == '1'
+    RESOLUTION_TEXT_HEIGHT = float(os.environ.get('RESOLUTION_TEXT_HEIGHT', 16))
+    RESOLUTION_MAX_UPSCALE = float(os.environ.get('RESOLUTION_MAX_UPSCALE', 1.0))
+    RESOLUTION_MIN_SIDE = int(os.environ.get('RESOLUTION_MIN_SIDE', 1000))
+    RESOLUTION_TOLERANCE = float(os.environ.get('RESOLUTION_TOLERANCE', 0.2))
+
+    # Тайловый препроцессинг больших изображений: шумоподавление, резкость и бинаризация
+    # выполняются по перекрывающимся тайлам в общем пуле потоков (от PREPROCESS_TILE_MIN_PIXELS).
+    # Выключен по умолчанию: OpenCV сам распараллеливает эти фильтры, и пул поверх них
+    # переподписывает CPU; включать, если benchmarks/stages.py (step[...,tiled]) показывает ускорение
+    PREPROCESS_TILED = os.environ.get('PREPROCESS_TILED', '0') == '1'
+    PREPROCESS_TILE_SIZE = int(os.environ.get('PREPROCESS_TILE_SIZE', 1024))
+    PREPROCESS_TILE_OVERLAP = int(os.environ.get('PREPROCESS_TILE_OVERLAP', 32))
+    PREPROCESS_TILE_WORKERS = int(os.environ.get('PREPROCESS_TILE_WORKERS', os.cpu_count() or 1))
+    PREPROCESS_TILE_MIN_PIXELS = int(os.environ.get('PREPROCESS_TILE_MIN_PIXELS', 4_000_000))
+
+    # Геометрия страницы (раз на страницу, до разбиения на блоки): перспектива,
+    # поворот на 90° (по проекциям, 90/270 не различаются — по умолчанию выключен)
+    # и наклон не больше GEOMETRY_MAX_SKEW градусов
+    GEOMETRY_PERSPECTIVE = os.environ.get('GEOMETRY_PERSPECTIVE', '1') == '1'
+    GEOMETRY_ROTATION = os.environ.get('GEOMETRY_ROTATION', '0') == '1'
+    GEOMETRY_DESKEW = os.environ.get('GEOMETRY_DESKEW', '1') == '1'
+    GEOMETRY_MAX_SKEW = float(os.environ.get('GEOMETRY_MAX_SKEW', 10))
+
+    # Асинхронные задачи: каталог с загруженными файлами и очередью (SQLite), число обработчиков
+    JOBS_DIR = os.environ.get('JOBS_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'doc2text-jobs'))
+    JOBS_WORKERS = int(os.environ.get('JOBS_WORKERS', 2))
+    # Срок хранения завершённых задач (секунды; 0 — хранить всегда) и как часто искать устаревшие
+    JOBS_TTL = int(os.environ.get('JOBS_TTL', 7 * 24 * 3600))
+    JOBS_SWEEP_INTERVAL = int(os.environ.get('JOBS_SWEEP_INTERVAL', 600))
+
+    # Трассировка горячих участков (нормализация, шаги препроцессинга, движки OCR,
+    # объединение, вызовы LLM): агрегаты отдаются в /metrics, TRACE_LOG — ещё и JSON-лог на участок
+    TRACE_ENABLED = os.environ.get('TRACE_ENABLED', '1') == '1'
+    TRACE_LOG = os.environ.get('TRACE_LOG', '0') == '1'
+
+    # Gradio: число одновременно обрабатываемых запросов, размер очереди (0 — без ограничения)
+    # и общий пул потоков для OCR страниц всех сессий
+    GRADIO_CONCURRENCY = int(os.environ.get('GRADIO_CONCURRENCY', 4))
+    GRADIO_QUEUE_SIZE = int(os.environ.get('GRADIO_QUEUE_SIZE', 64))
+    GRADIO_WORKERS = int(os.environ.get('GRADIO_WORKERS', 2))
@@ -1,30 +1,20 @@
-import torch
-import os
 import json
 import logging
-import gradio as gr
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from app.utils import startup
 
-# Патч для weights_only=False
-_original_torch_load = torch.load
-def _patched_torch_load(*args, **kwargs):
-    kwargs['weights_only'] = False
-    return _original_torch_load(*args, **kwargs)
-torch.load = _patched_torch_load
+import cv2
+import gradio as gr
 
-# Разрешаем pickle загрузку YOLO-модели
-from shiftlab_ocr.doc2text.yolov5.models.yolo import Model
-torch.serialization.add_safe_globals([Model])
+from app.config import Config
+from app.services import preprocessor, pipeline, models, workers
 
-from app.services import file_handler, preprocessor, ocr, analyzer
+startup.mark("imports")
 
-# Логирование
+# Логирование (обработчики настраивает app.utils.logger.setup_logging при импорте app)
 logger = logging.getLogger("document_pipeline")
-logger.setLevel(logging.DEBUG)
-handler = logging.StreamHandler()
-formatter = logging.Formatter('[%(asctime)s] %(levelname)s: %(message)s')
-handler.setFormatter(formatter)
-if not logger.handlers:
-    logger.addHandler(handler)
 
 # Парсинг markdown_response и красивый вывод
 def parse_analysis(result):
@@ -63,33 +53,75 @@ def parse_analysis(result):
     return md_final
 
 
-# Обработка документа
-def process_document(file):
-    if file is None:
-        return "**Ошибка:** Файл не загружен.", None, "", "", "", ""
+# Общий пул потоков для OCR страниц всех сессий: нагрузка на CPU не растёт
+# с числом одновременно обрабатываемых документов. С Config.WORKER_POOL страницы
+# распознаются в процессах-обработчиках (app.services.workers)
+_executor = None
+_executor_lock = threading.Lock()
 
-    mime_type = file_handler.get_mime_type(file)
-    normalized_path = None
 
-    normalized_path = preprocessor.normalize_file(file)
-    
-    image_paths = normalized_path
-
-    extracted_text, ocr_info = ocr.extract_text_from_pages(image_paths)
-    if not extracted_text:
-        return "**Ошибка:** Не удалось извлечь текст.", normalized_path, "", "", "", ""
-
-    result = analyzer.process_document_pipeline(extracted_text)
-    formatted_result = parse_analysis(result)
-
-    return (
-        formatted_result,
-        normalized_path,
-        ocr_info.get("docTR", ""),
-        ocr_info.get("easyocr", ""),
-        ocr_info.get("shiftlab", ""),
-        ocr_info.get("visual", "")
-    )
+def get_executor():
+    global _executor
+    pool = workers.executor()
+    if pool is not None:
+        return pool
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=Config.GRADIO_WORKERS, thread_name_prefix="gradio-ocr")
+    return _executor
+
+
+def annotated_preview(path, blocks, page_index=0):
+    """Исходное изображение с контурами найденных блоков (для PDF — None: превью страниц нет)."""
+    if not path or path.lower().endswith(".pdf"):
+        return None
+    image = cv2.imread(path)
+    if image is None:
+        return None
+    return cv2.cvtColor(preprocessor.draw_blocks(image, blocks, page_index), cv2.COLOR_BGR2RGB)
+
+
+# Обработка документа: генератор, выдаёт текст и визуализацию по мере распознавания страниц,
+# затем результат анализа
+def process_document(file, profile=None):
+    if file is None:
+        yield "**Ошибка:** Файл не загружен.", None, None, "", "", "", ""
+        return
+
+    path = getattr(file, "name", file)
+    previews = []
+    original = {"image": path}
+    ocr_info = {"docTR": "", "easyocr": "", "shiftlab": "", "visual": ""}
+
+    def outputs(message):
+        return (
+            message,
+            original["image"],
+            previews,
+            ocr_info["docTR"],
+            ocr_info["easyocr"],
+            ocr_info["shiftlab"],
+            ocr_info["visual"]
+        )
+
+    pages_done = 0
+    for event in pipeline.iter_document(file, profile=profile, executor=get_executor()):
+        if event["event"] == "page":
+            pages_done += 1
+            previews.extend(preprocessor.preview_images(event["blocks"]))
+            annotated = annotated_preview(path, event["blocks"], event["page"])
+            if annotated is not None:
+                original["image"] = annotated
+            for key in ocr_info:
+                ocr_info[key] += event["ocr"].get(key, "")
+            yield outputs(f"⏳ Распознано страниц: {pages_done}")
+        elif event["event"] == "text":
+            yield outputs(f"⏳ Распознано страниц: {pages_done}. Анализ текста...")
+        elif event["analysis"] is None:
+            yield outputs("**Ошибка:** Не удалось извлечь текст.")
+        else:
+            yield outputs(parse_analysis(event["analysis"]))
 
 # Gradio интерфейс
 with gr.Blocks() as demo:
@@ -101,6 +133,11 @@ with gr.Blocks() as demo:
     """)
 
     file_input = gr.File(label="📂 Загрузите документ")
+    profile_input = gr.Dropdown(
+        choices=list(preprocessor.PREPROCESS_PROFILES),
+        value=Config.PREPROCESS_PROFILE,
+        label="⚙️ Профиль обработки изображений"
+    )
     image_preview = gr.Image(label="🖼️ Предпросмотр документа")
     processed_preview = gr.Gallery(label="🧪 Обработанные изображения")
     output_md = gr.Markdown(label="📝 Результаты анализа")
@@ -137,9 +174,10 @@ with gr.Blocks() as demo:
 
     submit_button.click(
         fn=process_document,
-        inputs=file_input,
+        inputs=[file_input, profile_input],
         outputs=[
             output_md,
+            image_preview,
             processed_preview,
             output_doctr,
             output_easyocr,
@@ -152,8 +190,25 @@ with gr.Blocks() as demo:
     submit_button.click(lambda: gr.update(interactive=False), None, submit_button)
     submit_button.click(lambda: gr.update(interactive=True), None, submit_button, queue=False)
 
+startup.mark("ui")
+
 if __name__ == "__main__":
-    demo.queue().launch(
+    # Интерфейс поднимается сразу, модели грузятся в фоне (или лениво при первом запросе).
+    # Пул обработчиков загружает модели и создаёт процессы до запуска сервера
+    if Config.WORKER_POOL:
+        try:
+            workers.start()
+        except RuntimeError as e:
+            # Без пула страницы распознаются в общем пуле потоков (get_executor)
+            logger.error("Пул обработчиков не создан: %s", e)
+    if workers.get_pool() is None and Config.MODELS_WARMUP:
+        models.warm_up_in_background()
+    logger.info("Время запуска: %s", startup.report())
+    # Одновременно обрабатывается GRADIO_CONCURRENCY запросов, остальные ждут в очереди
+    demo.queue(
+        default_concurrency_limit=Config.GRADIO_CONCURRENCY,
+        max_size=Config.GRADIO_QUEUE_SIZE or None,
+    ).launch(
         server_name="0.0.0.0",
         server_port=7860,
         show_api=False,
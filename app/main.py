@@ -1,5 +1,27 @@
+import logging
+import os
+
 from app import app
+from app.config import Config
+from app.services import jobs, models, workers
+from app.utils import startup
 
 if __name__ == '__main__':
+    # Модели прогреваются в фоне: /health отвечает сразу, /ready — после загрузки
+    # (в режиме отладки — только в дочернем процессе перезагрузчика werkzeug)
+    serving = not app.debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true'
+    if Config.WORKER_POOL and serving:
+        # Модели загружаются в родителе, обработчики создаются fork до запуска потоков сервера
+        try:
+            workers.start()
+        except RuntimeError as e:
+            # Без пула документы обрабатываются в процессе сервера
+            logging.getLogger(__name__).error("Пул обработчиков не создан: %s", e)
+    if workers.get_pool() is None and Config.MODELS_WARMUP and serving:
+        models.warm_up_in_background()
+    if serving:
+        # Задачи, прерванные перезапуском, снова ставятся в очередь
+        jobs.get_manager()
+    logging.getLogger(__name__).info("Время запуска: %s", startup.report())
     # Запуск Flask-сервера
     app.run(host='0.0.0.0', port=5000, debug=True)
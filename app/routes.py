@@ -1,25 +1,126 @@
-from flask import Blueprint, request, jsonify
-from app.services import file_handler, preprocessor, ocr, analyzer
+import json
+import os
+import shutil
+from tempfile import mkdtemp
+
+from flask import Blueprint, Response, request, jsonify, url_for
+from app.services import cache, jobs, models, pipeline, preprocessor, workers
+from app.utils import startup, tracing
+from app.utils.memory import current_rss
 
 bp = Blueprint('main', __name__)
 
+@bp.route('/health', methods=['GET'])
+def health():
+    # Процесс жив и принимает запросы (модели могут ещё загружаться)
+    return jsonify({'status': 'ok'})
+
+@bp.route('/ready', methods=['GET'])
+def ready():
+    # Готовность: все модели реестра загружены
+    is_ready = models.registry.ready()
+    body = {
+        'ready': is_ready,
+        'models': models.registry.report(),
+        'startup': startup.report(),
+    }
+    return jsonify(body), (200 if is_ready else 503)
+
+@bp.route('/metrics', methods=['GET'])
+def metrics():
+    # Prometheus: длительности участков конвейера (app.utils.tracing) и состояние процесса
+    cache_stats = cache.store.report()
+    extra = {
+        'doc2text_process_resident_memory_bytes': current_rss(),
+        'doc2text_models_loaded': sum(m['loaded'] for m in models.registry.report().values()),
+        'doc2text_cache_hits': cache_stats['hits'],
+        'doc2text_cache_disk_hits': cache_stats['disk_hits'],
+        'doc2text_cache_misses': cache_stats['misses'],
+    }
+    return Response(tracing.render_prometheus(extra), mimetype='text/plain; version=0.0.4')
+
+def _profile_or_error():
+    # Профиль препроцессинга можно выбрать на запрос ("fast", "balanced", "max-quality")
+    profile = request.form.get('profile') or None
+    if profile and profile not in preprocessor.PREPROCESS_PROFILES:
+        return None, (jsonify({'error': f'Неизвестный профиль: {profile}'}), 400)
+    return profile, None
+
 @bp.route('/extract-text', methods=['POST'])
 def extract_text():
     if 'file' not in request.files:
         return jsonify({'error': 'Файл не найден'}), 400
+    profile, error = _profile_or_error()
+    if error:
+        return error
 
-    # Загрузка файла и определение MIME-типа
+    # Синхронная обработка: файл сохраняется во временный каталог (расширение нужно для PDF)
     file = request.files['file']
-    mime_type = file_handler.get_mime_type(file)
+    tmp_dir = mkdtemp(prefix="doc2text_upload_")
+    try:
+        path = os.path.join(tmp_dir, os.path.basename(file.filename or '') or 'document')
+        file.save(path)
+        result = pipeline.process_path(path, profile=profile, executor=workers.executor())
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return jsonify(result)
+
+@bp.route('/jobs', methods=['POST'])
+def submit_job():
+    # Асинхронная обработка: сразу возвращаем id задачи, результат — по /jobs/<id>/result
+    if 'file' not in request.files:
+        return jsonify({'error': 'Файл не найден'}), 400
+    profile, error = _profile_or_error()
+    if error:
+        return error
+
+    file = request.files['file']
+    params = {'profile': profile} if profile else {}
+    job_id = jobs.get_manager().submit(file.stream, file.filename or 'document', params)
+    body = {
+        'job_id': job_id,
+        'status_url': url_for('main.job_status', job_id=job_id),
+        'result_url': url_for('main.job_result', job_id=job_id),
+    }
+    return jsonify(body), 202
+
+@bp.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = jobs.get_manager().get(job_id)
+    if job is None:
+        return jsonify({'error': 'Задача не найдена'}), 404
+    return jsonify(jobs.public_view(job))
 
-    # Если это изображение, применяем нормализацию
-    if mime_type.startswith('image/'):
-        file = preprocessor.normalize_image(file)
+@bp.route('/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    # Server-Sent Events: событие на каждое изменение прогресса, до завершения задачи
+    manager = jobs.get_manager()
+    if manager.get(job_id) is None:
+        return jsonify({'error': 'Задача не найдена'}), 404
 
-    # Извлечение текста с использованием подходящего метода
-    extracted_text = ocr.extract_text(file, mime_type)
+    def stream():
+        updated_after = None
+        while True:
+            job = manager.wait(job_id, timeout=15, updated_after=updated_after)
+            if job['updated_at'] == updated_after:
+                yield ': keep-alive\n\n'
+                continue
+            updated_after = job['updated_at']
+            yield f"data: {json.dumps(jobs.public_view(job), ensure_ascii=False)}\n\n"
+            if job['status'] in jobs.FINISHED:
+                return
 
-    # Анализ текста и структурирование ответа через hugging-chat-api
-    structured_data = analyzer.analyze_text(extracted_text)
+    return Response(stream(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
 
-    return jsonify(structured_data)
+@bp.route('/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    job = jobs.get_manager().get(job_id)
+    if job is None:
+        return jsonify({'error': 'Задача не найдена'}), 404
+    if job['status'] == jobs.FAILED:
+        return jsonify({'error': job['error']}), 500
+    if job['status'] != jobs.DONE:
+        return jsonify(jobs.public_view(job)), 202
+    return jsonify(job['result'])
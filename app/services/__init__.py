@@ -1,2 +1,2 @@
 # Импортируем все модули для удобства
-from . import file_handler, preprocessor, ocr, analyzer
+from . import models, file_handler, preprocessor, ocr, analyzer
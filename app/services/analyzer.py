@@ -1,27 +1,14 @@
-import os
 import json
 import re
 import logging
-from hugchat.login import Login
-from hugchat.hugchat import ChatBot
-from hugchat.exceptions import ChatError
-from transliterate import translit
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 
-# Настройка логирования
+from app.config import Config
+from app.services import cache, llm, textnorm
+
+# Логирование (обработчики настраивает app.utils.logger.setup_logging)
 logger = logging.getLogger("document_pipeline")
-logger.setLevel(logging.DEBUG)
-handler = logging.StreamHandler()
-formatter = logging.Formatter('[%(asctime)s] %(levelname)s in %(module)s: %(message)s')
-handler.setFormatter(formatter)
-if not logger.handlers:
-    logger.addHandler(handler)
-
-OCR_FIX_MAP = {
-    "A": "А", "B": "В", "C": "С", "E": "Е", "H": "Н", "K": "К",
-    "M": "М", "O": "О", "P": "Р", "T": "Т", "X": "Х", "Y": "У",
-    "a": "а", "c": "с", "e": "е", "o": "о", "p": "р", "x": "х",
-    "y": "у", "6": "б", "0": "о", "3": "з", "4": "ч", "1": "л"
-}
 
 PROMPTS = {
     "analyze_text": (
@@ -65,82 +52,224 @@ PROMPTS = {
     )
 }
 
+def _chat(prompt):
+    """Запрос к LLM через общий бэкенд (сессии HuggingChat переиспользуются между вызовами)."""
+    return llm.chat(prompt)
 
+# Разделители фрагментов в порядке приоритета: страница, абзац, строка, слово
+CHUNK_SEPARATORS = ("\f", "\n\n", "\n", " ")
 
-def fix_ocr_translit(text):
-    corrected = ''.join(OCR_FIX_MAP.get(ch, ch) for ch in text)
-    if re.search(r'[a-zA-Z]', corrected):
-        try:
-            corrected = translit(corrected, 'ru')
-        except Exception:
-            pass
-    return corrected
+EMPTY_VALUES = (None, "", "null", [], {})
 
-def authorize():
-    EMAIL = os.environ.get('HF_EMAIL', 'your_email_here')
-    PASSWD = os.environ.get('HF_PASS', 'your_password_here')
-    cookie_path_dir = os.environ.get('HUGGING_CHAT_COOKIE_DIR', './cookies/')
 
-    sign = Login(EMAIL, PASSWD)
-    cookies = sign.login(cookie_dir_path=cookie_path_dir, save_cookies=True)
-    chatbot = ChatBot(cookies=cookies.get_dict())
-    return chatbot
+def _split(text, max_chars, level):
+    if len(text) <= max_chars:
+        return [text]
+    if level == len(CHUNK_SEPARATORS):
+        return [text[i:i + max_chars] for i in range(0, len(text), max_chars)]
+    separator = CHUNK_SEPARATORS[level]
+    pieces = []
+    for part in text.split(separator):
+        if part.strip():
+            pieces.extend(_split(part.strip(), max_chars, level + 1))
+    # Жадно собираем соседние куски обратно, пока помещаются в max_chars
+    chunks, current = [], ""
+    for piece in pieces:
+        candidate = current + separator + piece if current else piece
+        if len(candidate) <= max_chars:
+            current = candidate
+        else:
+            chunks.append(current)
+            current = piece
+    if current:
+        chunks.append(current)
+    return chunks
 
-def analyze_text(text):
-    chatbot = authorize()
-    MAX_TEXT_LENGTH = 2000
-    truncated_text = text[:MAX_TEXT_LENGTH] if len(text) > MAX_TEXT_LENGTH else text
-    # translated_text = fix_ocr_translit(truncated_text)
 
-    prompt = PROMPTS["analyze_text"].format(truncated_text)
+def split_text(text, max_chars=None):
+    """
+    Делит текст на фрагменты не длиннее max_chars (по умолчанию Config.ANALYSIS_CHUNK_CHARS),
+    стараясь резать по границам страниц (\f), затем абзацев, строк и слов.
+    """
+    max_chars = max_chars or Config.ANALYSIS_CHUNK_CHARS
+    text = text.strip()
+    return _split(text, max_chars, 0) if text else []
+
+
+def _map_chunks(func, chunks):
+    """Применяет func к фрагментам параллельно (Config.ANALYSIS_MAX_WORKERS), порядок сохраняется."""
+    if len(chunks) == 1:
+        return [func(chunks[0])]
+    workers = max(1, min(Config.ANALYSIS_MAX_WORKERS, len(chunks)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="llm-chunk") as pool:
+        return list(pool.map(func, chunks))
+
+
+def _chunks(text):
+    return split_text(text) if Config.ANALYSIS_CHUNKED else [text]
+
+
+def _parse_json(response):
+    """JSON из ответа LLM: весь ответ или блок ```json ... ```; None, если не разобрать."""
+    match = re.search(r"```json\s*(.*?)```", response or "", re.S)
+    try:
+        return json.loads(match.group(1) if match else response)
+    except (TypeError, ValueError):
+        return None
+
+
+def _result_fields(result):
+    """Поля результата фрагмента: сам dict или JSON внутри markdown_response."""
+    if not isinstance(result, dict):
+        return None
+    if "markdown_response" not in result:
+        return result
+    fields = _parse_json(result["markdown_response"])
+    return fields if isinstance(fields, dict) else None
+
+
+def merge_chunk_results(results):
+    """
+    Reduce-шаг: объединяет JSON-результаты фрагментов в один.
+    document_type — самый частый, списки объединяются без повторов, summary и
+    full_text склеиваются по порядку фрагментов, остальные поля берутся
+    из первого фрагмента, где они заполнены. markdown_response содержит
+    итоговый JSON в том же формате, что и ответ LLM на один фрагмент.
+    """
+    parsed = [fields for fields in map(_result_fields, results) if fields]
+    if not parsed:
+        return {"markdown_response": "\n\n".join(
+            r.get("markdown_response", "") for r in results if isinstance(r, dict)
+        )}
+
+    merged = {}
+    for fields in parsed:
+        for key, value in fields.items():
+            if value in EMPTY_VALUES:
+                continue
+            if isinstance(value, list):
+                items = merged.setdefault(key, [])
+                items.extend(item for item in value if item not in items)
+            elif key in ("summary", "full_text") and isinstance(value, str) and key in merged:
+                merged[key] = f"{merged[key]}\n{value}"
+            else:
+                merged.setdefault(key, value)
+    types = Counter(f.get("document_type") for f in parsed if f.get("document_type") not in EMPTY_VALUES)
+    if types:
+        merged["document_type"] = types.most_common(1)[0][0]
+
+    body = json.dumps(merged, ensure_ascii=False, indent=2)
+    merged["markdown_response"] = (
+        f"Сводный результат по {len(results)} фрагментам документа.\n\n```json\n{body}\n```"
+    )
+    return merged
+
+
+def _analyze_chunk(text):
+    prompt = PROMPTS["analyze_text"].format(text)
     try:
-        response = chatbot.chat(prompt).wait_until_done()
+        response = _chat(prompt)
         return json.loads(response)
     except:
         return {"markdown_response": response}
 
+def analyze_text(text):
+    """
+    Базовый анализ. Длинный текст делится на фрагменты (Config.ANALYSIS_CHUNKED),
+    которые анализируются параллельно и объединяются merge_chunk_results;
+    без разбиения текст обрезается до Config.ANALYSIS_CHUNK_CHARS.
+    """
+    if not Config.ANALYSIS_CHUNKED:
+        return _analyze_chunk(text[:Config.ANALYSIS_CHUNK_CHARS])
+    chunks = _chunks(text) or [""]
+    if len(chunks) == 1:
+        return _analyze_chunk(chunks[0])
+    return merge_chunk_results(_map_chunks(_analyze_chunk, chunks))
+
 def generate_specific_fields(document_type):
-    chatbot = authorize()
     prompt = PROMPTS["generate_specific_fields"].format(document_type)
     try:
-        response = chatbot.chat(prompt).wait_until_done()
+        response = _chat(prompt)
         return json.loads(response)
     except:
         return []
 
 def extract_detailed_fields(full_text, document_type):
-    chatbot = authorize()
     specific_fields = generate_specific_fields(document_type)
-    translated_text = fix_ocr_translit(full_text)
+    translated_text = textnorm.normalize_text(full_text)
 
-    prompt = PROMPTS["extract_detailed_fields"].format(", ".join(specific_fields), translated_text)
-    try:
-        response = chatbot.chat(prompt).wait_until_done()
-        return json.loads(response)
-    except:
-        return {"markdown_response": response}
+    def extract(text):
+        prompt = PROMPTS["extract_detailed_fields"].format(", ".join(specific_fields), text)
+        try:
+            response = _chat(prompt)
+            return json.loads(response)
+        except:
+            return {"markdown_response": response}
 
-def estimate_document_count(full_text):
-    chatbot = authorize()
-    translated_text = fix_ocr_translit(full_text)
+    chunks = _chunks(translated_text) or [""]
+    if len(chunks) == 1:
+        return extract(chunks[0])
+    return merge_chunk_results(_map_chunks(extract, chunks))
 
-    prompt = PROMPTS["estimate_document_count"].format(translated_text)
+def _estimate_chunk_count(text):
+    prompt = PROMPTS["estimate_document_count"].format(text)
     try:
-        response = chatbot.chat(prompt).wait_until_done()
+        response = _chat(prompt)
         result = json.loads(response)
         return result.get("document_count", None)
     except:
         match = re.search(r'\d+', response)
         return int(match.group(0)) if match else None
 
-def process_document_pipeline(ocr_text):
-    base_result = analyze_text(ocr_text)
+def estimate_document_count(full_text):
+    """
+    Число документов. Для длинного текста — максимум по фрагментам: документ,
+    разрезанный на несколько фрагментов, не считается несколько раз.
+    """
+    translated_text = textnorm.normalize_text(full_text)
+    chunks = _chunks(translated_text) or [""]
+    counts = [c for c in _map_chunks(_estimate_chunk_count, chunks) if isinstance(c, int)]
+    return max(counts) if counts else None
+
+def _analysis_chain(ocr_text):
+    base_result = analyze_text(textnorm.normalize_text(ocr_text))
     document_type = base_result.get("document_type", "unknown")
-    detailed_result = extract_detailed_fields(ocr_text, document_type)
-    document_count = estimate_document_count(ocr_text)
+    return base_result, extract_detailed_fields(ocr_text, document_type)
+
+def process_document_pipeline(ocr_text, use_cache=None):
+    """
+    Базовый анализ, специфичные поля и число документов.
+    Все вызовы получают текст после textnorm.normalize_text (считается один раз на документ).
+    Результат кэшируется по тексту и версии промптов (use_cache, по умолчанию
+    Config.CACHE_ENABLED), поэтому правка промптов не затрагивает кэш OCR.
+    """
+    if use_cache is None:
+        use_cache = Config.CACHE_ENABLED
+    key = None
+    if use_cache and cache.store.enabled:
+        key = cache.stage_key("analysis", ocr_text, PROMPTS, textnorm.VERSION, textnorm.LATIN_HOMOGLYPHS,
+                              textnorm.DIGIT_HOMOGLYPHS, Config.LLM_BACKEND,
+                              Config.ANALYSIS_CHUNKED, Config.ANALYSIS_CHUNK_CHARS)
+        cached = cache.store.get("analysis", key)
+        if cached is not None:
+            return cached
+
+    if Config.LLM_CONCURRENT:
+        # Число документов не зависит от остальных вызовов и идёт параллельно с цепочкой
+        # analyze_text -> generate_specific_fields -> extract_detailed_fields
+        with ThreadPoolExecutor(max_workers=2, thread_name_prefix="llm") as pool:
+            count_future = pool.submit(estimate_document_count, ocr_text)
+            base_result, detailed_result = _analysis_chain(ocr_text)
+            document_count = count_future.result()
+    else:
+        base_result, detailed_result = _analysis_chain(ocr_text)
+        document_count = estimate_document_count(ocr_text)
 
-    return {
+    result = {
         "document_count": document_count,
         "base_analysis": base_result,
         "detailed_analysis": detailed_result
     }
+    if key is not None:
+        cache.store.put("analysis", key, result)
+    return result
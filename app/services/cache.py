@@ -0,0 +1,230 @@
+import hashlib
+import json
+import logging
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from app.config import Config
+
+logger = logging.getLogger(__name__)
+
+# Версии этапов: увеличиваются при изменении алгоритма, чтобы старые записи не использовались
+STAGE_VERSIONS = {
+    "normalize": 2,
+    "geometry": 1,
+    "ocr": 2,
+    "analysis": 1,
+}
+
+_MISSING = object()
+
+
+def digest(*parts) -> str:
+    """
+    sha256 от набора частей: bytes, str, np.ndarray (с формой и типом)
+    или любой JSON-сериализуемой структуры (конфигурации этапа).
+    """
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, np.ndarray):
+            h.update(f"{part.shape}{part.dtype}".encode())
+            h.update(np.ascontiguousarray(part).tobytes())
+        elif isinstance(part, (bytes, bytearray, memoryview)):
+            h.update(part)
+        elif isinstance(part, str):
+            h.update(part.encode("utf-8"))
+        else:
+            h.update(json.dumps(part, sort_keys=True, default=str).encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+
+def file_digest(file_obj) -> str:
+    """Хэш содержимого загруженного файла: путь, объект с .name или file-like в памяти."""
+    if isinstance(file_obj, str):
+        with open(file_obj, "rb") as f:
+            return digest(f.read())
+    if hasattr(file_obj, "name") and isinstance(file_obj.name, str) and os.path.exists(file_obj.name):
+        with open(file_obj.name, "rb") as f:
+            return digest(f.read())
+    if hasattr(file_obj, "read"):
+        file_obj.seek(0)
+        data = file_obj.read()
+        file_obj.seek(0)
+        return digest(data)
+    raise ValueError("Неподдерживаемый тип файла: {}".format(type(file_obj)))
+
+
+class ResultCache:
+    """
+    Двухуровневый кэш результатов этапов конвейера: LRU в памяти и LRU на диске,
+    оба ограничены по размеру (в байтах сериализованного значения).
+    Ключ — (этап, хэш), на диске записи лежат в <directory>/<этап>/<хэш>.pkl,
+    порядок вытеснения определяется временем последнего обращения (mtime).
+    Значения из кэша отдаются как есть — вызывающий код не должен их изменять.
+    """
+
+    def __init__(self, directory=None, memory_bytes=0, disk_bytes=0):
+        self.directory = directory
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self._memory = OrderedDict()
+        self._memory_used = 0
+        self._disk_used = None  # считается при первом обращении к диску
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "disk_hits": 0, "misses": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.memory_bytes > 0 or (self.directory is not None and self.disk_bytes > 0)
+
+    def _disk_enabled(self) -> bool:
+        return self.directory is not None and self.disk_bytes > 0
+
+    def _path(self, stage, key):
+        return os.path.join(self.directory, stage, f"{key}.pkl")
+
+    def get(self, stage, key, default=None):
+        if not self.enabled:
+            return default
+        with self._lock:
+            entry = self._memory.get((stage, key))
+            if entry is not None:
+                self._memory.move_to_end((stage, key))
+                self._stats["hits"] += 1
+                return entry[0]
+        value = self._read_disk(stage, key)
+        with self._lock:
+            if value is _MISSING:
+                self._stats["misses"] += 1
+                return default
+            self._stats["disk_hits"] += 1
+        self._remember(stage, key, value, len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL)))
+        return value
+
+    def put(self, stage, key, value):
+        if not self.enabled:
+            return
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        self._remember(stage, key, value, len(data))
+        self._write_disk(stage, key, data)
+
+    def _remember(self, stage, key, value, size):
+        if size > self.memory_bytes:
+            return
+        with self._lock:
+            old = self._memory.pop((stage, key), None)
+            if old is not None:
+                self._memory_used -= old[1]
+            self._memory[stage, key] = (value, size)
+            self._memory_used += size
+            while self._memory_used > self.memory_bytes:
+                _, (_, evicted) = self._memory.popitem(last=False)
+                self._memory_used -= evicted
+
+    def _read_disk(self, stage, key):
+        if not self._disk_enabled():
+            return _MISSING
+        path = self._path(stage, key)
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+            os.utime(path)  # отмечаем обращение для LRU
+            return value
+        except FileNotFoundError:
+            return _MISSING
+        except Exception as e:
+            logger.warning("Повреждённая запись кэша %s: %s", path, e)
+            self._remove(path)
+            return _MISSING
+
+    def _write_disk(self, stage, key, data):
+        if not self._disk_enabled() or len(data) > self.disk_bytes:
+            return
+        path = self._path(stage, key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            previous = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning("Не удалось записать кэш %s: %s", path, e)
+            return
+        with self._lock:
+            if self._disk_used is None:
+                self._disk_used = sum(size for _, size, _ in self._disk_entries())
+            else:
+                self._disk_used += len(data) - previous
+            if self._disk_used > self.disk_bytes:
+                self._evict_disk()
+
+    def _disk_entries(self):
+        """[(путь, размер, mtime)] всех записей на диске."""
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(".pkl"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def _evict_disk(self):
+        """Удаляет самые давние записи, пока размер не опустится до 90% лимита."""
+        entries = sorted(self._disk_entries(), key=lambda e: e[2])
+        used = sum(size for _, size, _ in entries)
+        target = self.disk_bytes * 0.9
+        for path, size, _ in entries:
+            if used <= target:
+                break
+            if self._remove(path):
+                used -= size
+        self._disk_used = used
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+            return True
+        except OSError:
+            return False
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._memory_used = 0
+            if self._disk_enabled() and os.path.isdir(self.directory):
+                for path, _, _ in self._disk_entries():
+                    self._remove(path)
+            self._disk_used = 0
+
+    def report(self):
+        with self._lock:
+            return {
+                **self._stats,
+                "memory_entries": len(self._memory),
+                "memory_mb": round(self._memory_used / 2 ** 20, 1),
+                "disk_mb": None if self._disk_used is None else round(self._disk_used / 2 ** 20, 1),
+            }
+
+
+def stage_key(stage, *parts) -> str:
+    """Ключ этапа: версия этапа + части (хэши входа и конфигурация)."""
+    return digest(stage, STAGE_VERSIONS[stage], *parts)
+
+
+store = ResultCache(
+    directory=Config.CACHE_DIR if Config.CACHE_ENABLED else None,
+    memory_bytes=Config.CACHE_MEMORY_MB * 2 ** 20 if Config.CACHE_ENABLED else 0,
+    disk_bytes=Config.CACHE_DISK_MB * 2 ** 20 if Config.CACHE_ENABLED else 0,
+)
@@ -0,0 +1,170 @@
+import re
+from collections import defaultdict
+from typing import List, Optional, Sequence, Tuple
+
+from app.config import Config
+
+# Порог сходства строк (по триграммам), при котором строки разных движков считаются одной строкой
+LINE_MATCH_THRESHOLD = 0.3
+# Порог сходства слов, при котором слово другого движка голосует за позицию слова опорной строки
+TOKEN_MATCH_THRESHOLD = 0.5
+# Доля n-грамм более короткой строки, входящих в более длинную, при которой короткая
+# считается её фрагментом (EasyOCR режет строки на фразы, docTR отдаёт строки целиком)
+FRAGMENT_MATCH_THRESHOLD = 0.6
+# Минимум n-грамм у фрагмента: совсем короткие строки (номера, одиночные буквы) так не сопоставляются
+FRAGMENT_MIN_GRAMS = 4
+# На сколько строк вперёд ищется пара для строки другого движка
+LINE_SEARCH_WINDOW = 8
+
+_TOKEN_RE = re.compile(r"\S+")
+
+
+def _normalize(text: str) -> str:
+    return " ".join(text.lower().split())
+
+
+def ngrams(text: str, n: int = 3) -> frozenset:
+    """Множество хэшей символьных n-грамм нормализованной строки."""
+    padded = f" {_normalize(text)} "
+    if len(padded) <= n:
+        return frozenset((hash(padded),))
+    return frozenset(hash(padded[i:i + n]) for i in range(len(padded) - n + 1))
+
+
+def similarity(a, b) -> float:
+    """Коэффициент Жаккара по n-граммам (строки или готовые множества n-грамм), O(len)."""
+    a = a if isinstance(a, frozenset) else ngrams(a)
+    b = b if isinstance(b, frozenset) else ngrams(b)
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def containment(part: frozenset, whole: frozenset) -> float:
+    """Доля n-грамм part, входящих в whole."""
+    return len(part & whole) / len(part) if part else 0.0
+
+
+def _is_fragment(a: frozenset, b: frozenset) -> bool:
+    """Более короткая из строк почти целиком входит в более длинную."""
+    shorter, longer = (a, b) if len(a) <= len(b) else (b, a)
+    return len(shorter) >= FRAGMENT_MIN_GRAMS and containment(shorter, longer) >= FRAGMENT_MATCH_THRESHOLD
+
+
+class _Line:
+    __slots__ = ("text", "weight", "grams", "tokens")
+
+    def __init__(self, text, weight):
+        self.text = text
+        self.weight = weight
+        self.grams = ngrams(text)
+        self.tokens = _TOKEN_RE.findall(text)
+
+
+def _engine_lines(engine: str, text: Optional[str], lines: Sequence[str], confidences: Sequence[float]):
+    """Строки движка с весом = уверенность строки x вес движка (Config.OCR_ENGINE_WEIGHTS)."""
+    if not lines and text and text.strip():
+        lines = text.splitlines()
+    engine_weight = Config.OCR_ENGINE_WEIGHTS.get(engine, 1.0)
+    result = []
+    for i, line in enumerate(lines):
+        if not line or not line.strip():
+            continue
+        conf = confidences[i] if i < len(confidences) and confidences[i] is not None else 1.0
+        result.append(_Line(line.strip(), max(conf, 0.01) * engine_weight))
+    return result
+
+
+def _align(groups, other):
+    """
+    Жадно и монотонно сопоставляет строки движка с группами строк:
+    для каждой строки ищется самая похожая группа в окне LINE_SEARCH_WINDOW
+    после предыдущего совпадения. Строка без пары становится новой группой
+    сразу после последней сопоставленной.
+    Если строка — фрагмент строки группы или, наоборот, содержит её целиком
+    (фразы против полных строк), она не голосует и не добавляется в текст:
+    её содержимое уже представлено группой. Несколько фрагментов подряд
+    могут относиться к одной группе.
+    """
+    cursor = 0
+    for line in other:
+        best, best_score = None, LINE_MATCH_THRESHOLD
+        for j in range(cursor, min(cursor + LINE_SEARCH_WINDOW, len(groups))):
+            score = similarity(line.grams, groups[j][0].grams)
+            if score >= best_score:
+                best, best_score = j, score
+        if best is not None:
+            groups[best].append(line)
+            cursor = best + 1
+            continue
+        fragment_of = next(
+            (j for j in range(max(0, cursor - 1), min(cursor + LINE_SEARCH_WINDOW, len(groups)))
+             if _is_fragment(line.grams, groups[j][0].grams)),
+            None,
+        )
+        if fragment_of is not None:
+            cursor = fragment_of
+        else:
+            groups.insert(cursor, [line])
+            cursor += 1
+
+
+def _vote_tokens(anchor: _Line, candidates: List[_Line]) -> str:
+    """
+    Голосование по словам: каждое слово опорной строки заменяется на вариант
+    с наибольшим суммарным весом среди слов других строк группы на той же
+    (пропорциональной, +-1) позиции, если они достаточно похожи.
+    """
+    if not anchor.tokens:
+        return anchor.text
+    result = []
+    n = len(anchor.tokens)
+    for i, token in enumerate(anchor.tokens):
+        votes = defaultdict(float)
+        votes[token] += anchor.weight
+        token_grams = ngrams(token, 2)
+        for line in candidates:
+            if line is anchor or not line.tokens:
+                continue
+            center = round(i * len(line.tokens) / n)
+            best, best_score = None, TOKEN_MATCH_THRESHOLD
+            for k in range(max(0, center - 1), min(len(line.tokens), center + 2)):
+                score = similarity(token_grams, ngrams(line.tokens[k], 2))
+                if score >= best_score:
+                    best, best_score = line.tokens[k], score
+            if best is not None:
+                votes[best] += line.weight
+        result.append(max(votes.items(), key=lambda item: (item[1], item[0] == token))[0])
+    return " ".join(result)
+
+
+def _consensus(group: List[_Line]) -> str:
+    if len(group) == 1:
+        return group[0].text
+    # Опорная строка — та, что лучше всего согласуется с остальными с учётом весов
+    anchor = max(
+        group,
+        key=lambda line: line.weight + sum(similarity(line.grams, o.grams) * o.weight for o in group if o is not line),
+    )
+    return _vote_tokens(anchor, group)
+
+
+def fuse(results: Sequence[Tuple[str, Optional[str], Sequence[str], Sequence[float]]]) -> Optional[str]:
+    """
+    Объединяет результаты движков для одного блока в один текст.
+    results — [(движок, текст, строки, уверенности)]; у движка без построчного
+    результата текст делится на строки по переводам строк.
+    Опорный движок — с наибольшим суммарным весом строк; строки остальных
+    сопоставляются с ним по n-граммам, в каждой группе слова выбираются
+    голосованием с весами уверенностей. None — если текста нет ни у кого.
+    """
+    engines = [_engine_lines(*item) for item in results]
+    engines = [lines for lines in engines if lines]
+    if not engines:
+        return None
+
+    engines.sort(key=lambda lines: sum(line.weight * len(line.text) for line in lines), reverse=True)
+    groups = [[line] for line in engines[0]]
+    for other in engines[1:]:
+        _align(groups, other)
+    return "\n".join(_consensus(group) for group in groups)
@@ -0,0 +1,87 @@
+import contextlib
+import logging
+import os
+import threading
+
+from app.config import Config
+
+logger = logging.getLogger(__name__)
+
+# Модели, для которых есть вариант int8 (Config.OCR_QUANTIZE)
+QUANTIZABLE = ("docTR", "easyocr")
+
+_settings = None
+_lock = threading.Lock()
+
+
+def outer_parallelism(processes: int = 1) -> int:
+    """Сколько моделей одновременно считают на CPU: процессы x движки OCR, запущенные параллельно."""
+    engines = 3 if Config.OCR_CONCURRENT else 1
+    return max(1, processes) * engines
+
+
+def configure(processes: int = 1, force: bool = False) -> dict:
+    """
+    Настраивает потоки torch один раз на процесс (до загрузки моделей):
+    intra-op — Config.TORCH_INTRA_THREADS или ядра, поделённые на внешний
+    параллелизм (outer_parallelism), чтобы параллельные движки и процессы
+    не переподписывали CPU; inter-op — Config.TORCH_INTEROP_THREADS.
+    processes — число процессов-обработчиков (пакетный режим, пул обработчиков);
+    force=True — настроить заново (в процессе, созданном fork от настроенного).
+    Возвращает применённые настройки; без torch — пустой словарь.
+    """
+    global _settings
+    if _settings is not None and not force:
+        return _settings
+    with _lock:
+        if _settings is not None and not force:
+            return _settings
+        try:
+            import torch
+        except ImportError:
+            _settings = {}
+            return _settings
+        intra = Config.TORCH_INTRA_THREADS or max(1, (os.cpu_count() or 1) // outer_parallelism(processes))
+        torch.set_num_threads(intra)
+        interop = Config.TORCH_INTEROP_THREADS
+        if interop:
+            try:
+                torch.set_num_interop_threads(interop)
+            except RuntimeError:
+                # Пул inter-op уже запущен (torch успел посчитать что-то в этом процессе)
+                interop = torch.get_num_interop_threads()
+        _settings = {"intra_op_threads": torch.get_num_threads(),
+                     "inter_op_threads": interop or torch.get_num_interop_threads(),
+                     "quantized": sorted(Config.OCR_QUANTIZE)}
+        logger.info("Настройки инференса: %s", _settings)
+        return _settings
+
+
+def settings() -> dict:
+    """Применённые настройки (None — configure ещё не вызывался)."""
+    return _settings
+
+
+def inference_mode():
+    """torch.inference_mode для вызова модели (без torch — пустой контекст)."""
+    try:
+        import torch
+    except ImportError:
+        return contextlib.nullcontext()
+    return torch.inference_mode()
+
+
+def is_quantized(name: str) -> bool:
+    return name in QUANTIZABLE and name in Config.OCR_QUANTIZE
+
+
+def variant(name: str) -> str:
+    """Вариант весов модели ("int8" или "fp32") — часть ключа кэша результатов OCR."""
+    return "int8" if is_quantized(name) else "fp32"
+
+
+def quantize_dynamic(module):
+    """Динамическое квантование int8 слоёв Linear и LSTM (свёртки остаются fp32)."""
+    import torch
+
+    return torch.ao.quantization.quantize_dynamic(module, {torch.nn.Linear, torch.nn.LSTM}, dtype=torch.qint8)
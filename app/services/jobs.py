@@ -0,0 +1,251 @@
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from app.config import Config
+
+logger = logging.getLogger(__name__)
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+FINISHED = (DONE, FAILED)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    path TEXT NOT NULL,
+    params TEXT NOT NULL,
+    progress TEXT NOT NULL,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+)
+"""
+
+
+class JobStore:
+    """Персистентная очередь задач в SQLite: задачи переживают перезапуск процесса."""
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.execute(_SCHEMA)
+
+    def insert(self, job_id, filename, path, params):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO jobs (id, status, filename, path, params, progress, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, QUEUED, filename, path, json.dumps(params), json.dumps({}), now, now),
+            )
+
+    def update(self, job_id, **fields):
+        for key in ("params", "progress", "result"):
+            if key in fields:
+                fields[key] = json.dumps(fields[key], ensure_ascii=False)
+        fields["updated_at"] = time.time()
+        columns = ", ".join(f"{key} = ?" for key in fields)
+        with self._lock, self._conn:
+            self._conn.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._row(row) if row else None
+
+    def unfinished(self):
+        """Задачи, не завершённые к моменту остановки (в очереди или прерванные), по времени создания."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM jobs WHERE status IN (?, ?) ORDER BY created_at", (QUEUED, RUNNING)
+            ).fetchall()
+        return [self._row(row) for row in rows]
+
+    def expired(self, before):
+        """id завершённых задач, не обновлявшихся с момента before (time.time())."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id FROM jobs WHERE status IN (?, ?) AND updated_at < ?", (*FINISHED, before)
+            ).fetchall()
+        return [row["id"] for row in rows]
+
+    def delete(self, job_ids):
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM jobs WHERE id = ?", [(job_id,) for job_id in job_ids])
+
+    @staticmethod
+    def _row(row):
+        job = dict(row)
+        for key in ("params", "progress", "result"):
+            job[key] = json.loads(job[key]) if job[key] is not None else None
+        return job
+
+
+class JobManager:
+    """
+    Асинхронная обработка документов: файл сохраняется в каталог задачи,
+    задача записывается в JobStore и выполняется в ограниченном пуле потоков
+    (Config.JOBS_WORKERS). Прогресс по этапам обновляется по мере обработки.
+    Загруженный файл удаляется, как только задача завершена; сами задачи
+    с результатами удаляются через ttl секунд (Config.JOBS_TTL, см. sweep).
+    """
+
+    def __init__(self, directory=None, workers=None, runner=None, ttl=None):
+        self.directory = directory or Config.JOBS_DIR
+        os.makedirs(self.directory, exist_ok=True)
+        self.store = JobStore(os.path.join(self.directory, "jobs.sqlite3"))
+        self._pool = ThreadPoolExecutor(max_workers=workers or Config.JOBS_WORKERS, thread_name_prefix="job")
+        self._runner = runner
+        self._changed = threading.Condition()
+        self.ttl = Config.JOBS_TTL if ttl is None else ttl
+        self._swept_at = 0.0
+
+    def submit(self, stream, filename, params=None):
+        """Сохраняет загруженный файл (file-like) и ставит задачу в очередь. Возвращает id задачи."""
+        self._maybe_sweep()
+        job_id = uuid.uuid4().hex
+        job_dir = self._job_dir(job_id)
+        os.makedirs(job_dir)
+        path = os.path.join(job_dir, os.path.basename(filename) or "document")
+        with open(path, "wb") as f:
+            shutil.copyfileobj(stream, f)
+        self.store.insert(job_id, filename, path, params or {})
+        self._pool.submit(self._run, job_id)
+        return job_id
+
+    def recover(self):
+        """Повторно ставит в очередь задачи, не завершённые до перезапуска, и удаляет устаревшие."""
+        self.sweep()
+        jobs = self.store.unfinished()
+        for job in jobs:
+            logger.info("Восстановление задачи %s (%s)", job["id"], job["status"])
+            self.store.update(job["id"], status=QUEUED)
+            self._pool.submit(self._run, job["id"])
+        return len(jobs)
+
+    def get(self, job_id):
+        return self.store.get(job_id)
+
+    def _job_dir(self, job_id):
+        return os.path.join(self.directory, job_id)
+
+    def _remove_upload(self, job):
+        # Удаляется только собственный каталог задачи (см. submit)
+        if os.path.dirname(job["path"]) == self._job_dir(job["id"]):
+            shutil.rmtree(self._job_dir(job["id"]), ignore_errors=True)
+
+    def sweep(self, now=None):
+        """Удаляет завершённые задачи старше ttl вместе с их каталогами. Возвращает число удалённых."""
+        if self.ttl <= 0:
+            return 0
+        now = time.time() if now is None else now
+        self._swept_at = now
+        expired = self.store.expired(now - self.ttl)
+        for job_id in expired:
+            shutil.rmtree(self._job_dir(job_id), ignore_errors=True)
+        self.store.delete(expired)
+        if expired:
+            logger.info("Удалено устаревших задач: %d", len(expired))
+        return len(expired)
+
+    def _maybe_sweep(self):
+        if time.time() - self._swept_at >= Config.JOBS_SWEEP_INTERVAL:
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.warning("Не удалось удалить устаревшие задачи: %s", e)
+
+    def wait(self, job_id, timeout=None, updated_after=None):
+        """
+        Ждёт изменения задачи (новее updated_after) или её завершения.
+        Используется для потоковой выдачи статуса; возвращает текущее состояние.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._changed:
+            while True:
+                job = self.store.get(job_id)
+                if job is None or job["status"] in FINISHED:
+                    return job
+                if updated_after is None or job["updated_at"] > updated_after:
+                    return job
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return job
+                self._changed.wait(remaining)
+
+    def _notify(self):
+        with self._changed:
+            self._changed.notify_all()
+
+    def _run(self, job_id):
+        job = self.store.get(job_id)
+        if job is None or job["status"] in FINISHED:
+            return
+        progress_state = {}
+
+        def progress(stage, done, total):
+            progress_state[stage] = {"done": done, "total": total}
+            self.store.update(job_id, progress={"stage": stage, "stages": progress_state})
+            self._notify()
+
+        self.store.update(job_id, status=RUNNING)
+        self._notify()
+        try:
+            runner = self._runner or _default_runner
+            result = runner(job["path"], progress=progress, **job["params"])
+            self.store.update(job_id, status=DONE, result=result)
+        except Exception as e:
+            logger.exception("Задача %s завершилась с ошибкой: %s", job_id, e)
+            self.store.update(job_id, status=FAILED, error=str(e))
+        finally:
+            self._remove_upload(job)
+        self._notify()
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
+
+
+def _default_runner(path, progress=None, **params):
+    from app.services import pipeline, workers
+    return pipeline.process_path(path, progress=progress, executor=workers.executor(), **params)
+
+
+def public_view(job):
+    """Состояние задачи для ответа API (без путей на диске)."""
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "filename": job["filename"],
+        "progress": job["progress"],
+        "error": job["error"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+    }
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_manager():
+    """Общий менеджер задач процесса; при создании восстанавливает незавершённые задачи."""
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                manager = JobManager()
+                manager.recover()
+                _manager = manager
+    return _manager
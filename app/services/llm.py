@@ -0,0 +1,203 @@
+import abc
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+
+from app.config import Config
+from app.utils.tracing import span
+
+logger = logging.getLogger(__name__)
+
+
+class LLMBackend(abc.ABC):
+    """Бэкенд LLM: принимает промпт, возвращает текст ответа."""
+
+    name = "base"
+
+    @abc.abstractmethod
+    def chat(self, prompt: str) -> str:
+        ...
+
+    def report(self) -> dict:
+        return {"backend": self.name}
+
+
+class _Session:
+    def __init__(self, chatbot):
+        self.chatbot = chatbot
+        self.created_at = time.monotonic()
+
+
+class HuggingChatBackend(LLMBackend):
+    """
+    HuggingChat через hugchat с пулом сессий.
+    Вход (Login) выполняется один раз, cookies переиспользуются, пока не истечёт
+    session_ttl; из них создаётся не больше pool_size ChatBot, каждый занят
+    одним запросом. Каждый запрос идёт в новом разговоре, который затем
+    удаляется: промпты разных документов и пользователей не смешиваются
+    и контекст не растёт. При ошибке запроса сессия пересоздаётся с новым
+    входом и запрос повторяется один раз.
+    """
+
+    name = "hugchat"
+
+    def __init__(self, pool_size=None, session_ttl=None):
+        self.pool_size = pool_size or Config.LLM_POOL_SIZE
+        self.session_ttl = session_ttl if session_ttl is not None else Config.LLM_SESSION_TTL
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.pool_size)
+        self._lock = threading.Lock()
+        self._cookies = None
+        self._cookies_at = 0.0
+        self._stats = {"logins": 0, "sessions": 0, "requests": 0, "refreshes": 0}
+
+    def _expired(self, created_at):
+        return self.session_ttl > 0 and time.monotonic() - created_at > self.session_ttl
+
+    def _login(self, force=False):
+        from hugchat.login import Login
+
+        with self._lock:
+            if force or self._cookies is None or self._expired(self._cookies_at):
+                email = os.environ.get('HF_EMAIL', 'your_email_here')
+                passwd = os.environ.get('HF_PASS', 'your_password_here')
+                cookie_path_dir = os.environ.get('HUGGING_CHAT_COOKIE_DIR', './cookies/')
+                cookies = Login(email, passwd).login(cookie_dir_path=cookie_path_dir, save_cookies=True)
+                self._cookies, self._cookies_at = cookies.get_dict(), time.monotonic()
+                self._stats["logins"] += 1
+            return self._cookies
+
+    def _new_session(self, force_login=False):
+        from hugchat.hugchat import ChatBot
+
+        session = _Session(ChatBot(cookies=self._login(force=force_login)))
+        with self._lock:
+            self._stats["sessions"] += 1
+        return session
+
+    def _acquire(self):
+        self._slots.acquire()
+        try:
+            while True:
+                try:
+                    session = self._idle.get_nowait()
+                except queue.Empty:
+                    return self._new_session()
+                if not self._expired(session.created_at):
+                    return session
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _release(self, session):
+        if session is not None:
+            self._idle.put(session)
+        self._slots.release()
+
+    def _ask(self, session, prompt):
+        chatbot = session.chatbot
+        conversation = chatbot.new_conversation(switch_to=True)
+        try:
+            return chatbot.chat(prompt).wait_until_done()
+        finally:
+            try:
+                chatbot.delete_conversation(conversation)
+            except Exception as e:
+                logger.warning("Не удалось удалить разговор HuggingChat: %s", e)
+
+    def chat(self, prompt: str) -> str:
+        session = self._acquire()
+        try:
+            with self._lock:
+                self._stats["requests"] += 1
+            try:
+                return self._ask(session, prompt)
+            except Exception as e:
+                logger.warning("Ошибка сессии HuggingChat, повторный вход: %s", e)
+                session = None
+                session = self._new_session(force_login=True)
+                with self._lock:
+                    self._stats["refreshes"] += 1
+                return self._ask(session, prompt)
+        except Exception:
+            session = None  # сломанная сессия не возвращается в пул
+            raise
+        finally:
+            self._release(session)
+
+    def report(self) -> dict:
+        with self._lock:
+            return {"backend": self.name, "idle_sessions": self._idle.qsize(), **self._stats}
+
+
+class StubBackend(LLMBackend):
+    """
+    Локальная заглушка для офлайн-тестов и разработки: отвечает детерминированно
+    в форматах, которые ожидают промпты анализатора. delay — имитация задержки сети.
+    """
+
+    name = "stub"
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.prompts = []
+        self._lock = threading.Lock()
+
+    def chat(self, prompt: str) -> str:
+        with self._lock:
+            self.prompts.append(prompt)
+        if self.delay:
+            time.sleep(self.delay)
+        if "Тип документа:" in prompt:
+            return json.dumps(["номер документа", "дата выдачи"], ensure_ascii=False)
+        if "document_count" in prompt:
+            return json.dumps({"document_count": 1})
+        lines = [line for line in prompt.splitlines() if line.strip()]
+        text = lines[-1] if lines else ""
+        words = re.findall(r"\w+", text)
+        return json.dumps({
+            "document_type": "unknown",
+            "title": " ".join(words[:5]) or None,
+            "author": None,
+            "date": None,
+            "summary": None,
+            "keywords": words[:5],
+            "full_text": text,
+        }, ensure_ascii=False)
+
+
+BACKENDS = {"hugchat": HuggingChatBackend, "stub": StubBackend}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend() -> LLMBackend:
+    """Общий бэкенд процесса (Config.LLM_BACKEND), создаётся при первом обращении."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if Config.LLM_BACKEND not in BACKENDS:
+                    raise ValueError(f"Неизвестный LLM-бэкенд: {Config.LLM_BACKEND}")
+                _backend = BACKENDS[Config.LLM_BACKEND]()
+    return _backend
+
+
+def set_backend(backend: LLMBackend) -> None:
+    """Подменяет бэкенд процесса (тесты, собственные интеграции)."""
+    global _backend
+    with _backend_lock:
+        _backend = backend
+
+
+def chat(prompt: str) -> str:
+    backend = get_backend()
+    with span("llm.chat", backend=backend.name, prompt_chars=len(prompt)) as sp:
+        response = backend.chat(prompt)
+        sp.set(response_chars=len(response or ""))
+    return response
@@ -0,0 +1,167 @@
+import contextlib
+import logging
+import threading
+import time
+
+from app.config import Config
+from app.services import inference
+from app.utils.memory import current_rss
+
+logger = logging.getLogger(__name__)
+
+
+class ModelRegistry:
+    """
+    Общий реестр моделей: каждая модель создаётся один раз, при первом
+    обращении, под собственной блокировкой. Для каждой модели запоминается
+    время загрузки и прирост RSS процесса.
+    """
+
+    def __init__(self):
+        self._loaders = {}
+        self._models = {}
+        self._locks = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, loader):
+        with self._lock:
+            self._loaders[name] = loader
+            self._locks.setdefault(name, threading.Lock())
+
+    def get(self, name):
+        model = self._models.get(name)
+        if model is not None:
+            return model
+        if name not in self._loaders:
+            raise KeyError(f"Модель не зарегистрирована: {name}")
+        with self._locks[name]:
+            if name not in self._models:
+                self._models[name] = self._load(name)
+        return self._models[name]
+
+    def _load(self, name):
+        logger.info("Загрузка модели %s", name)
+        rss_before, started = current_rss(), time.perf_counter()
+        model = self._loaders[name]()
+        self._stats[name] = {
+            "load_seconds": round(time.perf_counter() - started, 3),
+            "rss_delta_mb": round((current_rss() - rss_before) / 2 ** 20, 1),
+        }
+        logger.info("Модель %s загружена за %.1f с (+%.0f МБ)", name,
+                    self._stats[name]["load_seconds"], self._stats[name]["rss_delta_mb"])
+        return model
+
+    def is_loaded(self, name):
+        return name in self._models
+
+    def names(self):
+        return list(self._loaders)
+
+    def warm_up(self, names=None):
+        """Загружает модели заранее (по умолчанию все) и возвращает отчёт."""
+        for name in names or self.names():
+            try:
+                self.get(name)
+            except Exception as e:
+                logger.exception("Не удалось загрузить модель %s: %s", name, e)
+        return self.report()
+
+    def warm_up_in_background(self, names=None):
+        """Прогрев в фоновом потоке: сервис отвечает на health-запросы, пока модели грузятся."""
+        thread = threading.Thread(target=self.warm_up, args=(names,), name="models-warmup", daemon=True)
+        thread.start()
+        return thread
+
+    def ready(self, names=None):
+        return all(self.is_loaded(name) for name in names or self.names())
+
+    def report(self):
+        """{модель: {"loaded", "load_seconds", "rss_delta_mb"}}"""
+        return {
+            name: {"loaded": self.is_loaded(name), **self._stats.get(name, {})}
+            for name in self.names()
+        }
+
+    def unload(self, name=None):
+        """Выгружает модель (или все) — для тестов и освобождения памяти."""
+        for key in [name] if name else self.names():
+            with self._locks[key]:
+                self._models.pop(key, None)
+                self._stats.pop(key, None)
+
+
+def _load_easyocr():
+    import easyocr
+    inference.configure()
+    # quantize — собственное динамическое квантование распознавателя EasyOCR на CPU
+    return easyocr.Reader(['ru', 'en'], gpu=False, quantize=inference.is_quantized("easyocr"))
+
+
+def _load_doctr():
+    from doctr.models import ocr_predictor
+    inference.configure()
+    predictor = ocr_predictor(
+        det_arch='db_resnet50', reco_arch='crnn_vgg16_bn', detect_language=True, pretrained=True,
+        det_bs=Config.DOCTR_DET_BATCH_SIZE, reco_bs=Config.DOCTR_RECO_BATCH_SIZE,
+    )
+    if inference.is_quantized("docTR"):
+        # Квантуется только распознавание (LSTM и Linear в CRNN); детектор — свёрточный
+        predictor.reco_predictor.model = inference.quantize_dynamic(predictor.reco_predictor.model)
+    return predictor
+
+
+@contextlib.contextmanager
+def _allow_pickled_weights():
+    """
+    Веса YOLO в Shiftlab сохранены целиком (pickle), а torch>=2.6 по умолчанию
+    грузит с weights_only=True. Разрешаем это только на время загрузки Shiftlab.
+    """
+    import torch
+    from shiftlab_ocr.doc2text.yolov5.models.yolo import Model
+
+    torch.serialization.add_safe_globals([Model])
+    original_load = torch.load
+
+    def patched_load(*args, **kwargs):
+        kwargs['weights_only'] = False
+        return original_load(*args, **kwargs)
+
+    torch.load = patched_load
+    try:
+        yield
+    finally:
+        torch.load = original_load
+
+
+def _load_shiftlab():
+    from shiftlab_ocr.doc2text.reader import Reader
+    inference.configure()
+    with _allow_pickled_weights():
+        return Reader()
+
+
+registry = ModelRegistry()
+registry.register("easyocr", _load_easyocr)
+registry.register("docTR", _load_doctr)
+registry.register("shiftlab", _load_shiftlab)
+
+
+def get_easyocr_reader():
+    return registry.get("easyocr")
+
+
+def get_doctr_model():
+    return registry.get("docTR")
+
+
+def get_shiftlab_reader():
+    return registry.get("shiftlab")
+
+
+def warm_up(names=None):
+    return registry.warm_up(names)
+
+
+def warm_up_in_background(names=None):
+    return registry.warm_up_in_background(names)
@@ -1,104 +1,513 @@
 import logging
 import os
-from difflib import SequenceMatcher
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
-import easyocr
-from doctr.models import ocr_predictor
-from doctr.io import DocumentFile
-from shiftlab_ocr.doc2text.reader import Reader
+import cv2
+import numpy as np
+from PIL import Image
 
-# Логирование
-logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
-handler = logging.StreamHandler()
-formatter = logging.Formatter('[%(asctime)s] %(levelname)s in %(module)s: %(message)s')
-handler.setFormatter(formatter)
-logger.addHandler(handler)
+from app.config import Config
+from app.services import cache, fusion, inference, models
+from app.services.preprocessor import BlockContext
+from app.utils.tracing import span
 
-# Модели
-doctr_model = ocr_predictor(det_arch='db_resnet50', reco_arch='crnn_vgg16_bn', detect_language=True, pretrained=True)
-easyocr_reader = easyocr.Reader(['ru', 'en'], gpu=False)
+# Логирование (обработчики настраивает app.utils.logger.setup_logging)
+logger = logging.getLogger(__name__)
 
 
 def visualize_ocr(lines, confidences, title="OCR"):
     html = f"<h4>{title}</h4><pre>"
     for line, conf in zip(lines, confidences):
-        color = "#00cc44" if conf > 0.85 else "#ffaa00" if conf > 0.6 else "#ff3333"
+        if conf is None:
+            color = "#888888"
+        else:
+            color = "#00cc44" if conf > 0.85 else "#ffaa00" if conf > 0.6 else "#ff3333"
         html += f"<span style='color:{color}'>{line}</span>\n"
     html += "</pre>"
     return html
 
 
 def merge_ocr_results(texts):
-    texts = [t for t in texts if t and t.strip()]
-    if not texts:
-        return None
-    if len(texts) == 1:
-        return texts[0]
+    """Объединяет тексты нескольких движков в один согласованный (без построчных уверенностей)."""
+    return fusion.fuse([(f"text{i}", text, [], []) for i, text in enumerate(texts)])
 
-    unique = []
-    for t in texts:
-        if all(SequenceMatcher(None, t, u).ratio() < 0.85 for u in unique):
-            unique.append(t)
 
-    best = max(unique, key=len)
+ENGINE_LABELS = {"docTR": "docTR", "easyocr": "EasyOCR", "shiftlab": "Shiftlab OCR"}
 
-    merged = best
-    for other in unique:
-        if other != best:
-            merged += "\n\n--- OCR вариант ---\n\n" + other
+# Движки, которые умеют обрабатывать пакет блоков за один вызов модели
+BATCHED_ENGINES = ("docTR", "easyocr")
 
-    return merged
 
+def _load_image(img):
+    """Путь к файлу или np.ndarray (BGR) -> np.ndarray (BGR)."""
+    if isinstance(img, np.ndarray):
+        return img
+    image = cv2.imread(img)
+    if image is None:
+        raise ValueError(f"Не удалось прочитать изображение: {img}")
+    return image
 
-def extract_text_from_pages(file_obj):
-    image_paths = file_obj
 
-    full_texts = []
-    ocr_details = {"docTR": "", "easyocr": "", "shiftlab": "", "visual": ""}
+def _doctr_page_result(page):
+    """
+    Строки docTR и их уверенности: среднее уверенностей слов из export()
+    (None, если у слов строки уверенностей нет).
+    """
+    lines, confidences = [], []
+    for block in page['blocks']:
+        for line in block['lines']:
+            text = " ".join([w['value'] for w in line['words']])
+            lines.append(text)
+            word_conf = [w['confidence'] for w in line['words'] if w.get('confidence') is not None]
+            confidences.append(sum(word_conf) / len(word_conf) if word_conf else None)
+    return "\n".join(lines), lines, confidences
 
-    for idx, img_path in enumerate(image_paths):
-        logger.info("Обрабатываю страницу %d/%d", idx + 1, len(image_paths))
 
-        doctr_text, doctr_lines, doctr_conf = None, [], []
-        easy_text, easy_lines, easy_conf = None, [], []
-        shiftlab_text = None
+def run_doctr(images):
+    """docTR: один вызов предиктора на весь список блоков -> [(текст, строки, уверенности)]."""
+    pages = [cv2.cvtColor(_load_image(img), cv2.COLOR_BGR2RGB) for img in images]
+    predictor = models.get_doctr_model()
+    with inference.inference_mode():
+        result = predictor(pages)
+    return [_doctr_page_result(page) for page in result.export()['pages']]
 
-        # docTR
-        try:
-            doc = DocumentFile.from_images(img_path)
-            result = doctr_model(doc)
-            for page in result.export()['pages']:
-                for block in page['blocks']:
-                    for line in block['lines']:
-                        text = " ".join([w['value'] for w in line['words']])
-                        doctr_lines.append(text)
-                        doctr_conf.append(min(len(text) / 80, 1.0))
-            doctr_text = "\n".join(doctr_lines)
-        except Exception as e:
-            logger.exception("Ошибка docTR: %s", e)
 
-        # EasyOCR
-        try:
-            results = easyocr_reader.readtext(img_path, detail=1)
-            easy_lines = [txt for _, txt, _ in results]
-            easy_conf = [conf for _, _, conf in results]
-            easy_text = "\n".join(easy_lines)
-        except Exception as e:
-            logger.exception("Ошибка EasyOCR: %s", e)
+def _easyocr_result(items):
+    lines = [txt for _, txt, _ in items]
+    confidences = [conf for _, _, conf in items]
+    return "\n".join(lines), lines, confidences
+
+
+def _pad_to_canvas(images):
+    """
+    readtext_batched требует изображения одного размера: дополняем блоки
+    белым полем справа и снизу, координаты текста при этом не меняются.
+    """
+    height = max(img.shape[0] for img in images)
+    width = max(img.shape[1] for img in images)
+    padded = []
+    for img in images:
+        if img.ndim == 2:
+            img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+        canvas = np.full((height, width, 3), 255, dtype=np.uint8)
+        canvas[:img.shape[0], :img.shape[1]] = img
+        padded.append(canvas)
+    return padded
+
+
+def run_easyocr(images):
+    """EasyOCR: пакетное распознавание через readtext_batched -> [(текст, строки, уверенности)]."""
+    easyocr_reader = models.get_easyocr_reader()
+    if len(images) == 1:
+        with inference.inference_mode():
+            return [_easyocr_result(easyocr_reader.readtext(images[0], detail=1))]
+    padded = _pad_to_canvas([_load_image(img) for img in images])
+    with inference.inference_mode():
+        batches = easyocr_reader.readtext_batched(padded, detail=1, batch_size=Config.EASYOCR_RECOGNITION_BATCH)
+    return [_easyocr_result(items) for items in batches]
+
+
+def _shiftlab_doc2text(shiftlab_reader, image):
+    """
+    Reader.doc2text принимает только путь к файлу; для np.ndarray повторяем
+    его шаги (детекция YOLO, сортировка фрагментов, распознавание) в памяти.
+    """
+    if not isinstance(image, np.ndarray):
+        return shiftlab_reader.doc2text(image)
+    from shiftlab_ocr.doc2text.crop import Crop
+
+    pil_image = Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+    data = shiftlab_reader.detector.model([pil_image]).pandas().xyxy[0]
+    crops = []
+    for i in range(data.shape[0]):
+        box = (data['xmin'][i], data['ymin'][i], data['xmax'][i], data['ymax'][i])
+        crops.append(Crop([[box[0], box[1]], [box[2], box[3]]], img=pil_image.crop(box)))
+    crops = sorted(crops)
+    lines = [shiftlab_reader.recognizer.run(crop.img) for crop in crops]
+    text = ''.join(line + ' ' for line in lines)
+    return text, crops, lines
+
+
+def run_shiftlab(images):
+    """
+    Shiftlab OCR: по одному блоку -> [(текст, строки, [])]. Строки (фрагменты YOLO)
+    есть только для блоков в памяти; построчных уверенностей нет.
+    """
+    shiftlab_reader = models.get_shiftlab_reader()
+    results = []
+    for image in images:
+        with inference.inference_mode():
+            result = _shiftlab_doc2text(shiftlab_reader, image)
+        lines = list(result[2]) if result and len(result) > 2 else []
+        results.append(((result[0].strip() if result else ""), lines, []))
+    return results
 
-        # Shiftlab OCR
+
+ENGINES = (("docTR", run_doctr), ("easyocr", run_easyocr), ("shiftlab", run_shiftlab))
+
+EMPTY_RESULT = (None, [], [])
+
+
+def plan_batches(shapes, batch_size, memory_cap, padded=False):
+    """
+    Делит блоки на пакеты: не больше batch_size блоков и не больше memory_cap
+    байт на пакет (для padded=True считается общий холст max(h) x max(w)).
+    Блоки сортируются по размеру, чтобы дополнение тратило меньше памяти.
+    Возвращает списки индексов в исходной нумерации.
+    """
+    order = sorted(range(len(shapes)), key=lambda i: (shapes[i][0], shapes[i][1], i))
+    batches, current = [], []
+    max_h = max_w = total = 0
+    for idx in order:
+        h, w = shapes[idx][:2]
+        if padded:
+            cost = (len(current) + 1) * max(max_h, h) * max(max_w, w) * 3
+        else:
+            cost = total + h * w * 3
+        if current and (len(current) >= batch_size or cost > memory_cap):
+            batches.append(current)
+            current, max_h, max_w, total = [], 0, 0, 0
+        current.append(idx)
+        max_h, max_w, total = max(max_h, h), max(max_w, w), total + h * w * 3
+    if current:
+        batches.append(current)
+    return batches
+
+
+def _plan_tasks(images, batched, skip=None):
+    """
+    Список задач (движок, индексы блоков) в детерминированном порядке.
+    skip — {движок: индексы блоков, для которых результат уже есть}.
+    """
+    skip = skip or {}
+    if not batched:
+        return [
+            (name, [idx])
+            for idx in range(len(images)) for name, _ in ENGINES
+            if idx not in skip.get(name, ())
+        ]
+    memory_cap = Config.OCR_BATCH_MEMORY_MB * 1024 * 1024
+    tasks = []
+    for name, _ in ENGINES:
+        indices = [idx for idx in range(len(images)) if idx not in skip.get(name, ())]
+        if name in BATCHED_ENGINES:
+            shapes = [images[idx].shape for idx in indices]
+            for batch in plan_batches(shapes, Config.OCR_BATCH_SIZE, memory_cap, padded=(name == "easyocr")):
+                tasks.append((name, [indices[i] for i in batch]))
+        else:
+            tasks.extend((name, [idx]) for idx in indices)
+    return tasks
+
+
+def _reused_easyocr_result(block):
+    """Результат EasyOCR из первого прохода split_image_by_ocr (если он был полным)."""
+    if not isinstance(block, BlockContext) or not block.page.recognized:
+        return None
+    return _easyocr_result(block.detections)
+
+
+def _block_digest(img):
+    """Хэш блока (массив или PNG на диске); None — блок нельзя прочитать, кэш не используется."""
+    if isinstance(img, np.ndarray):
+        return cache.digest(img)
+    if isinstance(img, str) and os.path.isfile(img):
+        return cache.file_digest(img)
+    return None
+
+
+def _ocr_cache_keys(images):
+    """{(индекс блока, движок): ключ кэша} — у каждого движка свой ключ."""
+    keys = {}
+    for idx, img in enumerate(images):
+        block_digest = _block_digest(img)
+        if block_digest is None:
+            continue
+        for name, _ in ENGINES:
+            keys[idx, name] = cache.stage_key("ocr", name, inference.variant(name), block_digest)
+    return keys
+
+
+def _run_engine_safe(name, images):
+    """
+    Запускает движок на пакете блоков. Если пакетный вызов упал,
+    повторяет по одному блоку, чтобы ошибка одного блока не гасила остальные.
+    """
+    engine = dict(ENGINES)[name]
+    with span(f"ocr.{name}", blocks=len(images)) as sp:
         try:
-            shiftlab_reader = Reader()
-            result = shiftlab_reader.doc2text(img_path)
-            shiftlab_text = result[0].strip() if result else ""
+            results = engine(images)
+            if len(results) != len(images):
+                raise RuntimeError(f"ожидалось {len(images)} результатов, получено {len(results)}")
+            return results
         except Exception as e:
-            logger.exception("Ошибка Shiftlab OCR: %s", e)
+            sp.set(failures=1)
+            logger.exception("Ошибка %s: %s", ENGINE_LABELS[name], e)
+    if len(images) == 1:
+        return [EMPTY_RESULT]
+    return [_run_engine_safe(name, [img])[0] for img in images]
+
+
+def is_confident(result, threshold=None) -> bool:
+    """
+    Достаточно ли результата движка для блока: есть строки и уверенность
+    каждой строки не ниже threshold (по умолчанию Config.OCR_CASCADE_THRESHOLD).
+    Результат без построчных уверенностей (Shiftlab) уверенным не считается.
+    """
+    if result is None:
+        return False
+    threshold = Config.OCR_CASCADE_THRESHOLD if threshold is None else threshold
+    text, lines, confidences = result
+    if not text or not lines or len(confidences) < len(lines):
+        return False
+    return all(conf is not None and conf >= threshold for conf in confidences[:len(lines)])
+
+
+def _cascade_order():
+    """Движки в порядке каскада: Config.OCR_CASCADE_ORDER, затем остальные из ENGINES."""
+    names = [name for name, _ in ENGINES]
+    order = [name for name in Config.OCR_CASCADE_ORDER if name in names]
+    return order + [name for name in names if name not in order]
+
+
+def _run_cascade(count, reused, run, progress=None):
+    """
+    Каскад движков: сначала самый быстрый движок на всех блоках, следующий —
+    только на блоках, где предыдущие не уверены (is_confident), и так далее.
+    Уже готовые результаты (кэш, первый проход EasyOCR) участвуют в проверке
+    и не пересчитываются. run(skip, progress) выполняет задачи по словарю пропусков.
+    Для непрогнанных движков возвращается EMPTY_RESULT (в объединении не участвует).
+    """
+    names = [name for name, _ in ENGINES]
+    pending = {
+        idx for idx in range(count)
+        if not any(is_confident(reused.get((idx, name))) for name in names)
+    }
+    results = {}
+    offset = 0
+    for name in _cascade_order():
+        if not pending:
+            break
+        skip = {other: set(range(count)) for other in names if other != name}
+        skip[name] = {idx for idx in range(count) if idx not in pending or (idx, name) in reused}
+        planned = [0]
+
+        def stage_progress(stage, done, total, offset=offset, planned=planned):
+            planned[0] = total
+            if progress:
+                progress(stage, offset + done, offset + total)
+
+        with span(f"ocr.cascade.{name}", blocks=len(pending)):
+            results.update(run(skip, stage_progress))
+        offset += planned[0]
+        pending = {
+            idx for idx in pending
+            if not is_confident(results.get((idx, name)) or reused.get((idx, name)))
+        }
+    for idx in range(count):
+        for name in names:
+            results.setdefault((idx, name), EMPTY_RESULT)
+    return results
+
+
+def _run_tasks_sequential(tasks, inputs, progress=None):
+    results = {}
+    for done, (name, indices) in enumerate(tasks, start=1):
+        logger.info("%s: блоки %s", ENGINE_LABELS[name], ", ".join(str(i + 1) for i in indices))
+        outputs = _run_engine_safe(name, [inputs[name][i] for i in indices])
+        for idx, output in zip(indices, outputs):
+            results[idx, name] = output
+        if progress:
+            progress("ocr", done, len(tasks))
+    return results
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _get_pool(max_workers: int) -> ThreadPoolExecutor:
+    """
+    Общий ограниченный пул потоков OCR (один на размер): потоки не создаются
+    на каждый документ, а зависшая задача занимает не больше одного потока пула.
+    """
+    with _pools_lock:
+        pool = _pools.get(max_workers)
+        if pool is None:
+            pool = _pools[max_workers] = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ocr")
+        return pool
+
+
+def _reset_pools():
+    # Потоки пула не переживают fork: в дочернем процессе пулы создаются заново
+    global _pools_lock
+    _pools.clear()
+    _pools_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_pools)
+
+
+def _run_tasks_concurrent(tasks, inputs, max_workers, timeouts, progress=None):
+    """
+    Запускает все задачи (движок, пакет блоков) в общем ограниченном пуле потоков.
+    Движки одного блока идут параллельно, блоки перекрываются между собой.
+    Таймаут движка задан на один блок: срок движка — таймаут, умноженный на число
+    его блоков, от начала всего пакета задач. Незавершённые к сроку задачи
+    отменяются или (уже запущенные) помечаются пустым результатом —
+    сам поток прервать нельзя.
+    """
+    started = time.monotonic()
+    counts = {}
+    for name, indices in tasks:
+        counts[name] = counts.get(name, 0) + len(indices)
+    deadlines = {name: started + timeouts[name] * count
+                 for name, count in counts.items() if timeouts.get(name) is not None}
+
+    pool = _get_pool(max_workers)
+    submitted = {
+        pool.submit(_run_engine_safe, name, [inputs[name][i] for i in indices]): (name, indices)
+        for name, indices in tasks
+    }
+    results = {}
+
+    def finish(future, outputs):
+        name, indices = submitted[future]
+        for idx, output in zip(indices, outputs):
+            results[idx, name] = output
+        if progress:
+            progress("ocr", len(submitted) - len(pending), len(submitted))
+
+    def expired(future, now):
+        name = submitted[future][0]
+        return name in deadlines and deadlines[name] <= now
+
+    pending = set(submitted)
+    while pending:
+        now = time.monotonic()
+        for future in [f for f in pending if expired(f, now)]:
+            name, indices = submitted[future]
+            future.cancel()
+            logger.warning("%s: таймаут %g с на блоках %s", ENGINE_LABELS[name], timeouts[name],
+                           ", ".join(str(i + 1) for i in indices))
+            pending.discard(future)
+            finish(future, [EMPTY_RESULT] * len(indices))
+        if not pending:
+            break
+        waiting = [deadlines[submitted[f][0]] for f in pending if submitted[f][0] in deadlines]
+        done, _ = wait(pending, timeout=max(0.0, min(waiting) - now) if waiting else None,
+                       return_when=FIRST_COMPLETED)
+        for future in done:
+            pending.discard(future)
+            finish(future, future.result())
+    return results
+
+
+def extract_text_from_pages(file_obj, concurrent=None, max_workers=None, timeouts=None, batched=None,
+                            reuse_detection=None, use_cache=None, progress=None, cascade=None):
+    """
+    Прогоняет блоки через docTR, EasyOCR и Shiftlab и объединяет результат.
+    file_obj — список путей/изображений или BlockContext из normalize_file(with_context=True).
+    concurrent — параллельный режим (по умолчанию Config.OCR_CONCURRENT),
+    max_workers — размер пула, timeouts — {движок: секунды на блок},
+    batched — пакетный режим docTR/EasyOCR (по умолчанию Config.OCR_BATCHED),
+    reuse_detection — брать результат EasyOCR из первого прохода разбиения
+    (по умолчанию Config.OCR_REUSE_SPLIT_RESULTS),
+    use_cache — брать результаты движков из кэша по хэшу блока
+    (по умолчанию Config.CACHE_ENABLED),
+    progress — необязательный callback(этап, готово, всего) по мере выполнения задач,
+    cascade — запускать движки каскадом (по умолчанию Config.OCR_CASCADE): следующий
+    движок только для блоков, где уверенность предыдущих ниже Config.OCR_CASCADE_THRESHOLD.
+    Без каскада порядок блоков и содержимое ocr_details не зависят от режима.
+    """
+    blocks = list(file_obj)
+    image_paths = [block.image if isinstance(block, BlockContext) else block for block in blocks]
+    if concurrent is None:
+        concurrent = Config.OCR_CONCURRENT
+    if batched is None:
+        batched = Config.OCR_BATCHED
+    if reuse_detection is None:
+        reuse_detection = Config.OCR_REUSE_SPLIT_RESULTS
+    if use_cache is None:
+        use_cache = Config.CACHE_ENABLED
+    if cascade is None:
+        cascade = Config.OCR_CASCADE
+
+    # Страницы из текстового слоя PDF: текст уже есть, движки для них не запускаются
+    text_layer = {
+        idx: block.page.text_layer for idx, block in enumerate(blocks)
+        if isinstance(block, BlockContext) and block.page.text_layer is not None
+    }
+    reused = {(idx, name): EMPTY_RESULT for idx in text_layer for name, _ in ENGINES}
+    if reuse_detection:
+        for idx, block in enumerate(blocks):
+            result = _reused_easyocr_result(block)
+            if result is not None and idx not in text_layer:
+                reused[idx, "easyocr"] = result
+
+    cache_keys = _ocr_cache_keys(image_paths) if use_cache and cache.store.enabled else {}
+    for task_key, key in cache_keys.items():
+        if task_key not in reused:
+            result = cache.store.get("ocr", key)
+            if result is not None:
+                reused[task_key] = result
+    skip = {}
+    for idx, name in reused:
+        skip.setdefault(name, set()).add(idx)
+
+    # В пакетном режиме декодируем блоки один раз и отдаём массивы docTR и EasyOCR
+    # (блоки из конвейера в памяти уже являются массивами и не декодируются вовсе)
+    inputs = {name: image_paths for name, _ in ENGINES}
+    plan_images = image_paths
+    if batched and image_paths:
+        plan_images = [None if idx in text_layer else _load_image(img) for idx, img in enumerate(image_paths)]
+        inputs.update({name: plan_images for name in BATCHED_ENGINES})
+
+    def run(skip, progress):
+        tasks = _plan_tasks(plan_images, batched=batched and bool(image_paths), skip=skip)
+        with span("ocr.engines", blocks=len(image_paths), tasks=len(tasks), reused=len(reused)):
+            if concurrent:
+                return _run_tasks_concurrent(
+                    tasks,
+                    inputs,
+                    max_workers or Config.OCR_MAX_WORKERS,
+                    {**Config.OCR_ENGINE_TIMEOUTS, **(timeouts or {})},
+                    progress,
+                )
+            return _run_tasks_sequential(tasks, inputs, progress)
+
+    if cascade:
+        engine_results = _run_cascade(len(image_paths), reused, run, progress)
+    else:
+        engine_results = run(skip, progress)
+    for task_key, result in engine_results.items():
+        # Ошибки и таймауты (текст None) не кэшируются
+        if task_key in cache_keys and result[0] is not None:
+            cache.store.put("ocr", cache_keys[task_key], result)
+    engine_results.update(reused)
+
+    page_texts = {}
+    ocr_details = {"docTR": "", "easyocr": "", "shiftlab": "", "visual": ""}
+
+    for idx in range(len(image_paths)):
+        doctr_text, doctr_lines, doctr_conf = engine_results[idx, "docTR"]
+        easy_text, easy_lines, easy_conf = engine_results[idx, "easyocr"]
+        shiftlab_text, shiftlab_lines, shiftlab_conf = engine_results[idx, "shiftlab"]
 
-        # Объединение
-        final_page_text = merge_ocr_results([doctr_text, shiftlab_text, easy_text])
+        # Объединение: построчное выравнивание и голосование по словам
+        if idx in text_layer:
+            final_page_text = text_layer[idx]
+        else:
+            with span("ocr.merge", blocks=1):
+                final_page_text = fusion.fuse([
+                    ("docTR", doctr_text, doctr_lines, doctr_conf),
+                    ("easyocr", easy_text, easy_lines, easy_conf),
+                    ("shiftlab", shiftlab_text, shiftlab_lines, shiftlab_conf),
+                ])
         if final_page_text:
-            full_texts.append(final_page_text)
+            page = blocks[idx].page.page_index if isinstance(blocks[idx], BlockContext) else 0
+            page_texts.setdefault(page, []).append(final_page_text)
 
         # Визуализация
         visual_html = ""
@@ -112,7 +521,8 @@ def extract_text_from_pages(file_obj):
         ocr_details["shiftlab"] += shiftlab_text or ""
         ocr_details["visual"] += visual_html
 
-    final_document_text = " ".join(full_texts)
+    # Блоки — абзацы, страницы разделяются \f: по этим границам analyzer режет длинный текст
+    final_document_text = "\f".join("\n\n".join(texts) for _, texts in sorted(page_texts.items()))
     logger.info("OCR обработка завершена")
 
     return final_document_text, ocr_details
@@ -0,0 +1,124 @@
+import logging
+from collections import deque
+
+from app.config import Config
+from app.services import analyzer, ocr, preprocessor
+from app.utils.tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Этапы обработки документа в порядке выполнения (для отчёта о прогрессе)
+STAGES = ("normalize", "ocr", "analysis")
+
+
+def _extract_by_pages(blocks, executor, progress=None):
+    """
+    OCR по страницам в executor (пул обработчиков app.services.workers или потоков):
+    тот же результат, что у ocr.extract_text_from_pages для всех блоков сразу.
+    """
+    pages = {}
+    for block in blocks:
+        pages.setdefault(block.page.page_index, []).append(block)
+    futures = [executor.submit(ocr.extract_text_from_pages, page_blocks) for _, page_blocks in sorted(pages.items())]
+    texts = []
+    ocr_details = {"docTR": "", "easyocr": "", "shiftlab": "", "visual": ""}
+    for done, future in enumerate(futures, 1):
+        text, details = future.result()
+        if text:
+            texts.append(text)
+        for key in ocr_details:
+            ocr_details[key] += details.get(key, "")
+        if progress:
+            progress("ocr", done, len(futures))
+    return "\f".join(texts), ocr_details
+
+
+def process_document(file_obj, profile=None, progress=None, executor=None) -> dict:
+    """
+    Полный конвейер для одного документа: нормализация, OCR, анализ LLM.
+    file_obj — открытый файл (по расширению .name определяется PDF) или file-like объект.
+    progress — необязательный callback(этап, готово, всего).
+    executor — пул для OCR страниц (например, app.services.workers); без него OCR
+    идёт в текущем процессе.
+    Возвращает {"text", "ocr", "analysis"}; analysis равен None, если текст не извлечён.
+    """
+    with span("document") as sp:
+        blocks = preprocessor.normalize_file(file_obj, with_context=True, profile=profile, progress=progress)
+        sp.set(pages=len({block.page.page_index for block in blocks}), blocks=len(blocks))
+        try:
+            with span("ocr", blocks=len(blocks)):
+                if executor is None:
+                    text, ocr_details = ocr.extract_text_from_pages(blocks, progress=progress)
+                else:
+                    text, ocr_details = _extract_by_pages(blocks, executor, progress)
+        finally:
+            # PNG блоков (режим на диске) нужны только для OCR
+            preprocessor.cleanup_blocks(blocks)
+        if not text:
+            logger.warning("Не удалось извлечь текст")
+            return {"text": "", "ocr": ocr_details, "analysis": None}
+
+        if progress:
+            progress("analysis", 0, 1)
+        with span("analysis", chars=len(text)):
+            analysis = analyzer.process_document_pipeline(text)
+        if progress:
+            progress("analysis", 1, 1)
+        return {"text": text, "ocr": ocr_details, "analysis": analysis}
+
+
+def process_path(path, profile=None, progress=None, executor=None) -> dict:
+    with open(path, "rb") as f:
+        return process_document(f, profile=profile, progress=progress, executor=executor)
+
+
+def iter_document(file_obj, profile=None, executor=None):
+    """
+    Потоковый конвейер для интерфейса: события по мере готовности.
+    {"event": "page", "page", "blocks", "text", "ocr"} — страница распознана (в порядке страниц);
+    {"event": "text", "text"} — весь текст документа, начинается анализ;
+    {"event": "analysis", "text", "analysis"} — результат анализа (None, если текста нет).
+    executor — общий пул (потоков или обработчиков app.services.workers): OCR страницы идёт в нём, пока нормализуется
+    следующая (не больше Config.PDF_MAX_PAGES_IN_MEMORY страниц в работе);
+    без пула страницы распознаются по очереди в текущем потоке.
+    """
+    page_texts = []
+    pending = deque()
+    max_pending = max(1, Config.PDF_MAX_PAGES_IN_MEMORY)
+
+    def page_event(page_index, blocks, result):
+        text, ocr_details = result
+        if text:
+            page_texts.append(text)
+        return {"event": "page", "page": page_index, "blocks": blocks, "text": text, "ocr": ocr_details}
+
+    # Участки трассировки не охватывают yield: генератор могут продолжать разные потоки
+    written = []
+    try:
+        for page_index, blocks in preprocessor.iter_normalized_pages(file_obj, profile=profile):
+            written.extend(blocks)
+            if executor is None:
+                yield page_event(page_index, blocks, ocr.extract_text_from_pages(blocks))
+                continue
+            pending.append((page_index, blocks, executor.submit(ocr.extract_text_from_pages, blocks)))
+            while pending and (pending[0][2].done() or len(pending) >= max_pending):
+                page_index, blocks, future = pending.popleft()
+                yield page_event(page_index, blocks, future.result())
+        while pending:
+            page_index, blocks, future = pending.popleft()
+            yield page_event(page_index, blocks, future.result())
+    finally:
+        # PNG блоков (режим на диске) удаляются, когда все страницы распознаны и показаны
+        for _, _, future in pending:
+            future.cancel()
+        preprocessor.cleanup_blocks(written)
+
+    text = "\f".join(page_texts)
+    if not text:
+        logger.warning("Не удалось извлечь текст")
+        yield {"event": "analysis", "text": "", "analysis": None}
+        return
+    yield {"event": "text", "text": text}
+    with span("analysis", chars=len(text)):
+        analysis = analyzer.process_document_pipeline(text)
+    yield {"event": "analysis", "text": text, "analysis": analysis}
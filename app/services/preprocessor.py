@@ -1,13 +1,98 @@
 import os
+import shutil
+import subprocess
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import cv2
 import numpy as np
-from tempfile import NamedTemporaryFile
-from typing import List
-from pdf2image import convert_from_path
-import easyocr
+from dataclasses import dataclass, field
+from tempfile import NamedTemporaryFile, mkdtemp
+from typing import Iterator, Optional, Tuple
+from pdf2image import convert_from_path, pdfinfo_from_path
+
+from app.config import Config
+from app.services import cache, models
+from app.utils.tracing import span
+
+# -----------------------------------------------------------------------------
+#                          Тайловое выполнение локальных фильтров
+# -----------------------------------------------------------------------------
+
+_tile_pool = None
+_tile_pool_lock = threading.Lock()
+
+
+def _get_tile_pool() -> ThreadPoolExecutor:
+    """Общий пул для тайлов: OpenCV отпускает GIL, поэтому потоки загружают все ядра."""
+    global _tile_pool
+    if _tile_pool is None:
+        with _tile_pool_lock:
+            if _tile_pool is None:
+                _tile_pool = ThreadPoolExecutor(max_workers=Config.PREPROCESS_TILE_WORKERS,
+                                                thread_name_prefix="tile")
+    return _tile_pool
+
+
+def _reset_tile_pool():
+    # Потоки пула не переживают fork: в дочернем процессе пул создаётся заново
+    global _tile_pool
+    _tile_pool = None
+
+
+os.register_at_fork(after_in_child=_reset_tile_pool)
+
+
+def tile_grid(shape, tile_size: int, halo: int):
+    """
+    Разбиение на тайлы: [(область тайла с полями, область результата)],
+    области — (y0, y1, x0, x1). Поля halo по краям изображения обрезаются.
+    """
+    height, width = shape[:2]
+    tiles = []
+    for y in range(0, height, tile_size):
+        for x in range(0, width, tile_size):
+            core = (y, min(y + tile_size, height), x, min(x + tile_size, width))
+            padded = (max(0, core[0] - halo), min(height, core[1] + halo),
+                      max(0, core[2] - halo), min(width, core[3] + halo))
+            tiles.append((padded, core))
+    return tiles
+
+
+def run_tiled(func, image: np.ndarray, halo: int = 0, tile_size: Optional[int] = None,
+              overlap: Optional[int] = None, workers: Optional[int] = None) -> np.ndarray:
+    """
+    Выполняет локальный фильтр func по перекрывающимся тайлам параллельно.
+    halo — радиус окрестности фильтра: тайл обрабатывается с полями
+    max(halo, overlap) и обрезается до своей области, поэтому результат
+    совпадает с обработкой целиком (склейка без швов, без смешивания).
+    Изображения меньше Config.PREPROCESS_TILE_MIN_PIXELS, а также режим
+    без тайлов (Config.PREPROCESS_TILED=0) обрабатываются одним вызовом.
+    """
+    tile_size = tile_size or Config.PREPROCESS_TILE_SIZE
+    overlap = Config.PREPROCESS_TILE_OVERLAP if overlap is None else overlap
+    height, width = image.shape[:2]
+    if (not Config.PREPROCESS_TILED or height * width < Config.PREPROCESS_TILE_MIN_PIXELS
+            or (height <= tile_size and width <= tile_size)):
+        return func(image)
+
+    tiles = tile_grid(image.shape, tile_size, max(halo, overlap))
+
+    def process(tile):
+        (py0, py1, px0, px1), (cy0, cy1, cx0, cx1) = tile
+        result = func(image[py0:py1, px0:px1])
+        return result[cy0 - py0:cy1 - py0, cx0 - px0:cx1 - px0]
+
+    if workers is not None:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tile") as pool:
+            parts = list(pool.map(process, tiles))
+    else:
+        parts = list(_get_tile_pool().map(process, tiles))
+    output = np.empty_like(image, shape=image.shape[:2] + parts[0].shape[2:])
+    for (_, (cy0, cy1, cx0, cx1)), part in zip(tiles, parts):
+        output[cy0:cy1, cx0:cx1] = part
+    return output
 
-# Инициализируем EasyOCR (русский + английский)
-reader = easyocr.Reader(['ru', 'en'], gpu=False)
 
 def enhance_contrast(image: np.ndarray) -> np.ndarray:
     """Повышает контраст изображения с помощью CLAHE."""
@@ -18,22 +103,28 @@ def enhance_contrast(image: np.ndarray) -> np.ndarray:
     clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
     return clahe.apply(gray)
 
-def denoise_image(image: np.ndarray) -> np.ndarray:
-    """Убираем шум fastNlMeansDenoising."""
+def _denoise(image: np.ndarray) -> np.ndarray:
     return cv2.fastNlMeansDenoising(image, h=20)
 
-def sharpen_image(image: np.ndarray) -> np.ndarray:
-    """Повышаем резкость."""
+def denoise_image(image: np.ndarray) -> np.ndarray:
+    """Убираем шум fastNlMeansDenoising (большие изображения — по тайлам, см. run_tiled)."""
+    # Окрестность: окно поиска 21 и шаблон 7 -> радиус 10 + 3
+    return run_tiled(_denoise, image, halo=13)
+
+def _sharpen(image: np.ndarray) -> np.ndarray:
     gaussian = cv2.GaussianBlur(image, (9, 9), 10.0)
     return cv2.addWeighted(image, 1.5, gaussian, -0.5, 0)
 
-def correct_perspective(image: np.ndarray) -> np.ndarray:
+def sharpen_image(image: np.ndarray) -> np.ndarray:
+    """Повышаем резкость (большие изображения — по тайлам, см. run_tiled)."""
+    return run_tiled(_sharpen, image, halo=4)
+
+def find_perspective(image: np.ndarray, min_area: float = 0.0):
     """
-    Ищет большой четырёхугольник и делает перспективное преобразование.
-    Если не найден — возвращаем исходное изображение.
+    Ищет большой четырёхугольник (не меньше min_area от площади изображения)
+    и возвращает (матрица перспективы, (ширина, высота)) или None.
     """
-    orig = image.copy()
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    gray = _to_gray(image)
     blur = cv2.GaussianBlur(gray, (5, 5), 0)
     edged = cv2.Canny(blur, 50, 200)
 
@@ -47,7 +138,9 @@ def correct_perspective(image: np.ndarray) -> np.ndarray:
             pts = approx.reshape(4, 2)
             break
     else:
-        return image  # ничего не нашли
+        return None  # ничего не нашли
+    if cv2.contourArea(pts) < min_area * gray.shape[0] * gray.shape[1]:
+        return None
 
     rect = np.zeros((4, 2), dtype="float32")
     s = pts.sum(axis=1)
@@ -61,13 +154,32 @@ def correct_perspective(image: np.ndarray) -> np.ndarray:
     widthA, widthB = np.linalg.norm(br - bl), np.linalg.norm(tr - tl)
     heightA, heightB = np.linalg.norm(tr - br), np.linalg.norm(tl - bl)
     maxWidth, maxHeight = int(max(widthA, widthB)), int(max(heightA, heightB))
+    if maxWidth < 2 or maxHeight < 2:
+        return None
 
     dst = np.array([[0, 0],
                     [maxWidth - 1, 0],
                     [maxWidth - 1, maxHeight - 1],
                     [0, maxHeight - 1]], dtype="float32")
-    M = cv2.getPerspectiveTransform(rect, dst)
-    return cv2.warpPerspective(orig, M, (maxWidth, maxHeight))
+    return cv2.getPerspectiveTransform(rect, dst), (maxWidth, maxHeight)
+
+def correct_perspective(image: np.ndarray) -> np.ndarray:
+    """
+    Ищет большой четырёхугольник и делает перспективное преобразование.
+    Если не найден — возвращаем исходное изображение.
+    """
+    found = find_perspective(image)
+    if found is None:
+        return image
+    M, size = found
+    return cv2.warpPerspective(image, M, size)
+
+def _adaptive_threshold(gray: np.ndarray) -> np.ndarray:
+    return cv2.adaptiveThreshold(
+        gray, 255,
+        cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY,
+        blockSize=35, C=11
+    )
 
 def binarize_image(image: np.ndarray) -> np.ndarray:
     """Адаптивная бинаризация (с проверкой среднего)."""
@@ -81,86 +193,608 @@ def binarize_image(image: np.ndarray) -> np.ndarray:
         else:
             gray = image
 
-    binarized = cv2.adaptiveThreshold(
-        gray, 255,
-        cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY,
-        blockSize=35, C=11
-    )
+    # Порог локальный (окно 35) и считается по тайлам; проверка среднего — по всему изображению
+    binarized = run_tiled(_adaptive_threshold, gray, halo=17)
     return binarized if np.mean(binarized) >= 50 else gray
 
-def preprocess_image(image: np.ndarray) -> np.ndarray:
+@dataclass
+class ImageQuality:
     """
-    Полный pipeline: перспектива, контраст, шум, резкость, бинаризация, BGR.
+    Дешёвые метрики качества блока (по уменьшенной серой копии):
+    noise — оценка СКО шума (метод Иммеркера), contrast — СКО яркости,
+    sharpness — дисперсия лапласиана, binary — изображение уже чёрно-белое.
     """
-    image = correct_perspective(image)
-    image = enhance_contrast(image)
-    image = denoise_image(image)
-    image = sharpen_image(image)
-    image = binarize_image(image)
+    noise: float
+    contrast: float
+    sharpness: float
+    binary: bool
+
+
+# Пороги выбора шагов в профилях "fast" и "balanced"
+NOISE_THRESHOLD = 6.0
+LOW_CONTRAST_THRESHOLD = 40.0
+BLUR_THRESHOLD = 150.0
+BINARY_FRACTION = 0.97
+QUALITY_MAX_SIDE = 1000
+
+# Шаги уровня блока — только фотометрия; геометрия правится раз на страницу (page_geometry)
+PREPROCESS_STEPS = ("contrast", "denoise", "sharpen", "binarize")
+PREPROCESS_PROFILES = ("fast", "balanced", "max-quality")
+
+_NOISE_KERNEL = np.array([[1, -2, 1], [-2, 4, -2], [1, -2, 1]], dtype=np.float32)
+
+
+def _to_gray(image: np.ndarray) -> np.ndarray:
+    if image.ndim == 2:
+        return image
+    if image.shape[2] == 4:
+        return cv2.cvtColor(image, cv2.COLOR_BGRA2GRAY)
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+
+def measure_quality(image: np.ndarray) -> ImageQuality:
+    """Метрики качества за несколько проходов по изображению не больше QUALITY_MAX_SIDE."""
+    gray = _to_gray(image)
+    scale = QUALITY_MAX_SIDE / max(gray.shape[:2])
+    if scale < 1:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    h, w = gray.shape[:2]
+    if h < 3 or w < 3:
+        return ImageQuality(noise=0.0, contrast=float(gray.std()), sharpness=0.0, binary=False)
+
+    residual = cv2.filter2D(gray.astype(np.float32), -1, _NOISE_KERNEL)[1:-1, 1:-1]
+    noise = float(np.abs(residual).sum() * np.sqrt(0.5 * np.pi) / (6 * (w - 2) * (h - 2)))
+    extremes = np.count_nonzero((gray < 32) | (gray > 223)) / gray.size
+    return ImageQuality(
+        noise=noise,
+        contrast=float(gray.std()),
+        sharpness=float(cv2.Laplacian(gray, cv2.CV_64F).var()),
+        binary=extremes >= BINARY_FRACTION,
+    )
+
+
+def plan_preprocessing(image: np.ndarray, profile: Optional[str] = None) -> list:
+    """
+    Шаги препроцессинга для блока в зависимости от профиля (по умолчанию
+    Config.PREPROCESS_PROFILE):
+    "max-quality" — все шаги;
+    "balanced" — контраст, шумоподавление и резкость по метрикам качества;
+    "fast" — без шумоподавления и резкости, контраст по метрикам.
+    Уже бинарное изображение (например, чистый рендер PDF) не обрабатывается.
+    """
+    profile = profile or Config.PREPROCESS_PROFILE
+    if profile not in PREPROCESS_PROFILES:
+        raise ValueError(f"Неизвестный профиль препроцессинга: {profile}")
+    if profile == "max-quality":
+        return list(PREPROCESS_STEPS)
+
+    quality = measure_quality(image)
+    if quality.binary:
+        return []
+    steps = []
+    if quality.contrast < LOW_CONTRAST_THRESHOLD:
+        steps.append("contrast")
+    if profile == "balanced" and quality.noise > NOISE_THRESHOLD:
+        steps.append("denoise")
+    if profile == "balanced" and quality.sharpness < BLUR_THRESHOLD:
+        steps.append("sharpen")
+    steps.append("binarize")
+    return steps
+
+
+_STEP_FUNCS = {
+    "contrast": enhance_contrast,
+    "denoise": denoise_image,
+    "sharpen": sharpen_image,
+    "binarize": binarize_image,
+}
+
+
+def preprocess_image(image: np.ndarray, profile: Optional[str] = None) -> np.ndarray:
+    """
+    Pipeline блока: контраст, шум, резкость, бинаризация, BGR.
+    Какие шаги выполняются, решает plan_preprocessing по профилю и метрикам блока.
+    Перспектива и наклон исправляются раньше, для всей страницы (page_geometry).
+    """
+    with span("preprocess.plan"):
+        steps = plan_preprocessing(image, profile)
+    image = _to_gray(image)
+    for step in steps:
+        with span(f"preprocess.{step}", pixels=image.size):
+            image = _STEP_FUNCS[step](image)
     return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
 
+# -----------------------------------------------------------------------------
+#                          Геометрия страницы: перспектива, поворот, наклон
+# -----------------------------------------------------------------------------
+
+# Минимальная доля площади страницы для четырёхугольника документа
+PAGE_MIN_QUAD_AREA = 0.25
+GEOMETRY_MAX_SIDE = 1000
+
+
+@dataclass
+class PageGeometry:
+    """
+    Геометрические поправки страницы: перспектива (матрица и размер результата),
+    поворот на 0/90/180/270 градусов по часовой стрелке и угол наклона в градусах.
+    Хранятся отдельно от изображения, чтобы кэшировать их по хэшу страницы.
+    """
+    perspective: Optional[list] = None
+    size: Optional[Tuple[int, int]] = None
+    rotation: int = 0
+    skew: float = 0.0
+
+    @property
+    def identity(self) -> bool:
+        return self.perspective is None and self.rotation == 0 and abs(self.skew) < 0.05
+
+
+_ROTATIONS = {90: cv2.ROTATE_90_CLOCKWISE, 180: cv2.ROTATE_180, 270: cv2.ROTATE_90_COUNTERCLOCKWISE}
+
+
+def _text_mask(gray: np.ndarray) -> np.ndarray:
+    """Уменьшенная маска тёмных (текстовых) пикселей для оценки поворота и наклона."""
+    scale = GEOMETRY_MAX_SIDE / max(gray.shape[:2])
+    if scale < 1:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    _, mask = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+    return mask
+
+
+def _profile_score(mask: np.ndarray) -> float:
+    """Дисперсия горизонтальной проекции: максимальна, когда строки текста горизонтальны."""
+    return float(np.var(mask.sum(axis=1, dtype=np.float64)))
+
+
+def _rotate_mask(mask: np.ndarray, angle: float) -> np.ndarray:
+    h, w = mask.shape[:2]
+    M = cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1.0)
+    return cv2.warpAffine(mask, M, (w, h), flags=cv2.INTER_NEAREST, borderValue=0)
+
+
+def detect_rotation(mask: np.ndarray) -> int:
+    """
+    Поворот на четверть оборота: если строки текста вертикальны (дисперсия
+    вертикальной проекции заметно больше), страница поворачивается на 90°.
+    Отличить 90 от 270 и 0 от 180 по проекциям нельзя — выбирается 90.
+    """
+    if not mask.any():
+        return 0
+    return 90 if _profile_score(mask.T) > 1.5 * _profile_score(mask) else 0
+
+
+def estimate_skew(mask: np.ndarray, max_angle: Optional[float] = None) -> float:
+    """
+    Угол наклона строк (градусы, в пределах +-max_angle): перебор углов
+    по максимуму дисперсии проекции, сначала с шагом 1°, затем 0.1°.
+    """
+    max_angle = Config.GEOMETRY_MAX_SKEW if max_angle is None else max_angle
+    if not mask.any() or max_angle <= 0:
+        return 0.0
+    best = 0.0
+    for step, extent in ((1.0, max_angle), (0.1, 1.0)):
+        angles = np.arange(best - extent, best + extent + step / 2, step)
+        best = float(max(angles, key=lambda a: _profile_score(_rotate_mask(mask, a))))
+    return round(best, 2)
+
+
+def detect_page_geometry(image: np.ndarray, profile: Optional[str] = None) -> PageGeometry:
+    """
+    Определяет поправки для всей страницы (профиль "fast" — без перспективы):
+    перспектива (Config.GEOMETRY_PERSPECTIVE), поворот (Config.GEOMETRY_ROTATION)
+    и наклон (Config.GEOMETRY_DESKEW).
+    """
+    profile = profile or Config.PREPROCESS_PROFILE
+    geometry = PageGeometry()
+    if Config.GEOMETRY_PERSPECTIVE and profile != "fast":
+        found = find_perspective(image, min_area=PAGE_MIN_QUAD_AREA)
+        if found is not None:
+            M, size = found
+            geometry.perspective, geometry.size = M.tolist(), size
+            image = cv2.warpPerspective(image, M, size)
+    if not (Config.GEOMETRY_ROTATION or Config.GEOMETRY_DESKEW):
+        return geometry
+    mask = _text_mask(_to_gray(image))
+    if Config.GEOMETRY_ROTATION:
+        geometry.rotation = detect_rotation(mask)
+        if geometry.rotation:
+            mask = cv2.rotate(mask, _ROTATIONS[geometry.rotation])
+    if Config.GEOMETRY_DESKEW:
+        geometry.skew = estimate_skew(mask)
+    return geometry
+
+
+def apply_page_geometry(image: np.ndarray, geometry: PageGeometry) -> np.ndarray:
+    if geometry.perspective is not None:
+        image = cv2.warpPerspective(image, np.array(geometry.perspective, dtype=np.float64), tuple(geometry.size))
+    if geometry.rotation:
+        image = cv2.rotate(image, _ROTATIONS[geometry.rotation])
+    if abs(geometry.skew) >= 0.05:
+        h, w = image.shape[:2]
+        M = cv2.getRotationMatrix2D((w / 2, h / 2), geometry.skew, 1.0)
+        image = cv2.warpAffine(image, M, (w, h), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+    return image
+
+
+def geometry_matrix(shape, geometry: PageGeometry) -> np.ndarray:
+    """
+    Матрица 3x3 преобразования apply_page_geometry: точка исходной страницы
+    (shape — её размер) -> точка исправленной страницы.
+    """
+    h, w = shape[:2]
+    M = np.eye(3)
+    if geometry.perspective is not None:
+        M = np.array(geometry.perspective, dtype=np.float64)
+        w, h = geometry.size
+    if geometry.rotation:
+        # Как cv2.rotate: 90 — по часовой стрелке, 270 — против
+        R = {90: [[0, -1, h - 1], [1, 0, 0]],
+             180: [[-1, 0, w - 1], [0, -1, h - 1]],
+             270: [[0, 1, 0], [-1, 0, w - 1]]}[geometry.rotation]
+        M = np.vstack([R, [0, 0, 1]]) @ M
+        if geometry.rotation != 180:
+            w, h = h, w
+    if abs(geometry.skew) >= 0.05:
+        M = np.vstack([cv2.getRotationMatrix2D((w / 2, h / 2), geometry.skew, 1.0), [0, 0, 1]]) @ M
+    return M
+
+
+def page_geometry(image: np.ndarray, profile: Optional[str] = None) -> Tuple[np.ndarray, PageGeometry]:
+    """
+    Геометрический этап страницы, до split_image_by_ocr: поправки определяются
+    один раз на страницу и кэшируются по хэшу страницы (этап "geometry"),
+    после чего применяются к изображению целиком.
+    """
+    profile = profile or Config.PREPROCESS_PROFILE
+    with span("geometry", pixels=image.size) as sp:
+        key = None
+        geometry = None
+        if Config.CACHE_ENABLED and cache.store.enabled:
+            key = cache.stage_key("geometry", image, profile, _geometry_config())
+            geometry = cache.store.get("geometry", key)
+        sp.set(cached=geometry is not None)
+        if geometry is None:
+            geometry = detect_page_geometry(image, profile)
+            if key is not None:
+                cache.store.put("geometry", key, geometry)
+        return apply_page_geometry(image, geometry), geometry
+
+
+def _geometry_config() -> dict:
+    return {
+        "perspective": Config.GEOMETRY_PERSPECTIVE,
+        "rotation": Config.GEOMETRY_ROTATION,
+        "deskew": Config.GEOMETRY_DESKEW,
+        "max_skew": Config.GEOMETRY_MAX_SKEW,
+    }
+
+# -----------------------------------------------------------------------------
+#                          Нормализация разрешения по высоте текста
+# -----------------------------------------------------------------------------
+
+TEXT_HEIGHT_MAX_SIDE = 2000
+# Меньше компонент — оценка ненадёжна, страница не масштабируется
+TEXT_HEIGHT_MIN_COMPONENTS = 20
+
+
+def estimate_text_height(image: np.ndarray) -> Optional[float]:
+    """
+    Медианная высота символов (px исходного изображения) по связным компонентам
+    маски тёмных пикселей. Линии, рамки, точки и заливки отбрасываются по размеру
+    и пропорциям. None — если похожих на символы компонент слишком мало.
+    """
+    gray = _to_gray(image)
+    scale = min(1.0, TEXT_HEIGHT_MAX_SIDE / max(gray.shape[:2]))
+    if scale < 1:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    _, mask = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+    _, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    w, h, area = stats[1:, cv2.CC_STAT_WIDTH], stats[1:, cv2.CC_STAT_HEIGHT], stats[1:, cv2.CC_STAT_AREA]
+    chars = (h >= 4) & (h <= gray.shape[0] * 0.1) & (w <= h * 3) & (w * 8 >= h) & (area >= w * h * 0.1)
+    if np.count_nonzero(chars) < TEXT_HEIGHT_MIN_COMPONENTS:
+        return None
+    return float(np.median(h[chars])) / scale
+
+
+def resolution_scale(text_height: Optional[float], shape=None) -> float:
+    """
+    Масштаб, приводящий высоту строчных букв (x-height, см. estimate_text_height)
+    к Config.RESOLUTION_TEXT_HEIGHT: увеличение не больше Config.RESOLUTION_MAX_UPSCALE,
+    уменьшение — не меньше Config.RESOLUTION_MIN_SIDE по длинной стороне (shape),
+    отклонения в пределах Config.RESOLUTION_TOLERANCE не исправляются (1.0 — без масштабирования).
+    """
+    if not text_height:
+        return 1.0
+    scale = min(Config.RESOLUTION_TEXT_HEIGHT / text_height, Config.RESOLUTION_MAX_UPSCALE)
+    if shape is not None and scale < 1:
+        scale = max(scale, min(1.0, Config.RESOLUTION_MIN_SIDE / max(shape[:2])))
+    return 1.0 if abs(scale - 1.0) <= Config.RESOLUTION_TOLERANCE else scale
+
+
+def page_resolution(image: np.ndarray) -> Tuple[np.ndarray, float]:
+    """
+    Этап после page_geometry и до split_image_by_ocr: страница масштабируется
+    так, чтобы текст имел целевую высоту (Config.RESOLUTION_NORMALIZE).
+    Возвращает изображение и масштаб (координаты на нём = исходные * масштаб).
+    """
+    if not Config.RESOLUTION_NORMALIZE:
+        return image, 1.0
+    with span("resolution", pixels=image.size) as sp:
+        text_height = estimate_text_height(image)
+        scale = resolution_scale(text_height, image.shape)
+        sp.set(scale=scale)
+        if scale == 1.0:
+            return image, 1.0
+        interpolation = cv2.INTER_AREA if scale < 1 else cv2.INTER_CUBIC
+        return cv2.resize(image, None, fx=scale, fy=scale, interpolation=interpolation), scale
+
+
+def _resolution_config() -> dict:
+    return {
+        "enabled": Config.RESOLUTION_NORMALIZE,
+        "text_height": Config.RESOLUTION_TEXT_HEIGHT,
+        "max_upscale": Config.RESOLUTION_MAX_UPSCALE,
+        "min_side": Config.RESOLUTION_MIN_SIDE,
+        "tolerance": Config.RESOLUTION_TOLERANCE,
+    }
+
 # -----------------------------------------------------------------------------
 #                          Новый метод: bounding box из EasyOCR
 # -----------------------------------------------------------------------------
 
+def _box_bounds(boxes) -> np.ndarray:
+    """Четырёхугольники [[x, y] x 4] (или уже (minX, minY, maxX, maxY)) -> массив n x 4 границ."""
+    if not len(boxes):
+        return np.zeros((0, 4))
+    try:
+        points = np.asarray(boxes)
+    except ValueError:  # боксы с разным числом точек
+        points = None
+    if points is not None and points.ndim == 2 and points.shape[1] == 4:
+        return points
+    if points is not None and points.ndim == 3:
+        return np.concatenate([points.min(axis=1), points.max(axis=1)], axis=1)
+    points = [np.asarray(box) for box in boxes]
+    return np.array([[p[:, 0].min(), p[:, 1].min(), p[:, 0].max(), p[:, 1].max()] for p in points])
+
+
+# Сколько пар-кандидатов проверяется за один векторный шаг (ограничивает память)
+PAIR_CHUNK = 1 << 20
+
+
+def _close_pairs(bounds: np.ndarray, eps: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Пары боксов с зазором не больше eps по обеим осям. Sweep line: боксы
+    отсортированы по началу вдоль оси, кандидаты для бокса — следующие за ним
+    до первого начала > конец + eps (searchsorted). Ось (X или Y) выбирается
+    ту, где кандидатов меньше. Кандидаты всех боксов разворачиваются в плоские
+    массивы и проверяются по второй оси векторно, порциями не больше PAIR_CHUNK пар.
+    """
+    best = None
+    for axis in (0, 1):
+        order = np.argsort(bounds[:, axis], kind="stable")
+        starts, ends = bounds[order, axis], bounds[order, axis + 2]
+        counts = np.searchsorted(starts, ends + eps, side="right") - np.arange(1, len(order) + 1)
+        counts = np.maximum(counts, 0)
+        if best is None or counts.sum() < best[2].sum():
+            best = (axis, order, counts)
+    axis, order, counts = best
+    other = 1 - axis
+    lo, hi = bounds[order, other], bounds[order, other + 2]
+    left, right = [], []
+    start = 0
+    while start < len(order):
+        # Набираем боксы, пока суммарное число кандидатов помещается в порцию
+        stop = start + max(1, int(np.searchsorted(np.cumsum(counts[start:]), PAIR_CHUNK, side="right")))
+        chunk_counts = counts[start:stop]
+        i = np.repeat(np.arange(start, stop), chunk_counts)
+        offsets = np.arange(i.size) - np.repeat(np.cumsum(chunk_counts) - chunk_counts, chunk_counts)
+        j = i + 1 + offsets
+        close = (lo[j] <= hi[i] + eps) & (hi[j] >= lo[i] - eps)
+        left.append(i[close])
+        right.append(j[close])
+        start = stop
+    if not left:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+    return order[np.concatenate(left)], order[np.concatenate(right)]
+
+
+def _connected_labels(n: int, left: np.ndarray, right: np.ndarray) -> np.ndarray:
+    """
+    Union-find в векторной форме: каждому боксу — наименьший индекс его компоненты.
+    Метки распространяются по рёбрам (np.minimum.at) и сжимаются переходом
+    по указателям (labels[labels]), пока не перестанут меняться.
+    """
+    labels = np.arange(n)
+    while True:
+        previous = labels
+        lowest = np.minimum(labels[left], labels[right])
+        labels = labels.copy()
+        np.minimum.at(labels, left, lowest)
+        np.minimum.at(labels, right, lowest)
+        labels = labels[labels]
+        if np.array_equal(labels, previous):
+            return labels
+
+
 def merge_overlapping_boxes(boxes, eps=50):
     """
     Сливаем пересекающиеся или близкие bounding boxes.
     eps = 50 пикселей — допустимое расстояние/зазор для объединения.
     boxes — список, где каждый элемент: [[x1, y1], [x2, y2], [x3, y3], [x4, y4]].
     Возвращаем список (minX, minY, maxX, maxY) блоков.
+    Слияние транзитивное и не зависит от порядка боксов: ищутся компоненты
+    связности графа "зазор <= eps", затем то же повторяется для получившихся
+    блоков, пока они не перестанут сливаться (итоговые блоки не ближе eps).
+    Блоки упорядочены по первому входящему в них боксу.
+    """
+    bounds = _box_bounds(boxes)
+    first = np.arange(len(bounds))
+    while len(bounds) > 1:
+        left, right = _close_pairs(bounds, eps)
+        if not left.size:
+            break
+        labels = _connected_labels(len(bounds), left, right)
+        roots, inverse = np.unique(labels, return_inverse=True)
+        merged = np.empty((len(roots), 4), dtype=bounds.dtype)
+        merged[:, :2] = np.inf if bounds.dtype.kind == "f" else np.iinfo(bounds.dtype).max
+        merged[:, 2:] = -np.inf if bounds.dtype.kind == "f" else np.iinfo(bounds.dtype).min
+        np.minimum.at(merged[:, 0], inverse, bounds[:, 0])
+        np.minimum.at(merged[:, 1], inverse, bounds[:, 1])
+        np.maximum.at(merged[:, 2], inverse, bounds[:, 2])
+        np.maximum.at(merged[:, 3], inverse, bounds[:, 3])
+        merged_first = np.full(len(roots), len(boxes))
+        np.minimum.at(merged_first, inverse, first)
+        bounds, first = merged, merged_first
+    order = np.argsort(first, kind="stable")
+    return [tuple(row) for row in bounds[order].tolist()]
+
+
+@dataclass
+class PageContext:
+    """
+    Результаты первого прохода EasyOCR по странице.
+    detections — [(box, text, conf)]; в режиме "detect" text и conf равны None.
+    block_boxes — (minX, minY, maxX, maxY) блоков, в том же порядке, что и блоки.
+    text_layer — текст из текстового слоя PDF (mode="text"): страница не рендерилась
+    и не распознаётся, её единственный блок не содержит изображения.
+    geometry — поправки страницы (page_geometry); block_boxes заданы в координатах
+    исправленной страницы.
+    scale — масштаб страницы (page_resolution): detections и block_boxes заданы
+    в масштабированных координатах.
+    original_shape — размер страницы до page_geometry; to_original переводит боксы
+    обратно в её координаты (для визуализации на исходном изображении).
+    """
+    page_index: int
+    shape: Tuple[int, ...]
+    mode: str
+    detections: list = field(default_factory=list)
+    block_boxes: list = field(default_factory=list)
+    text_layer: Optional[str] = None
+    geometry: Optional["PageGeometry"] = None
+    scale: float = 1.0
+    original_shape: Optional[Tuple[int, ...]] = None
+
+    @property
+    def recognized(self) -> bool:
+        return self.mode == "full"
+
+    def to_original(self, box) -> np.ndarray:
+        """
+        Бокс (minX, minY, maxX, maxY) или четырёхугольник [[x, y], ...] в координатах
+        исходной страницы: отменяются масштаб и поправки геометрии (перспектива,
+        поворот, наклон), поэтому результат — четырёхугольник n x 2 (float32).
+        """
+        points = np.asarray(box, dtype=np.float64)
+        if points.ndim == 1:
+            minx, miny, maxx, maxy = points
+            points = np.array([[minx, miny], [maxx, miny], [maxx, maxy], [minx, maxy]])
+        forward = np.diag([self.scale, self.scale, 1.0])
+        if self.geometry is not None and self.original_shape is not None:
+            forward = forward @ geometry_matrix(self.original_shape, self.geometry)
+        inverse = np.linalg.inv(forward)
+        return cv2.perspectiveTransform(points.reshape(-1, 1, 2), inverse).reshape(-1, 2).astype(np.float32)
+
+    def block_detections(self, block_index: int) -> list:
+        """Детекции, центр которых попадает в блок, в координатах блока."""
+        minx, miny, maxx, maxy = self.block_boxes[block_index]
+        found = []
+        for box, text, conf in self.detections:
+            cx = sum(p[0] for p in box) / len(box)
+            cy = sum(p[1] for p in box) / len(box)
+            if minx <= cx <= maxx and miny <= cy <= maxy:
+                shifted = [[p[0] - minx, p[1] - miny] for p in box]
+                found.append((shifted, text, conf))
+        return found
+
+
+@dataclass
+class BlockContext:
     """
-    merged = []
-    for box in boxes:
-        x_coords = [p[0] for p in box]
-        y_coords = [p[1] for p in box]
-        minx, maxx = min(x_coords), max(x_coords)
-        miny, maxy = min(y_coords), max(y_coords)
-
-        found_merge = False
-        for i, (mx1, my1, mx2, my2) in enumerate(merged):
-            # Проверка пересечения или близости
-            # Если наши новые координаты не полностью за пределами уже имеющегося бокса
-            if not (maxx < mx1 - eps or minx > mx2 + eps or maxy < my1 - eps or miny > my2 + eps):
-                # Расширяем существующий бокс
-                new_minx = min(minx, mx1)
-                new_miny = min(miny, my1)
-                new_maxx = max(maxx, mx2)
-                new_maxy = max(maxy, my2)
-                merged[i] = (new_minx, new_miny, new_maxx, new_maxy)
-                found_merge = True
-                break
-        if not found_merge:
-            merged.append((minx, miny, maxx, maxy))
-    return merged
-
-def split_image_by_ocr(image: np.ndarray) -> List[np.ndarray]:
-    """
-    1) Прогоняем EasyOCR (detail=1, paragraph=False),
+    Блок страницы после нормализации: изображение (путь к PNG или np.ndarray BGR)
+    и ссылка на контекст страницы.
+    """
+    image: object
+    page: PageContext
+    index: int
+
+    @property
+    def bbox(self):
+        return self.page.block_boxes[self.index]
+
+    @property
+    def original_bbox(self) -> np.ndarray:
+        """Четырёхугольник блока на исходной странице (см. PageContext.to_original)."""
+        return self.page.to_original(self.bbox)
+
+    @property
+    def detections(self) -> list:
+        return self.page.block_detections(self.index)
+
+
+def default_split_mode() -> str:
+    """Повторное использование результатов разбиения требует полного распознавания."""
+    return "full" if Config.OCR_REUSE_SPLIT_RESULTS else Config.SPLIT_MODE
+
+
+def _detect_boxes(gray: np.ndarray) -> list:
+    """Только детекция EasyOCR (без распознавания) -> [(box, None, None)]."""
+    horizontal_list, free_list = models.get_easyocr_reader().detect(gray)
+    detections = []
+    for x_min, x_max, y_min, y_max in horizontal_list[0]:
+        box = [[x_min, y_min], [x_max, y_min], [x_max, y_max], [x_min, y_max]]
+        detections.append((box, None, None))
+    for box in free_list[0]:
+        detections.append(([list(p) for p in box], None, None))
+    return detections
+
+
+def split_image_by_ocr(image: np.ndarray, mode: Optional[str] = None,
+                       return_context: bool = False, page_index: int = 0):
+    """
+    1) Прогоняем EasyOCR: mode="detect" — только детекция,
+       mode="full" — detail=1, paragraph=False (текст и уверенности сохраняются),
     2) собираем bounding box'ы,
     3) сливаем их (merge_overlapping_boxes),
     4) вырезаем блоки.
+    return_context=True — дополнительно возвращает PageContext.
     """
+    mode = mode or default_split_mode()
+    context = PageContext(page_index=page_index, shape=image.shape, mode=mode)
+
+    def result(blocks, boxes):
+        context.block_boxes = boxes
+        return (blocks, context) if return_context else blocks
+
+    full_box = (0, 0, image.shape[1], image.shape[0])
+
     # 1) EasyOCR
     gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    results = reader.readtext(gray, detail=1, paragraph=False)
-    if not results:
-        return [image]
+    with span(f"split.{mode}", pixels=gray.size) as sp:
+        if mode == "detect":
+            context.detections = _detect_boxes(gray)
+        else:
+            results = models.get_easyocr_reader().readtext(gray, detail=1, paragraph=False)
+            context.detections = [
+                (item[0], item[1], item[2] if len(item) > 2 else None)
+                for item in results if len(item) >= 2  # (box, text[, conf])
+            ]
+        sp.set(boxes=len(context.detections))
+    if not context.detections:
+        return result([image], [full_box])
 
     # 2) Собираем bounding boxes
-    boxes = []
-    for item in results:
-        if len(item) >= 2:  # (box, text[, conf])
-            box = item[0]
-            boxes.append(box)
+    boxes = [box for box, _, _ in context.detections]
 
     # 3) Сливаем пересекающиеся
-    merged_boxes = merge_overlapping_boxes(boxes, eps=50)
+    with span("split.merge_boxes", boxes=len(boxes)):
+        merged_boxes = merge_overlapping_boxes(boxes, eps=50)
     if not merged_boxes:
-        return [image]
+        return result([image], [full_box])
 
     # 4) Вырезаем каждый объединённый блок
-    blocks = []
+    blocks, block_boxes = [], []
     for (minx, miny, maxx, maxy) in merged_boxes:
         # Учитываем границы
         minx, miny = max(0, int(minx)), max(0, int(miny))
@@ -169,72 +803,367 @@ def split_image_by_ocr(image: np.ndarray) -> List[np.ndarray]:
         if w > 10 and h > 10:
             crop = image[miny:maxy, minx:maxx]
             blocks.append(crop)
+            block_boxes.append((minx, miny, maxx, maxy))
 
-    return blocks if blocks else [image]
+    if not blocks:
+        return result([image], [full_box])
+    return result(blocks, block_boxes)
 
 # -----------------------------------------------------------------------------
 #                          Обработка PDF / обычного изображения
 # -----------------------------------------------------------------------------
 
-def normalize_pdf(file_obj) -> List[str]:
+def _block_output(processed: np.ndarray, name: str, context: PageContext, index: int,
+                  with_context: bool, out_dir: Optional[str]):
     """
-    Обрабатывает многостраничный PDF: для каждой страницы
-    вызывает EasyOCR box'ы, preprocess и сохраняет.
+    В режиме в памяти блок остаётся np.ndarray (BGR), иначе пишется PNG
+    в уникальный каталог запроса (out_dir), чтобы параллельные запросы
+    не перезаписывали файлы друг друга.
     """
-    paths = []
+    if out_dir is None:
+        item = processed
+    else:
+        item = os.path.join(out_dir, f"{name}.png")
+        cv2.imwrite(item, processed)
+    return BlockContext(item, context, index) if with_context else item
+
+
+OUTPUT_DIR_PREFIX = "doc2text_"
+
+
+def cleanup_blocks(blocks) -> None:
+    """
+    Удаляет каталоги запроса с PNG блоков (_output_dir), когда блоки больше не нужны
+    (после OCR). Блоки в памяти и файлы вне таких каталогов не трогаются.
+    """
+    dirs = set()
+    for block in blocks:
+        image = block.image if isinstance(block, BlockContext) else block
+        if isinstance(image, str):
+            directory = os.path.dirname(image)
+            if os.path.basename(directory).startswith(OUTPUT_DIR_PREFIX):
+                dirs.add(directory)
+    for directory in dirs:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def _output_dir(in_memory: Optional[bool]) -> Optional[str]:
+    if in_memory is None:
+        in_memory = Config.PIPELINE_IN_MEMORY
+    return None if in_memory else mkdtemp(prefix=OUTPUT_DIR_PREFIX)
+
+
+def _pdf_path(file_obj) -> Tuple[str, bool]:
+    """
+    Путь к PDF на диске и флаг "временный файл". Загрузка, уже лежащая на диске,
+    используется как есть; во временный файл пишутся только объекты в памяти.
+    """
+    if isinstance(file_obj, str):
+        return file_obj, False
+    name = getattr(file_obj, 'name', None)
+    if isinstance(name, str) and os.path.exists(name):
+        return name, False
     with NamedTemporaryFile(suffix=".pdf", delete=False) as tmp_pdf:
-        # вместо file_obj.read() используем open(file_obj.name,'rb')
-        with open(file_obj.name, 'rb') as f:
-            pdf_data = f.read()
-        tmp_pdf.write(pdf_data)
-        tmp_pdf.flush()
-
-        pages = convert_from_path(tmp_pdf.name, dpi=200)
-
-    os.unlink(tmp_pdf.name)
-
-    for i, page in enumerate(pages):
-        img = cv2.cvtColor(np.array(page), cv2.COLOR_RGB2BGR)
-        blocks = split_image_by_ocr(img)
-        for j, region in enumerate(blocks):
-            processed = preprocess_image(region)
-            path = f"/tmp/doc2text_pdf_page_{i+1}_block_{j+1}.png"
-            cv2.imwrite(path, processed)
-            paths.append(path)
-    return paths
+        file_obj.seek(0)
+        shutil.copyfileobj(file_obj, tmp_pdf)
+    return tmp_pdf.name, True
+
+
+def _pdf_page_count(path: str) -> int:
+    return int(pdfinfo_from_path(path)["Pages"])
 
 
-def normalize_image(file_obj) -> List[str]:
+def _render_pdf_page(path: str, page_number: int, dpi: int) -> np.ndarray:
+    """Рендерит одну страницу (нумерация с 1) в np.ndarray BGR."""
+    with span("pdf.render", pages=1):
+        page = convert_from_path(path, dpi=dpi, first_page=page_number, last_page=page_number)[0]
+    return cv2.cvtColor(np.array(page), cv2.COLOR_RGB2BGR)
+
+
+def is_text_layer(text: Optional[str]) -> bool:
     """
-    Обычное изображение:
-    1) Читаем,
-    2) bounding box через OCR,
-    3) Препроцессинг,
-    4) Сохраняем
+    Похоже ли извлечённое из PDF содержимое на настоящий текстовый слой:
+    не меньше Config.PDF_TEXT_MIN_CHARS букв и буквы составляют
+    хотя бы половину непробельных символов (а не мусор из шрифтов).
     """
-    paths = []
-    # Читаем с диска
-    if hasattr(file_obj, 'name') and isinstance(file_obj.name, str):
+    if not text:
+        return False
+    letters = sum(ch.isalpha() for ch in text)
+    visible = sum(not ch.isspace() for ch in text)
+    return letters >= Config.PDF_TEXT_MIN_CHARS and letters >= 0.5 * visible
+
+
+def pdf_text_layer(path: str) -> dict:
+    """
+    {номер страницы: текст} для страниц с текстовым слоем (born-digital PDF).
+    Один вызов pdftotext (poppler) на весь файл; страницы в выводе разделены \f.
+    """
+    try:
+        with span("pdf.text_layer"):
+            result = subprocess.run(
+                ["pdftotext", "-layout", "-enc", "UTF-8", path, "-"],
+                capture_output=True, timeout=Config.PDF_TEXT_TIMEOUT, check=True,
+            )
+    except (OSError, subprocess.SubprocessError):
+        return {}
+    pages = result.stdout.decode("utf-8", errors="replace").split("\f")
+    return {n: text.strip() for n, text in enumerate(pages, start=1) if is_text_layer(text)}
+
+
+def iter_pdf_pages(path: str, pages, dpi: Optional[int] = None, threads: Optional[int] = None,
+                   max_pages: Optional[int] = None) -> Iterator[Tuple[int, np.ndarray]]:
+    """
+    Потоковый рендеринг: (номер страницы, np.ndarray BGR) в порядке pages.
+    Страницы рендерятся в threads потоках (Config.PDF_RENDER_THREADS), в очереди
+    одновременно не больше max_pages отрендеренных или рендерящихся страниц
+    (Config.PDF_MAX_PAGES_IN_MEMORY), поэтому память не растёт с длиной документа.
+    """
+    dpi = dpi or Config.PDF_DPI
+    threads = threads or Config.PDF_RENDER_THREADS
+    max_pages = max(1, max_pages or Config.PDF_MAX_PAGES_IN_MEMORY)
+    remaining = iter(pages)
+    with ThreadPoolExecutor(max_workers=threads, thread_name_prefix="pdf-render") as pool:
+        pending = deque()
+
+        def submit_next():
+            page_number = next(remaining, None)
+            if page_number is not None:
+                pending.append((page_number, pool.submit(_render_pdf_page, path, page_number, dpi)))
+
+        for _ in range(max_pages):
+            submit_next()
+        while pending:
+            page_number, future = pending.popleft()
+            image = future.result()
+            submit_next()
+            yield page_number, image
+
+
+def iter_pdf_blocks(file_obj, with_context: bool = False, in_memory: Optional[bool] = None,
+                    text_layer: Optional[bool] = None, profile: Optional[str] = None,
+                    progress=None) -> Iterator[Tuple[int, list]]:
+    """
+    Потоково обрабатывает PDF: (индекс страницы, блоки страницы) в порядке страниц,
+    по мере рендеринга (iter_pdf_pages). Для каждой страницы исправляются геометрия
+    и разрешение,
+    вызываются EasyOCR box'ы, preprocess и сохранение.
+    Параметры — как у normalize_pdf; progress вызывается после каждой страницы.
+    """
+    if text_layer is None:
+        text_layer = Config.PDF_TEXT_LAYER
+    text_layer = text_layer and with_context
+    out_dir = _output_dir(in_memory)
+    path, is_temp = _pdf_path(file_obj)
+    rendered = None
+    try:
+        page_count = _pdf_page_count(path)
+        text_pages = pdf_text_layer(path) if text_layer else {}
+        rendered = iter_pdf_pages(path, [n for n in range(1, page_count + 1) if n not in text_pages])
+        for n in range(1, page_count + 1):
+            i = n - 1
+            if n in text_pages:
+                context = PageContext(page_index=i, shape=(), mode="text", text_layer=text_pages[n])
+                page_blocks = [BlockContext(None, context, 0)]
+            else:
+                _, img = next(rendered)
+                original_shape = img.shape
+                img, geometry = page_geometry(img, profile)
+                img, scale = page_resolution(img)
+                blocks, context = split_image_by_ocr(img, return_context=True, page_index=i)
+                context.geometry, context.scale, context.original_shape = geometry, scale, original_shape
+                page_blocks = [
+                    _block_output(preprocess_image(region, profile), f"page_{i+1}_block_{j+1}", context, j, with_context, out_dir)
+                    for j, region in enumerate(blocks)
+                ]
+            if progress:
+                progress("normalize", n, page_count)
+            yield i, page_blocks
+    finally:
+        if rendered is not None:
+            rendered.close()
+        if is_temp:
+            os.unlink(path)
+
+
+def normalize_pdf(file_obj, with_context: bool = False, in_memory: Optional[bool] = None,
+                  text_layer: Optional[bool] = None, profile: Optional[str] = None, progress=None) -> list:
+    """
+    Обрабатывает многостраничный PDF (см. iter_pdf_blocks) и возвращает все блоки.
+    with_context=True — вместо путей возвращает BlockContext.
+    in_memory=True — блоки возвращаются как np.ndarray без записи на диск
+    (по умолчанию Config.PIPELINE_IN_MEMORY).
+    text_layer=True — страницы с текстовым слоем не рендерятся и не распознаются,
+    для них возвращается один BlockContext без изображения с текстом в
+    page.text_layer (только при with_context; по умолчанию Config.PDF_TEXT_LAYER).
+    profile — профиль препроцессинга (см. plan_preprocessing).
+    progress — необязательный callback("normalize", готово страниц, всего страниц).
+    """
+    pages = iter_pdf_blocks(file_obj, with_context=with_context, in_memory=in_memory,
+                            text_layer=text_layer, profile=profile, progress=progress)
+    return [block for _, page_blocks in pages for block in page_blocks]
+
+
+def _read_image(file_obj) -> np.ndarray:
+    """Читает изображение из пути, файла с .name или file-like объекта в памяти."""
+    if hasattr(file_obj, 'name') and isinstance(file_obj.name, str) and os.path.exists(file_obj.name):
         image = cv2.imread(file_obj.name)
     elif isinstance(file_obj, str):
         image = cv2.imread(file_obj)
+    elif hasattr(file_obj, 'read'):
+        file_obj.seek(0)
+        data = np.frombuffer(file_obj.read(), dtype=np.uint8)
+        image = cv2.imdecode(data, cv2.IMREAD_COLOR) if data.size else None
     else:
-        raise ValueError("Неподдерживаемый тип файла (нельзя прочитать из .name)") 
+        raise ValueError("Неподдерживаемый тип файла (нельзя прочитать из .name)")
+    if image is None:
+        raise ValueError("Не удалось декодировать изображение")
+    return image
+
 
-    blocks = split_image_by_ocr(image)
+def normalize_image(file_obj, with_context: bool = False, in_memory: Optional[bool] = None,
+                    profile: Optional[str] = None, progress=None) -> list:
+    """
+    Обычное изображение:
+    1) Читаем, исправляем геометрию страницы (page_geometry) и приводим
+       текст к целевой высоте (page_resolution),
+    2) bounding box через OCR,
+    3) Препроцессинг блоков,
+    4) Сохраняем (или оставляем в памяти при in_memory=True)
+    with_context=True — вместо путей возвращает BlockContext.
+    profile — профиль препроцессинга (см. plan_preprocessing).
+    """
+    out_dir = _output_dir(in_memory)
+    paths = []
+    image = _read_image(file_obj)
+
+    original_shape = image.shape
+    image, geometry = page_geometry(image, profile)
+    image, scale = page_resolution(image)
+    blocks, context = split_image_by_ocr(image, return_context=True)
+    context.geometry, context.scale, context.original_shape = geometry, scale, original_shape
     for i, region in enumerate(blocks):
-        processed = preprocess_image(region)
-        path = f"/tmp/doc2text_img_block_{i+1}.png"
-        cv2.imwrite(path, processed)
-        paths.append(path)
+        processed = preprocess_image(region, profile)
+        paths.append(_block_output(processed, f"img_block_{i+1}", context, i, with_context, out_dir))
+    if progress:
+        progress("normalize", 1, 1)
 
     return paths
 
-def normalize_file(file_obj) -> List[str]:
+def _normalize_config(profile: str) -> dict:
+    """Параметры конфигурации, от которых зависит результат нормализации (часть ключа кэша)."""
+    return {"split_mode": default_split_mode(), "pdf_dpi": Config.PDF_DPI, "profile": profile,
+            "geometry": _geometry_config(), "resolution": _resolution_config()}
+
+
+def _file_size(file_obj) -> Optional[int]:
+    """Размер входного файла в байтах (для трассировки); None, если не определить."""
+    probes = (
+        lambda: os.fstat(file_obj.fileno()).st_size,
+        lambda: file_obj.getbuffer().nbytes,
+        lambda: os.path.getsize(getattr(file_obj, 'name', file_obj)),
+    )
+    for probe in probes:
+        try:
+            return probe()
+        except (OSError, ValueError, TypeError, AttributeError):
+            continue
+    return None
+
+
+def iter_normalized_pages(file_obj, in_memory: Optional[bool] = None, use_cache: Optional[bool] = None,
+                          profile: Optional[str] = None, progress=None,
+                          text_layer: Optional[bool] = None) -> Iterator[Tuple[int, list]]:
     """
-    Определяет, PDF это или нет. Затем обрабатывает.
+    Потоковая нормализация: (индекс страницы, [BlockContext]) по мере готовности
+    страниц, чтобы следующие этапы могли начинать с первой страницы.
+    Параметры — как у normalize_file; text_layer — брать страницы PDF из текстового
+    слоя (по умолчанию Config.PDF_TEXT_LAYER). Результат кэшируется целиком,
+    только если документ дочитан до конца.
     """
-    ext = os.path.splitext(file_obj.name)[-1].lower()
+    ext = os.path.splitext(getattr(file_obj, 'name', None) or '')[-1].lower()
+    if in_memory is None:
+        in_memory = Config.PIPELINE_IN_MEMORY
+    if use_cache is None:
+        use_cache = Config.CACHE_ENABLED
+    profile = profile or Config.PREPROCESS_PROFILE
+
+    text_layer = ext == '.pdf' and (Config.PDF_TEXT_LAYER if text_layer is None else text_layer)
+
+    key = None
+    if use_cache and in_memory and cache.store.enabled:
+        key = cache.stage_key("normalize", cache.file_digest(file_obj), ext, text_layer, _normalize_config(profile))
+        blocks = cache.store.get("normalize", key)
+        if blocks is not None:
+            if progress:
+                progress("normalize", 1, 1)
+            by_page = {}
+            for block in blocks:
+                by_page.setdefault(block.page.page_index, []).append(block)
+            yield from sorted(by_page.items())
+            return
+
     if ext == '.pdf':
-        return normalize_pdf(file_obj)
-    return normalize_image(file_obj)
+        pages = iter_pdf_blocks(file_obj, with_context=True, in_memory=in_memory, text_layer=text_layer,
+                                profile=profile, progress=progress)
+    else:
+        pages = [(0, normalize_image(file_obj, with_context=True, in_memory=in_memory, profile=profile,
+                                     progress=progress))]
+    collected = []
+    for page_index, page_blocks in pages:
+        collected.extend(page_blocks)
+        yield page_index, page_blocks
+    if key is not None:
+        cache.store.put("normalize", key, collected)
+
+
+def normalize_file(file_obj, with_context: bool = False, in_memory: Optional[bool] = None,
+                   use_cache: Optional[bool] = None, profile: Optional[str] = None, progress=None) -> list:
+    """
+    Определяет, PDF это или нет. Затем обрабатывает.
+    with_context=True — вместо путей возвращает BlockContext
+    (для повторного использования первого прохода EasyOCR на этапе OCR).
+    in_memory=True — блоки передаются дальше как np.ndarray, без PNG на диске.
+    use_cache — брать блоки из кэша по хэшу файла и конфигурации
+    (по умолчанию Config.CACHE_ENABLED; кэшируются только блоки в памяти).
+    profile — профиль препроцессинга "fast", "balanced" или "max-quality"
+    (по умолчанию Config.PREPROCESS_PROFILE).
+    progress — необязательный callback(этап, готово, всего) по страницам.
+    """
+    ext = os.path.splitext(getattr(file_obj, 'name', None) or '')[-1].lower()
+    with span("normalize", bytes=_file_size(file_obj), kind=ext.lstrip('.') or 'image') as sp:
+        # Страницы из текстового слоя не имеют изображения — они нужны только вызывающим с контекстом
+        pages = iter_normalized_pages(file_obj, in_memory=in_memory, use_cache=use_cache, profile=profile,
+                                      progress=progress, text_layer=None if with_context else False)
+        blocks = [block for _, page_blocks in pages for block in page_blocks]
+        sp.set(pages=len({block.page.page_index for block in blocks}), blocks=len(blocks))
+    return blocks if with_context else [block.image for block in blocks]
+
+
+def draw_blocks(image: np.ndarray, blocks: list, page_index: int = 0) -> np.ndarray:
+    """
+    Копия исходной страницы (BGR) с контурами блоков страницы page_index
+    (BlockContext), пересчитанными в её координаты (to_original).
+    """
+    canvas = image.copy()
+    thickness = max(2, round(max(image.shape[:2]) / 500))
+    for block in blocks:
+        if isinstance(block, BlockContext) and block.page.page_index == page_index and block.page.block_boxes:
+            quad = np.round(block.original_bbox).astype(np.int32)
+            cv2.polylines(canvas, [quad.reshape(-1, 1, 2)], True, (0, 0, 255), thickness)
+    return canvas
+
+
+def preview_images(blocks: list) -> list:
+    """
+    Изображения для галереи Gradio: пути отдаются как есть, массивы
+    переводятся в RGB. PNG кодирует сам Gradio только при показе превью.
+    """
+    previews = []
+    for block in blocks:
+        image = block.image if isinstance(block, BlockContext) else block
+        if image is None:  # страница из текстового слоя PDF
+            continue
+        if isinstance(image, np.ndarray):
+            image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        previews.append(image)
+    return previews
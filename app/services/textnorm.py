@@ -0,0 +1,97 @@
+import re
+import string
+from functools import lru_cache
+
+# Версия правил нормализации (часть ключа кэша анализа)
+VERSION = 2
+
+# Латинские буквы, которые OCR путает с кириллическими (одинаковые начертания)
+LATIN_HOMOGLYPHS = {
+    "A": "А", "B": "В", "C": "С", "E": "Е", "H": "Н", "K": "К",
+    "M": "М", "O": "О", "P": "Р", "T": "Т", "X": "Х", "Y": "У",
+    "a": "а", "c": "с", "e": "е", "o": "о", "p": "р", "x": "х", "y": "у",
+}
+# Цифры, которые OCR ставит вместо кириллических букв внутри слова
+DIGIT_HOMOGLYPHS = {"6": "б", "0": "о", "3": "з", "4": "ч", "1": "л"}
+
+_LATIN_TABLE = str.maketrans(LATIN_HOMOGLYPHS)
+_DIGIT_TABLE = str.maketrans(DIGIT_HOMOGLYPHS)
+
+# Латинские буквы без кириллического двойника: слово с ними — настоящее латинское
+_OTHER_LATIN_RE = re.compile("[%s]" % "".join(sorted(set(string.ascii_letters) - set(LATIN_HOMOGLYPHS))))
+_LATIN_RE = re.compile(r"[A-Za-z]")
+_CYRILLIC_RE = re.compile(r"[А-Яа-яЁё]")
+_NEEDS_FIX_RE = re.compile(r"[A-Za-z]|\d[^\W\d_]|[^\W\d_]\d")
+# Один проход по строке: адреса почты, ссылки и домены пропускаются целиком (в них латиница
+# настоящая), в callback попадают только слова с латиницей или цифрами рядом с буквами
+_TOKEN_RE = re.compile(
+    r"(?P<protected>(?<![\w.+-])[\w.+-]+@[\w-]+(?:\.[\w-]+)+|(?:https?://|www\.)\S+|\b[\w-]+\.(?:ru|com|org|net|рф)\b)"
+    r"|\b(?=[^\W_]*(?:[A-Za-z]|\d[^\W\d_]|[^\W\d_]\d))[^\W_]+"
+)
+# Одиночная цифра между буквами: `п0дпись`, но не `3шт`, `0МВД` или `2024г`
+_INNER_DIGIT_RE = re.compile(r"(?<=[^\W\d_])\d(?=[^\W\d_])")
+_SPACES_RE = re.compile(r"[ \t\u00a0]+")
+_TRAILING_RE = re.compile(r" +(?=\n)|(?<=\n) +")
+_BLANK_LINES_RE = re.compile(r"\n{3,}")
+
+
+def _fix_word(word: str, cyrillic_line) -> str:
+    """
+    Исправление одного слова:
+    - смесь кириллицы и латиницы, где вся латиница — двойники кириллицы
+      (`Pоссия`), переводится в кириллицу;
+    - слово только из латинских двойников (`OOO`, `A123BC`) — только в строке,
+      где кириллицы больше, чем латиницы (cyrillic_line() вычисляется лениво);
+    - цифры-двойники внутри кириллического слова (`п0дпись`) — только одиночные
+      цифры с буквами с обеих сторон и если букв больше, чем цифр; количества
+      с единицами (`3шт`, `1кг`), `0МВД`, `2024г`, `1990года` не трогаем.
+    Настоящие латинские слова (есть буквы без кириллического двойника) не меняются.
+    """
+    if _LATIN_RE.search(word):
+        if _OTHER_LATIN_RE.search(word):
+            return word
+        if not _CYRILLIC_RE.search(word) and not cyrillic_line():
+            return word
+        word = word.translate(_LATIN_TABLE)
+    digits = sum(map(str.isdigit, word))
+    if digits and digits < len(word) - digits:
+        word = _INNER_DIGIT_RE.sub(lambda m: m.group().translate(_DIGIT_TABLE), word)
+    return word
+
+
+def _fix_line(line: str) -> str:
+    script = []
+
+    def cyrillic_line():
+        # Письменность строки считается только при необходимости и один раз
+        if not script:
+            script.append(len(_CYRILLIC_RE.findall(line)) > len(_LATIN_RE.findall(line)))
+        return script[0]
+
+    def fix(match):
+        return match.group() if match.group("protected") else _fix_word(match.group(), cyrillic_line)
+
+    return _TOKEN_RE.sub(fix, line)
+
+
+def _fix_words(text: str) -> str:
+    # Строки без латиницы и без цифр рядом с буквами (обычно большинство) не разбираются по словам
+    lines = text.split("\n")
+    for i, line in enumerate(lines):
+        if _NEEDS_FIX_RE.search(line):
+            lines[i] = _fix_line(line)
+    return "\n".join(lines)
+
+
+@lru_cache(maxsize=16)
+def normalize_text(text: str) -> str:
+    """
+    Нормализация текста OCR перед LLM: исправление двойников по словам
+    (см. _fix_word) с учётом письменности строки, схлопывание пробелов
+    и пустых строк. Границы страниц (\\f) и абзацев сохраняются.
+    Результат кэшируется: на один документ нормализация выполняется один раз.
+    """
+    text = _SPACES_RE.sub(" ", text)
+    text = _TRAILING_RE.sub("", text)
+    text = _BLANK_LINES_RE.sub("\n\n", text)
+    return _fix_words(text).strip()
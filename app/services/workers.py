@@ -0,0 +1,173 @@
+import gc
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from app.config import Config
+from app.services import inference, models
+from app.services.preprocessor import BlockContext
+
+logger = logging.getLogger(__name__)
+
+
+def pack_blocks(blocks):
+    """
+    Изображения блоков (np.ndarray) копируются в один сегмент общей памяти.
+    Возвращает (сегмент или None, блоки без изображений, раскладка
+    [(индекс блока, смещение, shape, dtype)]). Пути к файлам передаются как есть.
+    """
+    layout, offset = [], 0
+    for i, block in enumerate(blocks):
+        image = block.image if isinstance(block, BlockContext) else block
+        if isinstance(image, np.ndarray):
+            layout.append((i, offset, image.shape, image.dtype.str))
+            offset += image.nbytes
+    if not layout:
+        return None, list(blocks), []
+
+    shm = SharedMemory(create=True, size=offset)
+    stripped = list(blocks)
+    for i, start, shape, dtype in layout:
+        block = blocks[i]
+        image = block.image if isinstance(block, BlockContext) else block
+        np.ndarray(shape, dtype, buffer=shm.buf, offset=start)[...] = image
+        stripped[i] = BlockContext(None, block.page, block.index) if isinstance(block, BlockContext) else None
+    return shm, stripped, layout
+
+
+def _run_shared(fn, shm_name, blocks, layout):
+    """В процессе-обработчике: блоки — представления над общей памятью, без копирования."""
+    shm = SharedMemory(name=shm_name)
+    try:
+        for i, start, shape, dtype in layout:
+            image = np.ndarray(shape, dtype, buffer=shm.buf, offset=start)
+            blocks[i] = BlockContext(image, blocks[i].page, blocks[i].index) if blocks[i] is not None else image
+        return fn(blocks)
+    finally:
+        del blocks[:]
+        image = None
+        gc.collect()
+        try:
+            shm.close()
+        except BufferError:
+            # На сегмент ещё есть ссылки; он освободится при удалении (unlink) в родителе
+            logger.warning("Сегмент %s остался отображённым в обработчике", shm_name)
+
+
+def _init_worker(processes):
+    # Потоки torch делятся между обработчиками; модели уже в памяти (унаследованы от родителя)
+    inference.configure(processes=processes, force=True)
+
+
+class WorkerPool:
+    """
+    Пул процессов-обработчиков, созданных fork после загрузки моделей в родителе:
+    веса не копируются, а разделяются copy-on-write. gc.freeze перед fork убирает
+    уже созданные объекты из сборки мусора, чтобы её обходы не «пачкали» общие страницы.
+    Интерфейс — как у Executor: submit(fn, blocks) -> Future; изображения блоков
+    передаются через общую память (pack_blocks). Если обработчик аварийно
+    завершился, пул становится неисправным (broken): пересоздать его fork
+    из уже многопоточного процесса нельзя, и executor() перестаёт его отдавать.
+    """
+
+    def __init__(self, processes=None):
+        self.processes = processes or Config.WORKER_POOL_SIZE or os.cpu_count() or 1
+        self.broken = False
+        models.warm_up()
+        gc.freeze()
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.processes,
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=_init_worker,
+            initargs=(self.processes,),
+        )
+        # С fork все процессы создаются при первой задаче — создаём их сразу, пока родитель ещё не занят
+        self._executor.submit(os.getpid).result()
+        logger.info("Пул обработчиков: %d процессов", self.processes)
+
+    def _mark_broken(self):
+        if not self.broken:
+            self.broken = True
+            logger.error("Обработчик пула завершился аварийно: дальше обработка в процессе")
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _check(self, future):
+        if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+            self._mark_broken()
+
+    def submit(self, fn, blocks):
+        shm, stripped, layout = pack_blocks(blocks)
+        try:
+            if shm is None:
+                future = self._executor.submit(fn, stripped)
+            else:
+                future = self._executor.submit(_run_shared, fn, shm.name, stripped, layout)
+        except BaseException as e:
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+            if isinstance(e, BrokenProcessPool):
+                self._mark_broken()
+            raise
+
+        def release(_):
+            shm.close()
+            shm.unlink()
+
+        if shm is not None:
+            future.add_done_callback(release)
+        future.add_done_callback(self._check)
+        return future
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_warned = False
+
+
+def start() -> WorkerPool:
+    """
+    Создаёт общий пул процесса. Вызывается при старте, пока в процессе один поток:
+    fork из многопоточного процесса копирует только текущий поток, а блокировки
+    остальных остаются захваченными навсегда. Иначе — RuntimeError.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            threads = [t.name for t in threading.enumerate() if t is not threading.current_thread()]
+            if threads:
+                raise RuntimeError(f"Пул обработчиков нужно создать до запуска потоков: {', '.join(threads)}")
+            _pool = WorkerPool()
+    return _pool
+
+
+def get_pool() -> Optional[WorkerPool]:
+    """Пул, созданный start(), или None."""
+    return _pool
+
+
+def executor() -> Optional[WorkerPool]:
+    """
+    Пул обработчиков, если он включён (Config.WORKER_POOL), создан при старте (start)
+    и исправен, иначе None — обработка в текущем процессе. Лениво и после аварии
+    обработчика пул не создаётся: к моменту запроса процесс уже многопоточный.
+    """
+    global _warned
+    if not Config.WORKER_POOL:
+        return None
+    if _pool is None and not _warned:
+        _warned = True
+        logger.warning("WORKER_POOL включён, но пул не создан при старте (workers.start): обработка в процессе")
+    if _pool is not None and _pool.broken:
+        return None
+    return _pool
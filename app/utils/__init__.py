@@ -1,2 +1,3 @@
 # Пакет для вспомогательных утилит
 from .logger import setup_logging
+from .memory import current_rss, peak_rss
@@ -0,0 +1,17 @@
+import os
+import resource
+
+
+def current_rss() -> int:
+    """Текущий резидентный объём памяти процесса в байтах (0, если недоступно)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def peak_rss() -> int:
+    """Пиковый резидентный объём памяти процесса в байтах."""
+    # ru_maxrss в Linux указывается в килобайтах
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
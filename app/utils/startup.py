@@ -0,0 +1,25 @@
+import threading
+import time
+
+_started_at = time.perf_counter()
+_last_mark = _started_at
+_stages = []
+_lock = threading.Lock()
+
+
+def mark(stage: str) -> None:
+    """Отмечает завершение этапа запуска (время считается от предыдущей отметки)."""
+    global _last_mark
+    with _lock:
+        now = time.perf_counter()
+        _stages.append({"stage": stage, "seconds": round(now - _last_mark, 3)})
+        _last_mark = now
+
+
+def report() -> dict:
+    """Отчёт о времени запуска: этапы и общее время с импорта пакета app."""
+    with _lock:
+        return {
+            "total_seconds": round(_last_mark - _started_at, 3),
+            "stages": list(_stages),
+        }
@@ -0,0 +1,148 @@
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from app.config import Config
+
+logger = logging.getLogger("doc2text.trace")
+
+# Границы гистограммы длительностей (секунды): от шагов препроцессинга до вызовов LLM
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_local = threading.local()
+
+
+class Span:
+    """Открытый участок трассировки; attrs дополняются по ходу (байты, страницы, блоки)."""
+
+    __slots__ = ("name", "attrs", "parent", "started")
+
+    def __init__(self, name, attrs, parent):
+        self.name = name
+        self.attrs = attrs
+        self.parent = parent
+        self.started = time.perf_counter()
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+
+class _Histogram:
+    __slots__ = ("buckets", "count", "sum", "errors", "totals")
+
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.errors = 0
+        self.totals = {}
+
+
+class Registry:
+    """Агрегаты по участкам: гистограмма длительностей, ошибки, суммы числовых атрибутов."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._spans = {}
+
+    def observe(self, name, seconds, attrs, error=False):
+        with self._lock:
+            hist = self._spans.get(name)
+            if hist is None:
+                hist = self._spans[name] = _Histogram()
+            hist.count += 1
+            hist.sum += seconds
+            hist.errors += error
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    hist.buckets[i] += 1
+            for key, value in attrs.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    hist.totals[key] = hist.totals.get(key, 0) + value
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                name: {"count": h.count, "sum": h.sum, "errors": h.errors,
+                       "buckets": list(h.buckets), "totals": dict(h.totals)}
+                for name, h in self._spans.items()
+            }
+
+    def clear(self):
+        with self._lock:
+            self._spans.clear()
+
+
+registry = Registry()
+
+
+@contextmanager
+def span(name, **attrs):
+    """
+    Замеряет участок кода: длительность попадает в registry (для /metrics),
+    а при Config.TRACE_LOG — ещё и в структурный лог (JSON на строку).
+    Вложенные участки знают родителя (в пределах потока).
+    """
+    if not Config.TRACE_ENABLED:
+        yield Span(name, attrs, None)
+        return
+    parent = getattr(_local, "current", None)
+    current = _local.current = Span(name, attrs, parent)
+    error = None
+    try:
+        yield current
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        _local.current = parent
+        seconds = time.perf_counter() - current.started
+        registry.observe(name, seconds, current.attrs, error=error is not None)
+        if Config.TRACE_LOG:
+            record = {"span": name, "seconds": round(seconds, 6), **current.attrs}
+            if parent is not None:
+                record["parent"] = parent.name
+            if error:
+                record["error"] = error
+            logger.info(json.dumps(record, ensure_ascii=False, default=str))
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render_prometheus(extra=None):
+    """
+    Текстовый формат Prometheus: doc2text_span_seconds (гистограмма по участкам),
+    doc2text_span_errors_total и doc2text_span_<атрибут>_total (например, bytes, pages).
+    extra — дополнительные метрики {имя: значение} (gauge без меток).
+    """
+    spans = registry.snapshot()
+    lines = [
+        "# HELP doc2text_span_seconds Длительность участков конвейера",
+        "# TYPE doc2text_span_seconds histogram",
+    ]
+    for name, h in sorted(spans.items()):
+        label = f'span="{_label(name)}"'
+        for bound, count in zip(BUCKETS, h["buckets"]):
+            lines.append(f'doc2text_span_seconds_bucket{{{label},le="{bound}"}} {count}')
+        lines.append(f'doc2text_span_seconds_bucket{{{label},le="+Inf"}} {h["count"]}')
+        lines.append(f"doc2text_span_seconds_sum{{{label}}} {h['sum']:.6f}")
+        lines.append(f"doc2text_span_seconds_count{{{label}}} {h['count']}")
+
+    lines += ["# HELP doc2text_span_errors_total Участки, завершившиеся исключением",
+              "# TYPE doc2text_span_errors_total counter"]
+    lines += [f'doc2text_span_errors_total{{span="{_label(name)}"}} {h["errors"]}' for name, h in sorted(spans.items())]
+
+    totals = sorted({key for h in spans.values() for key in h["totals"]})
+    for key in totals:
+        metric = f"doc2text_span_{key}_total"
+        lines += [f"# HELP {metric} Сумма атрибута {key} по участкам", f"# TYPE {metric} counter"]
+        lines += [f'{metric}{{span="{_label(name)}"}} {h["totals"][key]:g}'
+                  for name, h in sorted(spans.items()) if key in h["totals"]]
+
+    for metric, value in sorted((extra or {}).items()):
+        lines += [f"# TYPE {metric} gauge", f"{metric} {value:g}"]
+    return "\n".join(lines) + "\n"
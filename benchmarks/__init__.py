@@ -0,0 +1 @@
+# Бенчмарки этапов конвейера (запуск: python -m benchmarks.<модуль>)
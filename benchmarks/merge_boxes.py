@@ -0,0 +1,102 @@
+"""
+Бенчмарк merge_overlapping_boxes на синтетических страницах.
+
+    python -m benchmarks.merge_boxes --sizes 100 1000 10000 --layouts text form
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from app.services.preprocessor import merge_overlapping_boxes
+
+
+def synthetic_page_boxes(n, layout="text", seed=0, width=2480):
+    """
+    n боксов слов EasyOCR в случайном порядке (ширина страницы A4 при 300 dpi,
+    высота растёт с n).
+    layout="text" — абзацы по 3-8 строк (строки внутри абзаца ближе eps=50,
+    абзацы дальше); layout="form" — сетка полей с зазорами больше eps,
+    почти ничего не сливается (худший случай для прежней реализации).
+    """
+    rng = np.random.default_rng(seed)
+    boxes = []
+    if layout == "form":
+        columns = width // 140
+        for k in range(n):
+            left, top = (k % columns) * 140 + 20, (k // columns) * 100 + 20
+            w, h = int(rng.integers(40, 80)), int(rng.integers(20, 40))
+            boxes.append([[left, top], [left + w, top], [left + w, top + h], [left, top + h]])
+    else:
+        x, y, lines_left = 0, 0, int(rng.integers(3, 9))
+        while len(boxes) < n:
+            word = int(rng.integers(40, 160))
+            if x + word > width - 80:
+                x, y, lines_left = 0, y + 70, lines_left - 1
+                if lines_left == 0:
+                    y, lines_left = y + 120, int(rng.integers(3, 9))  # разрыв абзаца
+            top = y + int(rng.integers(0, 4))
+            left = 40 + x
+            boxes.append([[left, top], [left + word, top], [left + word, top + 40], [left, top + 40]])
+            x += word + int(rng.integers(15, 35))
+    order = rng.permutation(len(boxes))
+    return [boxes[i] for i in order]
+
+
+def _legacy_merge(boxes, eps=50):
+    """Прежняя жадная реализация (один проход, без повторной проверки слитых блоков)."""
+    merged = []
+    for box in boxes:
+        xs, ys = [p[0] for p in box], [p[1] for p in box]
+        minx, maxx, miny, maxy = min(xs), max(xs), min(ys), max(ys)
+        for i, (mx1, my1, mx2, my2) in enumerate(merged):
+            if not (maxx < mx1 - eps or minx > mx2 + eps or maxy < my1 - eps or miny > my2 + eps):
+                merged[i] = (min(minx, mx1), min(miny, my1), max(maxx, mx2), max(maxy, my2))
+                break
+        else:
+            merged.append((minx, miny, maxx, maxy))
+    return merged
+
+
+def _best_of(func, boxes, eps, repeat):
+    best, result = float("inf"), None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(boxes, eps=eps)
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def run(sizes, layouts=("text", "form"), eps=50, repeat=3, legacy=True):
+    results = []
+    for layout in layouts:
+        for n in sizes:
+            results.append(_run_one(n, layout, eps, repeat, legacy))
+    return results
+
+
+def _run_one(n, layout, eps, repeat, legacy):
+    boxes = synthetic_page_boxes(n, layout)
+    seconds, merged = _best_of(merge_overlapping_boxes, boxes, eps, repeat)
+    row = {"layout": layout, "boxes": n, "blocks": len(merged), "seconds": round(seconds, 4)}
+    if legacy:
+        legacy_seconds, legacy_merged = _best_of(_legacy_merge, boxes, eps, repeat)
+        row.update(legacy_seconds=round(legacy_seconds, 4), legacy_blocks=len(legacy_merged))
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк слияния боксов EasyOCR.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--layouts", nargs="+", default=["text", "form"], choices=["text", "form"])
+    parser.add_argument("--eps", type=float, default=50)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--no-legacy", action="store_true", help="не сравнивать с прежней реализацией")
+    args = parser.parse_args()
+    for row in run(args.sizes, args.layouts, args.eps, args.repeat, legacy=not args.no_legacy):
+        print(json.dumps(row))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Точность и скорость OCR в fp32 и int8 (динамическое квантование) на examples/.
+
+    python -m benchmarks.quantization --engines docTR easyocr --repeat 3 --output quant.json
+
+Для каждого движка модель загружается в обоих вариантах; эталон — текст fp32.
+agreement — доля совпадающих символов int8 с fp32 (1.0 — текст не изменился),
+speedup — отношение медианных задержек fp32 / int8.
+"""
+import argparse
+import difflib
+import json
+import time
+
+import numpy as np
+
+from app.config import Config
+from app.services import inference, models, ocr
+from benchmarks.stages import example_pages
+
+ENGINES = dict(ocr.ENGINES)
+
+
+def _run_variant(name, pages, quantized, repeat):
+    others = Config.OCR_QUANTIZE - {name}
+    Config.OCR_QUANTIZE = others | {name} if quantized else others
+    models.registry.unload(name)
+    started = time.perf_counter()
+    models.registry.get(name)
+    load_seconds = time.perf_counter() - started
+
+    texts, latencies = [], []
+    for page in pages:
+        ENGINES[name]([page])  # прогрев на странице
+        times = []
+        for _ in range(repeat):
+            call = time.perf_counter()
+            text = ENGINES[name]([page])[0][0]
+            times.append(time.perf_counter() - call)
+        texts.append(text or "")
+        latencies.append(float(np.median(times)))
+    return texts, {
+        "load_seconds": round(load_seconds, 3),
+        "p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 1),
+        "total_seconds": round(sum(latencies), 3),
+    }
+
+
+def compare_engine(name, pages, repeat=3):
+    original = Config.OCR_QUANTIZE
+    try:
+        reference, fp32 = _run_variant(name, pages, quantized=False, repeat=repeat)
+        texts, int8 = _run_variant(name, pages, quantized=True, repeat=repeat)
+    finally:
+        Config.OCR_QUANTIZE = original
+        models.registry.unload(name)
+    agreement = [difflib.SequenceMatcher(None, a, b, autojunk=False).ratio() for a, b in zip(reference, texts)]
+    return {
+        "fp32": fp32,
+        "int8": int8,
+        "speedup": round(fp32["total_seconds"] / int8["total_seconds"], 2) if int8["total_seconds"] else None,
+        "agreement_mean": round(float(np.mean(agreement)), 4),
+        "agreement_min": round(float(np.min(agreement)), 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение fp32 и int8 для движков OCR.")
+    parser.add_argument("--engines", nargs="+", default=list(inference.QUANTIZABLE), choices=list(inference.QUANTIZABLE))
+    parser.add_argument("--repeat", type=int, default=3, help="замеров на страницу (берётся медиана)")
+    parser.add_argument("--output", help="сохранить отчёт в JSON")
+    args = parser.parse_args()
+
+    pages = example_pages()
+    report = {"meta": {"pages": len(pages), "inference": inference.configure()}, "engines": {}}
+    for name in args.engines:
+        try:
+            report["engines"][name] = compare_engine(name, pages, args.repeat)
+        except Exception as e:
+            report["engines"][name] = {"skipped": f"{type(e).__name__}: {e}"}
+        print(json.dumps({name: report["engines"][name]}, ensure_ascii=False), flush=True)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
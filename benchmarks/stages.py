@@ -0,0 +1,317 @@
+"""
+Бенчмарк этапов конвейера на документах из examples/ и синтетических страницах/PDF.
+
+    python -m benchmarks.stages --pages 10 --size 1654 2339 --pdf-pages 5 --output bench.json
+    python -m benchmarks.stages --stages preprocess merge_boxes --baseline bench.json
+
+Для каждого этапа: страниц (вызовов) в секунду, p50/p95 задержки и пиковый RSS
+за время этапа. Этапы, которым не хватает моделей или poppler, помечаются skipped.
+С --baseline этапы, ставшие медленнее допуска, выводятся как регрессии (код выхода 1).
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import tempfile
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from app.config import Config
+from app.services import analyzer, cache, llm, ocr, preprocessor
+from app.utils.memory import current_rss, peak_rss
+from benchmarks.merge_boxes import synthetic_page_boxes
+
+EXAMPLES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "examples")
+
+_WORDS = ("invoice", "total", "date", "number", "amount", "client", "address", "passport", "issued", "2024")
+
+
+def synthetic_page(width=1654, height=2339, seed=0, noise=8.0):
+    """Страница с абзацами печатного текста (BGR), лёгкий шум и наклон до 1 градуса."""
+    rng = np.random.default_rng(seed)
+    page = np.full((height, width, 3), 255, dtype=np.uint8)
+    y = 120
+    while y < height - 120:
+        for _ in range(int(rng.integers(3, 9))):
+            words = rng.choice(_WORDS, size=int(rng.integers(4, 10)))
+            cv2.putText(page, " ".join(words), (100, y), cv2.FONT_HERSHEY_SIMPLEX, 1.1, (20, 20, 20), 2)
+            y += 55
+            if y >= height - 120:
+                break
+        y += 70
+    if noise:
+        page = np.clip(page + rng.normal(0, noise, page.shape), 0, 255).astype(np.uint8)
+    matrix = cv2.getRotationMatrix2D((width / 2, height / 2), float(rng.uniform(-1, 1)), 1.0)
+    return cv2.warpAffine(page, matrix, (width, height), borderValue=(255, 255, 255))
+
+
+def synthetic_pdf(path, pages, dpi=200, **page_kwargs):
+    """Сканированный PDF (страницы — изображения без текстового слоя)."""
+    from PIL import Image
+
+    images = [Image.fromarray(cv2.cvtColor(synthetic_page(seed=i, **page_kwargs), cv2.COLOR_BGR2RGB))
+              for i in range(pages)]
+    images[0].save(path, save_all=True, append_images=images[1:], resolution=dpi)
+    return path
+
+
+def example_pages(directory=EXAMPLES_DIR):
+    pages = []
+    for path in sorted(glob.glob(os.path.join(directory, "*"))):
+        image = cv2.imread(path)
+        if image is not None:
+            pages.append(image)
+    return pages
+
+
+def _ocr_text(seed, lines=12):
+    rng = np.random.default_rng(seed)
+    return "\n".join(" ".join(rng.choice(_WORDS, size=int(rng.integers(4, 10)))) for _ in range(lines))
+
+
+def _corrupt(text, rng, rate=0.05):
+    """Вариант текста «другого движка»: часть символов заменена."""
+    chars = list(text)
+    for i in rng.choice(len(chars), size=int(len(chars) * rate), replace=False):
+        if chars[i] not in "\n ":
+            chars[i] = "0" if chars[i].isalpha() else "o"
+    return "".join(chars)
+
+
+class _RssSampler:
+    """Пиковый RSS процесса за время блока with (опрос в фоновом потоке)."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, current_rss())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = current_rss()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+
+
+def measure(func, items, pages_per_item=1, warmup=True):
+    """
+    Вызывает func для каждого элемента и возвращает метрики этапа.
+    Первый вызов при warmup=True не учитывается (ленивые модели, кэши OpenCV).
+    """
+    if warmup and items:
+        func(items[0])
+    latencies = []
+    with _RssSampler() as rss:
+        started = time.perf_counter()
+        for item in items:
+            call = time.perf_counter()
+            func(item)
+            latencies.append(time.perf_counter() - call)
+        total = time.perf_counter() - started
+    return {
+        "calls": len(items),
+        "pages": len(items) * pages_per_item,
+        "seconds": round(total, 4),
+        "pages_per_sec": round(len(items) * pages_per_item / total, 3) if total else None,
+        "p50_ms": round(float(np.percentile(latencies, 50)) * 1000, 3),
+        "p95_ms": round(float(np.percentile(latencies, 95)) * 1000, 3),
+        "peak_rss_mb": round(rss.peak / 2 ** 20, 1),
+    }
+
+
+# -----------------------------------------------------------------------------
+#                          Этапы: name -> [(метрика, func, items, страниц на вызов)]
+# -----------------------------------------------------------------------------
+
+def _tiled(func, image):
+    """Шаг препроцессинга с тайлами (Config.PREPROCESS_TILED) независимо от настроек и размера."""
+    saved = Config.PREPROCESS_TILED, Config.PREPROCESS_TILE_MIN_PIXELS
+    Config.PREPROCESS_TILED, Config.PREPROCESS_TILE_MIN_PIXELS = True, 0
+    try:
+        return func(image)
+    finally:
+        Config.PREPROCESS_TILED, Config.PREPROCESS_TILE_MIN_PIXELS = saved
+
+
+def _preprocess_cases(pages, args):
+    cases = [(f"preprocess_image[{profile}]", lambda img, p=profile: preprocessor.preprocess_image(img, p), pages, 1)
+             for profile in preprocessor.PREPROCESS_PROFILES]
+    gray = [cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) for img in pages]
+    steps = {
+        "contrast": preprocessor.enhance_contrast,
+        "denoise": preprocessor.denoise_image,
+        "sharpen": preprocessor.sharpen_image,
+        "binarize": preprocessor.binarize_image,
+    }
+    cases += [(f"step[{name}]", func, gray, 1) for name, func in steps.items()]
+    cases += [(f"step[{name},tiled]", lambda img, f=steps[name]: _tiled(f, img), gray, 1)
+              for name in ("denoise", "sharpen", "binarize")]
+    cases.append(("measure_quality", preprocessor.measure_quality, pages, 1))
+    cases.append(("page_geometry", preprocessor.page_geometry, pages, 1))
+    cases.append(("page_resolution", preprocessor.page_resolution, pages, 1))
+    return cases
+
+
+def _merge_boxes_cases(pages, args):
+    # Чередуем раскладки: абзацы текста и формы (худший случай, почти ничего не сливается)
+    boxes = [synthetic_page_boxes(args.boxes, ("text", "form")[i % 2], seed=i) for i in range(len(pages))]
+    return [("merge_overlapping_boxes", preprocessor.merge_overlapping_boxes, boxes, 1)]
+
+
+def _split_cases(pages, args):
+    return [(f"split_image_by_ocr[{mode}]", lambda img, m=mode: preprocessor.split_image_by_ocr(img, mode=m), pages, 1)
+            for mode in ("detect", "full")]
+
+
+def _ocr_cases(pages, args):
+    return [(f"ocr[{name}]", lambda img, run=run: run([img]), pages, 1) for name, run in ocr.ENGINES]
+
+
+def _fusion_cases(pages, args):
+    rng = np.random.default_rng(0)
+    samples = []
+    for i in range(len(pages)):
+        text = _ocr_text(i)
+        samples.append([text, _corrupt(text, rng), _corrupt(text, rng, rate=0.1)])
+    return [("merge_ocr_results", ocr.merge_ocr_results, samples, 1)]
+
+
+def _analyzer_cases(pages, args):
+    texts = ["\f".join(_ocr_text(i * 10 + k, lines=40) for k in range(3)) for i in range(len(pages))]
+
+    def run(text):
+        return analyzer.process_document_pipeline(text, use_cache=False)
+
+    return [("analyzer[stub]", run, texts, 3)]
+
+
+def _pdf_cases(pages, args):
+    if not args.pdf_pages:
+        return []
+    path = synthetic_pdf(os.path.join(args.workdir, "synthetic.pdf"), args.pdf_pages,
+                         dpi=args.dpi, width=args.size[0], height=args.size[1])
+
+    def render(pdf):
+        for _ in preprocessor.iter_pdf_pages(pdf, range(1, args.pdf_pages + 1), dpi=args.dpi):
+            pass
+
+    def normalize(pdf):
+        with open(pdf, "rb") as f:
+            preprocessor.normalize_pdf(f, with_context=True, in_memory=True)
+
+    return [("pdf_render", render, [path], args.pdf_pages),
+            ("normalize_pdf", normalize, [path], args.pdf_pages)]
+
+
+STAGES = {
+    "preprocess": _preprocess_cases,
+    "merge_boxes": _merge_boxes_cases,
+    "split": _split_cases,
+    "ocr": _ocr_cases,
+    "fusion": _fusion_cases,
+    "analyzer": _analyzer_cases,
+    "pdf": _pdf_cases,
+}
+
+
+def run(args):
+    pages = []
+    if not args.no_examples:
+        pages += example_pages()
+    pages += [synthetic_page(args.size[0], args.size[1], seed=i) for i in range(args.pages)]
+
+    # Анализатор меряется офлайн, без сети и без кэша результатов
+    llm.set_backend(llm.StubBackend())
+    cache.store = cache.ResultCache()
+
+    results = {}
+    for stage in args.stages:
+        try:
+            cases = STAGES[stage](pages, args)
+        except Exception as e:
+            results[stage] = {"skipped": f"{type(e).__name__}: {e}"}
+            continue
+        for name, func, items, pages_per_item in cases:
+            try:
+                results[name] = measure(func, items, pages_per_item)
+            except Exception as e:
+                results[name] = {"skipped": f"{type(e).__name__}: {e}"}
+            print(json.dumps({name: results[name]}, ensure_ascii=False), flush=True)
+
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "opencv_threads": cv2.getNumThreads(),
+            "pages": len(pages),
+            "page_size": list(args.size),
+            "pdf_pages": args.pdf_pages,
+            "peak_rss_mb": round(peak_rss() / 2 ** 20, 1),
+        },
+        "stages": results,
+    }
+
+
+def compare(current, baseline, tolerance=0.2):
+    """Этапы, у которых p50 выросла или пропускная способность упала больше чем на tolerance."""
+    regressions = []
+    for name, row in current["stages"].items():
+        old = baseline.get("stages", {}).get(name)
+        if not old or "skipped" in row or "skipped" in old:
+            continue
+        if row["p50_ms"] > old["p50_ms"] * (1 + tolerance) or \
+                (old["pages_per_sec"] and row["pages_per_sec"] < old["pages_per_sec"] * (1 - tolerance)):
+            regressions.append({"stage": name, "p50_ms": [old["p50_ms"], row["p50_ms"]],
+                                "pages_per_sec": [old["pages_per_sec"], row["pages_per_sec"]]})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк этапов конвейера.")
+    parser.add_argument("--stages", nargs="+", default=list(STAGES), choices=list(STAGES))
+    parser.add_argument("--pages", type=int, default=5, help="число синтетических страниц")
+    parser.add_argument("--size", type=int, nargs=2, default=[1654, 2339], metavar=("W", "H"),
+                        help="размер синтетической страницы (по умолчанию A4 при 200 dpi)")
+    parser.add_argument("--no-examples", action="store_true", help="не использовать изображения из examples/")
+    parser.add_argument("--boxes", type=int, default=1000, help="боксов на страницу для merge_overlapping_boxes")
+    parser.add_argument("--pdf-pages", type=int, default=3, help="страниц в синтетическом PDF (0 — без PDF)")
+    parser.add_argument("--dpi", type=int, default=200)
+    parser.add_argument("--output", help="сохранить результаты в JSON")
+    parser.add_argument("--baseline", help="JSON прошлого запуска для поиска регрессий")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        args.workdir = workdir
+        report = run(args)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for row in regressions:
+            print("РЕГРЕССИЯ", json.dumps(row, ensure_ascii=False))
+        if regressions:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
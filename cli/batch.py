@@ -0,0 +1,166 @@
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+# Расширения, которые пакетный режим берёт из каталогов
+SUPPORTED_EXTENSIONS = {'.pdf', '.png', '.jpg', '.jpeg', '.tif', '.tiff', '.bmp', '.webp'}
+
+
+def collect_files(inputs):
+    """
+    Файлы из аргументов: каталоги (рекурсивно, только SUPPORTED_EXTENSIONS),
+    glob-шаблоны (** поддерживается) и отдельные файлы. Порядок стабильный, без повторов.
+    """
+    found = []
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, _, files in os.walk(item):
+                found.extend(
+                    os.path.join(root, name) for name in files
+                    if os.path.splitext(name)[1].lower() in SUPPORTED_EXTENSIONS
+                )
+        elif glob.has_magic(item):
+            found.extend(path for path in glob.glob(item, recursive=True) if os.path.isfile(path))
+        else:
+            found.append(item)
+    return list(dict.fromkeys(sorted(os.path.abspath(path) for path in found)))
+
+
+def read_checkpoint(output_path, retry_failed=False):
+    """
+    Файлы, уже записанные в выходной JSONL (он же контрольная точка).
+    Оборванная последняя строка после сбоя пропускается.
+    """
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    with open(output_path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get('status') == 'ok' or not retry_failed:
+                done.add(record.get('file'))
+    return done
+
+
+def drop_partial_line(output_path, chunk_size=65536):
+    """
+    Обрезает выходной JSONL до последней полной строки: запись, оборванная
+    сбоем, иначе склеилась бы со следующей дописанной записью.
+    """
+    if not os.path.exists(output_path):
+        return
+    with open(output_path, 'rb+') as f:
+        end = f.seek(0, os.SEEK_END)
+        position = end
+        while position > 0:
+            start = max(0, position - chunk_size)
+            f.seek(start)
+            newline = f.read(position - start).rfind(b'\n')
+            if newline >= 0:
+                position = start + newline + 1
+                break
+            position = start
+        if position != end:
+            f.truncate(position)
+
+
+def _init_worker(workers=1):
+    # Потоки torch делятся между процессами; модели загружаются один раз на процесс, а не на каждый файл
+    from app.services import inference, models
+    inference.configure(processes=workers)
+    models.warm_up()
+
+
+def _process_one(path, profile):
+    from app.services import pipeline
+
+    started = time.perf_counter()
+    record = {'file': path}
+    try:
+        result = pipeline.process_path(path, profile=profile)
+        result['ocr'] = {k: v for k, v in result['ocr'].items() if k != 'visual'}
+        record.update(status='ok', result=result)
+    except Exception as e:
+        record.update(status='error', error=f'{type(e).__name__}: {e}')
+    record['seconds'] = round(time.perf_counter() - started, 3)
+    return record
+
+
+def _format_eta(seconds):
+    seconds = int(seconds)
+    return f'{seconds // 3600:d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}'
+
+
+class Progress:
+    """Пропускная способность и ETA в stderr не чаще раза в interval секунд."""
+
+    def __init__(self, total, interval=5.0, stream=sys.stderr):
+        self.total = total
+        self.interval = interval
+        self.stream = stream
+        self.done = self.failed = 0
+        self.started = self._last = time.monotonic()
+
+    def update(self, record, force=False):
+        self.done += 1
+        self.failed += record['status'] != 'ok'
+        now = time.monotonic()
+        if not force and now - self._last < self.interval and self.done < self.total:
+            return
+        self._last = now
+        elapsed = max(now - self.started, 1e-9)
+        rate = self.done / elapsed
+        eta = (self.total - self.done) / rate if rate else 0
+        print(
+            f'[{self.done}/{self.total}] ошибок: {self.failed}, '
+            f'{rate * 60:.1f} файлов/мин, осталось ~{_format_eta(eta)}',
+            file=self.stream, flush=True,
+        )
+
+
+def run_batch(inputs, output_path, workers=None, profile=None, retry_failed=False, max_pending=None):
+    """
+    Обрабатывает файлы в пуле процессов (модели загружаются один раз на процесс)
+    и дописывает результаты в JSONL по мере готовности. Уже записанные файлы
+    пропускаются, поэтому после сбоя запуск продолжается с места остановки.
+    Возвращает {"total", "skipped", "processed", "failed"}.
+    """
+    files = collect_files(inputs)
+    done = read_checkpoint(output_path, retry_failed=retry_failed)
+    todo = [path for path in files if path not in done]
+    workers = workers or os.cpu_count() or 1
+    max_pending = max_pending or workers * 2
+    summary = {'total': len(files), 'skipped': len(files) - len(todo), 'processed': 0, 'failed': 0}
+    if not todo:
+        return summary
+
+    drop_partial_line(output_path)
+    progress = Progress(len(todo))
+    remaining = iter(todo)
+    with open(output_path, 'a', encoding='utf-8') as out, \
+            ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(workers,)) as pool:
+        pending = set()
+        while True:
+            # Держим в очереди не больше max_pending файлов: список задач не растёт с размером выборки
+            while len(pending) < max_pending:
+                path = next(remaining, None)
+                if path is None:
+                    break
+                pending.add(pool.submit(_process_one, path, profile))
+            if not pending:
+                break
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                record = future.result()
+                out.write(json.dumps(record, ensure_ascii=False) + '\n')
+                out.flush()
+                summary['processed'] += 1
+                summary['failed'] += record['status'] != 'ok'
+                progress.update(record, force=summary['processed'] == len(todo))
+    return summary
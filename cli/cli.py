@@ -1,31 +1,46 @@
 import argparse
-from app.services import file_handler, preprocessor, ocr, analyzer
+import json
+import sys
 
-def process_file(file_path):
-    # Открываем файл
-    with open(file_path, 'rb') as f:
-        # Определяем MIME-тип
-        mime_type = file_handler.get_mime_type(f)
+def process_file(file_path, profile=None):
+    # Сервисы импортируются здесь, чтобы --help не платил за загрузку пакета app
+    from app.services import pipeline
 
-        # Если изображение, нормализуем
-        if mime_type.startswith('image/'):
-            f = preprocessor.normalize_image(f)
+    # Нормализация, OCR и анализ — тем же конвейером, что и в API
+    result = pipeline.process_path(file_path, profile=profile)
+    return result['analysis']
 
-        # Извлекаем текст
-        extracted_text = ocr.extract_text(f, mime_type)
-
-        # Анализируем текст
-        structured_data = analyzer.analyze_text(extracted_text)
-
-        return structured_data
-
-def main():
+def main(argv=None):
     parser = argparse.ArgumentParser(description='Конвертация и анализ документа.')
-    parser.add_argument('--file', required=True, help='Путь к файлу документа')
-    args = parser.parse_args()
-
-    result = process_file(args.file)
+    parser.add_argument('--file', help='Путь к файлу документа')
+    parser.add_argument('--profile', help='Профиль предобработки (fast, balanced, max-quality)')
+    commands = parser.add_subparsers(dest='command')
+
+    batch = commands.add_parser('batch', help='Пакетная обработка каталогов и glob-шаблонов в JSONL')
+    batch.add_argument('inputs', nargs='+', help='Каталоги, glob-шаблоны (в кавычках) или файлы')
+    batch.add_argument('-o', '--output', required=True,
+                       help='Выходной JSONL; он же контрольная точка для продолжения после сбоя')
+    batch.add_argument('-j', '--workers', type=int, help='Число процессов (по умолчанию — число ядер)')
+    # SUPPRESS: без --profile после batch остаётся значение, заданное до команды
+    batch.add_argument('--profile', default=argparse.SUPPRESS,
+                       help='Профиль предобработки (fast, balanced, max-quality)')
+    batch.add_argument('--retry-failed', action='store_true',
+                       help='Повторно обработать файлы, записанные с ошибкой')
+    args = parser.parse_args(argv)
+
+    if args.command == 'batch':
+        from cli.batch import run_batch
+
+        summary = run_batch(args.inputs, args.output, workers=args.workers,
+                            profile=args.profile, retry_failed=args.retry_failed)
+        print(json.dumps(summary, ensure_ascii=False))
+        return 1 if summary['failed'] else 0
+
+    if not args.file:
+        parser.error('нужен --file или команда batch')
+    result = process_file(args.file, profile=args.profile)
     print(result)
+    return 0
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
@@ -0,0 +1,28 @@
+import pytest
+
+from app.services import cache, llm
+
+
+@pytest.fixture(autouse=True)
+def no_result_cache(monkeypatch):
+    # Тесты не должны видеть результаты друг друга и кэш на диске разработчика
+    monkeypatch.setattr(cache, "store", cache.ResultCache())
+
+
+@pytest.fixture(autouse=True)
+def stub_llm():
+    # Анализатор в тестах работает офлайн, через локальную заглушку
+    backend = llm.StubBackend()
+    llm.set_backend(backend)
+    yield backend
+    llm.set_backend(None)
+
+
+@pytest.fixture
+def job_manager(tmp_path, monkeypatch):
+    from app.services import jobs
+
+    manager = jobs.JobManager(directory=str(tmp_path), workers=2)
+    monkeypatch.setattr(jobs, "_manager", manager)
+    yield manager
+    manager.shutdown()
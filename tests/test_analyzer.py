@@ -8,3 +8,110 @@ def test_analyze_text():
     result = analyzer.analyze_text(sample_text)
     # Допустим, ожидаем, что результат содержит ключ 'document_type'
     assert isinstance(result, dict) or 'document_type' in result
+
+
+def test_pipeline_runs_document_count_concurrently(stub_llm):
+    import time
+
+    stub_llm.delay = 0.2
+    started = time.perf_counter()
+    result = analyzer.process_document_pipeline("Договор аренды № 1")
+    elapsed = time.perf_counter() - started
+
+    assert result["document_count"] == 1
+    assert result["base_analysis"]["document_type"] == "unknown"
+    assert len(stub_llm.prompts) == 4
+    assert elapsed < 4 * 0.2  # estimate_document_count идёт параллельно с цепочкой из трёх вызовов
+
+
+def test_hugchat_sessions_are_reused(monkeypatch):
+    from app.services import llm
+
+    class FakeChat:
+        def new_conversation(self, switch_to=False):
+            return object()
+
+        def delete_conversation(self, conversation):
+            pass
+
+        def chat(self, prompt):
+            return self
+
+        def wait_until_done(self):
+            return "ok"
+
+    backend = llm.HuggingChatBackend(pool_size=2, session_ttl=60)
+    created = []
+
+    def new_session(force_login=False):
+        created.append(force_login)
+        return llm._Session(FakeChat())
+
+    monkeypatch.setattr(backend, "_new_session", new_session)
+
+    assert [backend.chat("привет") for _ in range(5)] == ["ok"] * 5
+    assert created == [False]
+    assert backend.report()["idle_sessions"] == 1
+
+
+def test_hugchat_requests_never_share_a_conversation(monkeypatch):
+    from app.services import llm
+
+    class FakeChat:
+        def __init__(self):
+            self.conversations, self.current, self.deleted, self.asked = 0, None, [], []
+
+        def new_conversation(self, switch_to=False):
+            self.conversations += 1
+            if switch_to:
+                self.current = self.conversations
+            return self.conversations
+
+        def delete_conversation(self, conversation):
+            self.deleted.append(conversation)
+
+        def chat(self, prompt):
+            self.asked.append(self.current)
+            return self
+
+        def wait_until_done(self):
+            return "ok"
+
+    chatbot = FakeChat()
+    backend = llm.HuggingChatBackend(pool_size=1, session_ttl=60)
+    monkeypatch.setattr(backend, "_new_session", lambda force_login=False: llm._Session(chatbot))
+
+    backend.chat("документ 1")
+    backend.chat("документ 2")
+    assert len(set(chatbot.asked)) == 2
+    assert chatbot.deleted == chatbot.asked
+
+
+def test_split_text_prefers_page_and_paragraph_boundaries():
+    pages = ["Абзац один.\n\nАбзац два.", "Вторая страница " * 10]
+    chunks = analyzer.split_text("\f".join(pages), max_chars=60)
+    assert chunks[0] == "Абзац один.\n\nАбзац два."
+    assert all(len(chunk) <= 60 for chunk in chunks)
+    assert " ".join(chunks).split() == " ".join(pages).split()
+
+
+def test_long_text_is_analyzed_in_chunks(stub_llm, monkeypatch):
+    monkeypatch.setattr(analyzer.Config, "ANALYSIS_CHUNK_CHARS", 50)
+    text = "\f".join(f"Страница {i} договора поставки" for i in range(4))
+    result = analyzer.analyze_text(text)
+    assert len(stub_llm.prompts) > 1
+    assert result["document_type"] == "unknown"
+    assert "```json" in result["markdown_response"]
+
+
+def test_merge_chunk_results():
+    merged = analyzer.merge_chunk_results([
+        {"document_type": "договор", "title": None, "keywords": ["аренда"], "summary": "Начало."},
+        {"markdown_response": "Комментарий\n```json\n{\"document_type\": \"договор\", \"title\": \"Договор\", "
+                              "\"keywords\": [\"аренда\", \"залог\"], \"summary\": \"Конец.\"}\n```"},
+        {"document_type": "акт"},
+    ])
+    assert merged["document_type"] == "договор"
+    assert merged["title"] == "Договор"
+    assert merged["keywords"] == ["аренда", "залог"]
+    assert merged["summary"] == "Начало.\nКонец."
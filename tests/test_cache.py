@@ -0,0 +1,52 @@
+import os
+
+import numpy as np
+
+from app.services import cache, ocr
+
+
+def test_memory_lru_evicts_least_recently_used():
+    store = cache.ResultCache(memory_bytes=800)
+    store.put("ocr", "a", b"x" * 300)
+    store.put("ocr", "b", b"x" * 300)
+    assert store.get("ocr", "a") is not None  # "a" становится свежее "b"
+    store.put("ocr", "c", b"x" * 300)
+    assert store.get("ocr", "b") is None
+    assert store.get("ocr", "a") is not None and store.get("ocr", "c") is not None
+
+
+def test_disk_cache_survives_new_instance_and_is_bounded(tmp_path):
+    store = cache.ResultCache(directory=str(tmp_path), disk_bytes=3000)
+    for i in range(10):
+        store.put("normalize", f"k{i}", os.urandom(1000))
+    sizes = [f.stat().st_size for f in tmp_path.rglob("*.pkl")]
+    assert sum(sizes) <= 3000
+
+    fresh = cache.ResultCache(directory=str(tmp_path), disk_bytes=3000)
+    assert fresh.get("normalize", "k9") is not None
+    assert fresh.get("normalize", "k0") is None
+
+
+def test_stage_keys_are_independent():
+    text_key = cache.digest(np.zeros((2, 2), dtype=np.uint8))
+    assert cache.stage_key("ocr", "docTR", text_key) != cache.stage_key("ocr", "easyocr", text_key)
+    assert cache.stage_key("analysis", "text", {"prompt": 1}) != cache.stage_key("analysis", "text", {"prompt": 2})
+
+
+def test_ocr_results_are_cached_per_engine(monkeypatch):
+    calls = []
+
+    def make(name):
+        def engine(images):
+            calls.extend(name for _ in images)
+            return [(name, [name], [0.9]) for _ in images]
+        return engine
+
+    monkeypatch.setattr(cache, "store", cache.ResultCache(memory_bytes=2 ** 20))
+    monkeypatch.setattr(ocr, "ENGINES", tuple((name, make(name)) for name in ("docTR", "easyocr", "shiftlab")))
+    blocks = [np.full((20, 40, 3), v, dtype=np.uint8) for v in (0, 255)]
+
+    first = ocr.extract_text_from_pages(blocks, concurrent=False, batched=False, use_cache=True)
+    assert len(calls) == 6
+    second = ocr.extract_text_from_pages(blocks, concurrent=False, batched=False, use_cache=True)
+    assert second == first and len(calls) == 6
@@ -0,0 +1,73 @@
+import json
+
+from cli import batch
+
+
+def test_collect_files_from_dirs_and_globs(tmp_path):
+    (tmp_path / 'scans' / 'sub').mkdir(parents=True)
+    (tmp_path / 'scans' / 'a.png').write_bytes(b'')
+    (tmp_path / 'scans' / 'sub' / 'b.PDF').write_bytes(b'')
+    (tmp_path / 'scans' / 'notes.txt').write_text('')
+    (tmp_path / 'c.jpg').write_bytes(b'')
+
+    files = batch.collect_files([str(tmp_path / 'scans'), str(tmp_path / '*.jpg'), str(tmp_path / 'scans' / 'a.png')])
+    names = [path.rsplit('/', 1)[-1] for path in files]
+    assert names == ['c.jpg', 'a.png', 'b.PDF']
+
+
+def test_checkpoint_skips_done_and_truncated_lines(tmp_path):
+    output = tmp_path / 'out.jsonl'
+    output.write_text(
+        json.dumps({'file': '/a', 'status': 'ok'}) + '\n'
+        + json.dumps({'file': '/b', 'status': 'error'}) + '\n'
+        + '{"file": "/c", "sta'
+    )
+    assert batch.read_checkpoint(str(output)) == {'/a', '/b'}
+    assert batch.read_checkpoint(str(output), retry_failed=True) == {'/a'}
+
+
+def test_run_batch_resumes_without_reprocessing(tmp_path):
+    scan = tmp_path / 'a.png'
+    scan.write_bytes(b'')
+    output = tmp_path / 'out.jsonl'
+    output.write_text(json.dumps({'file': str(scan), 'status': 'ok'}) + '\n')
+
+    summary = batch.run_batch([str(tmp_path)], str(output), workers=1)
+    assert summary == {'total': 1, 'skipped': 1, 'processed': 0, 'failed': 0}
+
+
+def test_run_batch_drops_truncated_last_line(tmp_path):
+    done, scan = tmp_path / 'a.png', tmp_path / 'b.png'
+    done.write_bytes(b'')
+    scan.write_bytes(b'')
+    output = tmp_path / 'out.jsonl'
+    output.write_text(json.dumps({'file': str(done), 'status': 'ok'}) + '\n' + '{"file": "' + str(scan) + '", "sta')
+
+    summary = batch.run_batch([str(tmp_path)], str(output), workers=1)
+    assert summary['processed'] == 1
+    records = [json.loads(line) for line in output.read_text().splitlines()]
+    assert [record['file'] for record in records] == [str(done), str(scan)]
+
+
+def test_process_one_records_errors(monkeypatch):
+    from app.services import pipeline
+
+    def fail(path, profile=None):
+        raise ValueError('плохой файл')
+
+    monkeypatch.setattr(pipeline, 'process_path', fail)
+    record = batch._process_one('/missing.png', None)
+    assert record['status'] == 'error'
+    assert 'плохой файл' in record['error']
+
+
+def test_profile_before_batch_command_is_kept(monkeypatch):
+    from cli import cli
+
+    calls = []
+    monkeypatch.setattr(batch, 'run_batch', lambda inputs, output, **kwargs: calls.append(kwargs['profile']) or
+                        {'total': 0, 'skipped': 0, 'processed': 0, 'failed': 0})
+    cli.main(['--profile', 'fast', 'batch', 'scans', '-o', 'out.jsonl'])
+    cli.main(['batch', 'scans', '-o', 'out.jsonl', '--profile', 'max-quality'])
+    cli.main(['batch', 'scans', '-o', 'out.jsonl'])
+    assert calls == ['fast', 'max-quality', None]
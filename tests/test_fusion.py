@@ -0,0 +1,40 @@
+from app.services import fusion, ocr
+
+
+def test_fuse_votes_per_token():
+    text = fusion.fuse([
+        ("docTR", None, ["Договор аренды № 15", "г. Москва"], [0.9, 0.8]),
+        ("easyocr", None, ["Дoговор аренды № 15", "г. Москва"], [0.6, 0.9]),
+        ("shiftlab", "Договор оренды № 15\nг. Москва", [], []),
+    ])
+    assert text == "Договор аренды № 15\nг. Москва"
+
+
+def test_fuse_keeps_lines_found_by_one_engine():
+    text = fusion.fuse([
+        ("docTR", None, ["Фамилия Иванов", "Имя Иван"], [0.9, 0.9]),
+        ("easyocr", None, ["Фамилия Иванов", "Отчество Иванович", "Имя Иван"], [0.9, 0.9, 0.9]),
+    ])
+    assert text.splitlines() == ["Фамилия Иванов", "Отчество Иванович", "Имя Иван"]
+
+
+def test_merge_returns_single_consensus_text():
+    assert ocr.merge_ocr_results(["", None]) is None
+    merged = ocr.merge_ocr_results(["СНИЛС 123-456-789 00", "СНИЛС 123-456-789 00"])
+    assert merged == "СНИЛС 123-456-789 00"
+
+
+def test_fuse_folds_phrase_fragments_into_full_lines():
+    full = ["ДОГОВОР АРЕНДЫ НЕЖИЛОГО ПОМЕЩЕНИЯ № 15", "г. Москва 1 марта 2024 года",
+            "Арендодатель передаёт Арендатору помещение"]
+    fragments = ["ДОГОВОР АРЕНДЫ", "НЕЖИЛОГО ПОМЕЩЕНИЯ", "№ 15", "г. Москва", "1 марта 2024 года",
+                 "Арендодатель передаёт", "Арендатору помещение"]
+    for results in (
+        [("docTR", None, full, [0.9] * 3), ("easyocr", None, fragments, [0.9] * 7)],
+        [("easyocr", None, fragments, [0.9] * 7), ("docTR", None, full, [0.5] * 3)],
+    ):
+        text = fusion.fuse(results)
+        assert text.count("Москва") == 1
+        assert text.count("НЕЖИЛОГО") == 1
+        assert text.count("Арендатору") == 1
+    assert fusion.fuse([("docTR", None, full, [0.9] * 3), ("easyocr", None, fragments, [0.9] * 7)]) == "\n".join(full)
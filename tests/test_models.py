@@ -0,0 +1,56 @@
+import threading
+import time
+
+from app.services.models import ModelRegistry
+
+
+def test_model_loaded_once_across_threads():
+    calls = []
+
+    def loader():
+        calls.append(1)
+        time.sleep(0.05)
+        return object()
+
+    registry = ModelRegistry()
+    registry.register("slow", loader)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(registry.get("slow"))) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(calls) == 1
+    assert len({id(r) for r in results}) == 1
+
+
+def test_warm_up_reports_load_stats():
+    registry = ModelRegistry()
+    registry.register("lazy", lambda: "model")
+    assert registry.report() == {"lazy": {"loaded": False}}
+
+    report = registry.warm_up()
+    assert report["lazy"]["loaded"] is True
+    assert "load_seconds" in report["lazy"] and "rss_delta_mb" in report["lazy"]
+
+
+def test_inference_variant_follows_quantize_setting(monkeypatch):
+    from app.config import Config
+    from app.services import inference
+
+    monkeypatch.setattr(Config, "OCR_QUANTIZE", frozenset({"docTR", "shiftlab"}))
+    assert inference.variant("docTR") == "int8"
+    assert inference.variant("easyocr") == "fp32"
+    # Shiftlab не квантуется, даже если указан
+    assert inference.variant("shiftlab") == "fp32"
+
+
+def test_outer_parallelism_divides_threads(monkeypatch):
+    from app.config import Config
+    from app.services import inference
+
+    monkeypatch.setattr(Config, "OCR_CONCURRENT", True)
+    assert inference.outer_parallelism(processes=2) == 6
+    monkeypatch.setattr(Config, "OCR_CONCURRENT", False)
+    assert inference.outer_parallelism() == 1
@@ -1,4 +1,5 @@
 import io
+import time
 import pytest
 from app.services import ocr
 
@@ -10,3 +11,133 @@ def test_extract_text_with_invalid_file():
     text = ocr.extract_text(dummy, mime_type)
     # Тестируем, что функция возвращает строку (в данном случае сообщение об ошибке)
     assert isinstance(text, str)
+
+
+def _fake_engines(delay=0.0):
+    def make(name):
+        def engine(images):
+            time.sleep(delay)
+            return [(f"{name} {img}", [f"{name} {img}"], [0.9]) for img in images]
+        return engine
+
+    return tuple((name, make(name)) for name in ("docTR", "easyocr", "shiftlab"))
+
+
+def test_concurrent_mode_matches_sequential(monkeypatch):
+    monkeypatch.setattr(ocr, "ENGINES", _fake_engines(delay=0.01))
+    blocks = ["block1.png", "block2.png", "block3.png"]
+    sequential = ocr.extract_text_from_pages(blocks, concurrent=False, batched=False)
+    concurrent = ocr.extract_text_from_pages(blocks, concurrent=True, max_workers=4, batched=False)
+    assert sequential == concurrent
+
+
+def test_concurrent_mode_engine_timeout(monkeypatch):
+    def slow_engine(images):
+        time.sleep(1)
+        return [("late", [], [])]
+
+    engines = dict(_fake_engines())
+    engines["shiftlab"] = slow_engine
+    monkeypatch.setattr(ocr, "ENGINES", tuple(engines.items()))
+    text, details = ocr.extract_text_from_pages(
+        ["block.png"], concurrent=True, batched=False, timeouts={"shiftlab": 0.05}
+    )
+    assert details["shiftlab"] == ""
+    assert "docTR block.png" in details["docTR"]
+
+
+def test_concurrent_mode_deadline_covers_whole_batch(monkeypatch):
+    def slow_engine(images):
+        time.sleep(1)
+        return [("late", [], [])] * len(images)
+
+    engines = dict(_fake_engines())
+    engines["shiftlab"] = slow_engine
+    monkeypatch.setattr(ocr, "ENGINES", tuple(engines.items()))
+    blocks = [f"block{i}.png" for i in range(4)]
+    started = time.monotonic()
+    _, details = ocr.extract_text_from_pages(
+        blocks, concurrent=True, max_workers=8, batched=False, timeouts={"shiftlab": 0.05}
+    )
+    # Срок движка — 4 x 0.05 с от начала пакета, а не сумма таймаутов по каждой задаче
+    assert time.monotonic() - started < 0.8
+    assert details["shiftlab"] == ""
+    assert ocr._get_pool(8) is ocr._get_pool(8)
+
+
+def test_plan_batches_respects_size_and_memory():
+    shapes = [(100, 200, 3), (10, 20, 3), (100, 200, 3), (10, 20, 3), (50, 50, 3)]
+    batches = ocr.plan_batches(shapes, batch_size=2, memory_cap=10 ** 9)
+    assert sorted(i for batch in batches for i in batch) == list(range(len(shapes)))
+    assert all(len(batch) <= 2 for batch in batches)
+
+    # Лимит памяти меньше одного большого блока: каждый блок в своём пакете
+    batches = ocr.plan_batches(shapes, batch_size=16, memory_cap=100 * 200 * 3 - 1, padded=True)
+    assert [2] in batches and [0] in batches
+
+
+def test_batched_mode_maps_results_back_to_blocks(monkeypatch):
+    import numpy as np
+
+    calls = []
+
+    def engine(images):
+        calls.append(len(images))
+        return [(f"h={img.shape[0]}", [], []) for img in images]
+
+    monkeypatch.setattr(ocr, "ENGINES", (("docTR", engine), ("easyocr", engine), ("shiftlab", engine)))
+    blocks = [np.zeros((h, 40, 3), dtype=np.uint8) for h in (30, 10, 20)]
+    _, details = ocr.extract_text_from_pages(blocks, concurrent=False, batched=True)
+    assert details["docTR"] == "h=30h=10h=20"
+    assert calls.count(3) == 2  # docTR и EasyOCR — одним вызовом на все блоки
+
+
+def test_reuse_detection_skips_easyocr(monkeypatch):
+    from app.services.preprocessor import BlockContext, PageContext
+
+    calls = {}
+
+    def make(name):
+        def engine(images):
+            calls[name] = calls.get(name, 0) + len(images)
+            return [(f"{name}", [name], [0.9]) for _ in images]
+        return engine
+
+    monkeypatch.setattr(ocr, "ENGINES", tuple((name, make(name)) for name in ("docTR", "easyocr", "shiftlab")))
+    page = PageContext(
+        page_index=0, shape=(100, 100, 3), mode="full",
+        detections=[([[1, 1], [20, 1], [20, 10], [1, 10]], "Привет", 0.95)],
+        block_boxes=[(0, 0, 50, 50)],
+    )
+    blocks = [BlockContext("block.png", page, 0)]
+    _, details = ocr.extract_text_from_pages(blocks, concurrent=False, batched=False, reuse_detection=True)
+    assert details["easyocr"] == "Привет"
+    assert "easyocr" not in calls and calls["docTR"] == 1
+
+
+def test_cascade_runs_next_engine_only_for_unconfident_blocks(monkeypatch):
+    calls = {}
+
+    def make(name, confidence):
+        def engine(images):
+            calls.setdefault(name, []).extend(images)
+            return [(f"{name} {img}", [f"{name} {img}"], [confidence(img)]) for img in images]
+        return engine
+
+    monkeypatch.setattr(ocr, "ENGINES", (
+        ("docTR", make("docTR", lambda img: 0.99 if img == "clean.png" else 0.4)),
+        ("easyocr", make("easyocr", lambda img: 0.95)),
+        ("shiftlab", make("shiftlab", lambda img: 0.9)),
+    ))
+    blocks = ["clean.png", "noisy.png"]
+    text, details = ocr.extract_text_from_pages(blocks, concurrent=False, batched=False, cascade=True)
+    assert calls == {"docTR": blocks, "easyocr": ["noisy.png"]}
+    assert details["easyocr"] == "easyocr noisy.png"
+    assert text.startswith("docTR clean.png")
+
+
+def test_is_confident_requires_every_line():
+    assert ocr.is_confident(("a\nb", ["a", "b"], [0.9, 0.95]), threshold=0.85)
+    assert not ocr.is_confident(("a\nb", ["a", "b"], [0.9, 0.5]), threshold=0.85)
+    assert not ocr.is_confident(("a", ["a"], []), threshold=0.85)
+    assert not ocr.is_confident(ocr.EMPTY_RESULT)
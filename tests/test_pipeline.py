@@ -0,0 +1,56 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.services import ocr, pipeline, preprocessor
+
+
+def _fake_pages(count):
+    def iter_pages(file_obj, profile=None):
+        for i in range(count):
+            yield i, [f"page{i}.png"]
+    return iter_pages
+
+
+def _fake_ocr(blocks):
+    # Первая страница распознаётся дольше остальных: порядок событий не должен меняться
+    time.sleep(0.05 if blocks == ["page0.png"] else 0)
+    return f"text {blocks[0]}", {"docTR": blocks[0], "easyocr": "", "shiftlab": "", "visual": ""}
+
+
+def test_iter_document_streams_pages_in_order(monkeypatch, stub_llm):
+    monkeypatch.setattr(preprocessor, "iter_normalized_pages", _fake_pages(3))
+    monkeypatch.setattr(ocr, "extract_text_from_pages", _fake_ocr)
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        events = list(pipeline.iter_document("doc.pdf", executor=executor))
+
+    assert [e["event"] for e in events] == ["page", "page", "page", "text", "analysis"]
+    assert [e["page"] for e in events[:3]] == [0, 1, 2]
+    assert events[3]["text"] == "text page0.png\ftext page1.png\ftext page2.png"
+    assert events[-1]["analysis"]["document_count"] == 1
+
+
+def test_iter_document_without_text_skips_analysis(monkeypatch, stub_llm):
+    monkeypatch.setattr(preprocessor, "iter_normalized_pages", _fake_pages(1))
+    monkeypatch.setattr(ocr, "extract_text_from_pages", lambda blocks: ("", {}))
+
+    events = list(pipeline.iter_document("doc.png"))
+    assert events[-1] == {"event": "analysis", "text": "", "analysis": None}
+    assert stub_llm.prompts == []
+
+
+def test_process_document_with_executor_matches_in_process(monkeypatch, stub_llm):
+    import numpy as np
+
+    def engine(images):
+        return [(f"v{int(img.mean())}", [f"v{int(img.mean())}"], [0.9]) for img in images]
+
+    monkeypatch.setattr(ocr, "ENGINES", (("docTR", engine), ("easyocr", engine), ("shiftlab", engine)))
+    pages = [preprocessor.PageContext(page_index=i, shape=(10, 10, 3), mode="detect") for i in range(3)]
+    blocks = [preprocessor.BlockContext(np.full((8, 8, 3), i * 10 + j, dtype=np.uint8), pages[i], j) for i in range(3) for j in range(2)]
+    monkeypatch.setattr(preprocessor, "normalize_file", lambda *args, **kwargs: blocks)
+    monkeypatch.setattr(pipeline.analyzer, "process_document_pipeline", lambda text: {"text": text})
+
+    expected = pipeline.process_document("doc.pdf")
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        assert pipeline.process_document("doc.pdf", executor=executor) == expected
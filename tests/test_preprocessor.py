@@ -13,3 +13,304 @@ def test_normalize_image():
     normalized = preprocessor.normalize_image(buf)
     # Проверяем, что результат – BytesIO объект, содержащий изображение
     assert hasattr(normalized, 'read')
+
+
+class _FakeReader:
+    """Подменяет EasyOCR: две строки текста в левом верхнем и правом нижнем углу."""
+
+    def __init__(self):
+        self.calls = []
+
+    def detect(self, img):
+        self.calls.append("detect")
+        return [[[10, 90, 10, 30], [300, 380, 300, 330]]], [[]]
+
+    def readtext(self, img, **kwargs):
+        self.calls.append("readtext")
+        return [
+            ([[10, 10], [90, 10], [90, 30], [10, 30]], "Привет", 0.9),
+            ([[300, 300], [380, 300], [380, 330], [300, 330]], "мир", 0.7),
+        ]
+
+
+def test_split_detect_mode_skips_recognition(monkeypatch):
+    import numpy as np
+
+    fake = _FakeReader()
+    monkeypatch.setattr(preprocessor.models, "get_easyocr_reader", lambda: fake)
+    image = np.full((400, 400, 3), 255, dtype=np.uint8)
+
+    blocks, context = preprocessor.split_image_by_ocr(image, mode="detect", return_context=True)
+    assert fake.calls == ["detect"]
+    assert len(blocks) == len(context.block_boxes) == 2
+    assert not context.recognized
+
+
+def test_split_full_mode_keeps_text_for_blocks(monkeypatch):
+    import numpy as np
+
+    monkeypatch.setattr(preprocessor.models, "get_easyocr_reader", _FakeReader)
+    image = np.full((400, 400, 3), 255, dtype=np.uint8)
+
+    blocks, context = preprocessor.split_image_by_ocr(image, mode="full", return_context=True)
+    block = preprocessor.BlockContext("block.png", context, 1)
+    assert context.recognized
+    assert [text for _, text, _ in block.detections] == ["мир"]
+    assert block.detections[0][0][0] == [0, 0]
+
+
+def _png_buffer():
+    image = Image.new('RGB', (400, 400), color='white')
+    buf = io.BytesIO()
+    image.save(buf, format='PNG')
+    buf.seek(0)
+    return buf
+
+
+def test_normalize_image_in_memory(monkeypatch):
+    import numpy as np
+
+    monkeypatch.setattr(preprocessor.models, "get_easyocr_reader", _FakeReader)
+    blocks = preprocessor.normalize_image(_png_buffer(), in_memory=True)
+    assert len(blocks) == 2
+    assert all(isinstance(block, np.ndarray) for block in blocks)
+
+
+def test_normalize_image_on_disk_uses_unique_paths(monkeypatch):
+    monkeypatch.setattr(preprocessor.models, "get_easyocr_reader", _FakeReader)
+    first = preprocessor.normalize_image(_png_buffer(), in_memory=False)
+    second = preprocessor.normalize_image(_png_buffer(), in_memory=False)
+    assert not set(first) & set(second)
+
+
+def test_iter_pdf_pages_keeps_order_and_bounds_queue(monkeypatch):
+    import threading
+    import time
+    import numpy as np
+
+    lock = threading.Lock()
+    state = {"rendered": 0, "consumed": 0, "max_ahead": 0}
+
+    def render(path, page_number, dpi):
+        time.sleep(0.01 * (page_number % 3))
+        with lock:
+            state["rendered"] += 1
+            state["max_ahead"] = max(state["max_ahead"], state["rendered"] - state["consumed"])
+        return np.full((4, 4, 3), page_number, dtype=np.uint8)
+
+    monkeypatch.setattr(preprocessor, "_render_pdf_page", render)
+    pages = []
+    for number, image in preprocessor.iter_pdf_pages("doc.pdf", range(1, 11), threads=3, max_pages=2):
+        with lock:
+            state["consumed"] += 1
+        pages.append((number, int(image[0, 0, 0])))
+
+    assert pages == [(n, n) for n in range(1, 11)]
+    assert state["max_ahead"] <= 3  # страница у потребителя + не больше двух в очереди
+
+
+def test_text_layer_pages_skip_rendering_and_ocr(monkeypatch):
+    import numpy as np
+    from app.services import ocr
+
+    rendered = []
+
+    def render(path, page_number, dpi):
+        rendered.append(page_number)
+        return np.full((400, 400, 3), 255, dtype=np.uint8)
+
+    monkeypatch.setattr(preprocessor, "_pdf_page_count", lambda path: 2)
+    monkeypatch.setattr(preprocessor, "pdf_text_layer", lambda path: {1: "Текст первой страницы"})
+    monkeypatch.setattr(preprocessor, "_render_pdf_page", render)
+    monkeypatch.setattr(preprocessor.models, "get_easyocr_reader", _FakeReader)
+
+    blocks = preprocessor.normalize_pdf("doc.pdf", with_context=True, in_memory=True, text_layer=True)
+    assert rendered == [2]
+    assert blocks[0].image is None and blocks[0].page.text_layer == "Текст первой страницы"
+
+    engine = lambda images: [("скан", ["скан"], [0.9]) for _ in images]
+    monkeypatch.setattr(ocr, "ENGINES", (("docTR", engine), ("easyocr", engine), ("shiftlab", engine)))
+    text, _ = ocr.extract_text_from_pages(blocks, concurrent=False, batched=True)
+    assert text.split("\f") == ["Текст первой страницы", "скан\n\nскан"]
+
+
+def test_is_text_layer():
+    assert preprocessor.is_text_layer("Договор аренды нежилого помещения " * 5)
+    assert not preprocessor.is_text_layer("  \n ")
+    assert not preprocessor.is_text_layer("#$%^&*()" * 50)
+
+
+def test_clean_binary_block_skips_preprocessing():
+    import numpy as np
+
+    image = np.full((200, 300, 3), 255, dtype=np.uint8)
+    image[50:60, 20:280] = 0
+    assert preprocessor.plan_preprocessing(image, "balanced") == []
+    assert preprocessor.plan_preprocessing(image, "max-quality") == list(preprocessor.PREPROCESS_STEPS)
+    assert preprocessor.preprocess_image(image, "fast").shape == image.shape
+
+
+def test_noisy_block_is_denoised_only_in_balanced():
+    import numpy as np
+
+    rng = np.random.default_rng(0)
+    image = np.clip(rng.normal(128, 40, (200, 300, 3)), 0, 255).astype(np.uint8)
+    assert preprocessor.measure_quality(image).noise > preprocessor.NOISE_THRESHOLD
+    assert "denoise" in preprocessor.plan_preprocessing(image, "balanced")
+    assert "denoise" not in preprocessor.plan_preprocessing(image, "fast")
+
+
+def _lined_page(angle=0.0):
+    import cv2
+    import numpy as np
+
+    page = np.full((600, 800, 3), 255, dtype=np.uint8)
+    for y in range(100, 500, 40):
+        page[y:y + 12, 100:700] = 0
+    if angle:
+        M = cv2.getRotationMatrix2D((400, 300), angle, 1.0)
+        page = cv2.warpAffine(page, M, (800, 600), borderValue=(255, 255, 255))
+    return page
+
+
+def test_estimate_skew_finds_rotation_angle():
+    import cv2
+
+    mask = preprocessor._text_mask(cv2.cvtColor(_lined_page(angle=4.0), cv2.COLOR_BGR2GRAY))
+    assert abs(preprocessor.estimate_skew(mask) + 4.0) < 0.5
+
+
+def test_page_geometry_is_cached_per_page(monkeypatch):
+    from app.services import cache
+
+    monkeypatch.setattr(cache, "store", cache.ResultCache(memory_bytes=2 ** 20))
+    calls = []
+    detect = preprocessor.detect_page_geometry
+    monkeypatch.setattr(preprocessor, "detect_page_geometry", lambda *a: calls.append(1) or detect(*a))
+
+    page = _lined_page(angle=3.0)
+    first, geometry = preprocessor.page_geometry(page)
+    second, _ = preprocessor.page_geometry(page)
+    assert len(calls) == 1 and geometry.skew != 0
+    assert (first == second).all()
+
+
+def _box(x, y, w=10, h=10):
+    return [[x, y], [x + w, y], [x + w, y + h], [x, y + h]]
+
+
+def test_merge_overlapping_boxes_is_transitive_and_order_independent():
+    boxes = [_box(0, 0), _box(200, 0), _box(100, 0), _box(0, 500)]
+    merged = preprocessor.merge_overlapping_boxes(boxes, eps=95)
+    assert merged == [(0, 0, 210, 10), (0, 500, 10, 510)]
+    assert sorted(preprocessor.merge_overlapping_boxes(boxes[::-1], eps=95)) == sorted(merged)
+
+
+def test_merge_overlapping_boxes_rechecks_grown_blocks():
+    # Слитые блоки, оказавшиеся рядом после роста, сливаются между собой
+    boxes = [_box(0, 0, 100, 10), _box(0, 35, 10, 10), _box(50, 70, 50, 10)]
+    assert preprocessor.merge_overlapping_boxes(boxes, eps=30) == [(0, 0, 100, 80)]
+
+
+def test_tiled_filters_match_single_pass(monkeypatch):
+    import cv2
+    import numpy as np
+    from app.config import Config
+
+    rng = np.random.default_rng(0)
+    image = cv2.GaussianBlur((rng.random((300, 260)) * 255).astype(np.uint8), (5, 5), 2)
+    monkeypatch.setattr(Config, "PREPROCESS_TILED", True)
+    monkeypatch.setattr(Config, "PREPROCESS_TILE_MIN_PIXELS", 0)
+    monkeypatch.setattr(Config, "PREPROCESS_TILE_OVERLAP", 0)
+    for func, halo in ((preprocessor._denoise, 13), (preprocessor._sharpen, 4),
+                       (preprocessor._adaptive_threshold, 17)):
+        tiled = preprocessor.run_tiled(func, image, halo=halo, tile_size=64, workers=3)
+        assert tiled.shape == image.shape
+        assert np.abs(tiled.astype(int) - func(image)).max() <= 1
+
+
+def test_tile_grid_covers_image_once():
+    grid = preprocessor.tile_grid((100, 70), tile_size=32, halo=8)
+    covered = [[0] * 70 for _ in range(100)]
+    for (py0, py1, px0, px1), (cy0, cy1, cx0, cx1) in grid:
+        assert py0 <= cy0 and cy1 <= py1 and px0 <= cx0 and cx1 <= px1
+        for y in range(cy0, cy1):
+            for x in range(cx0, cx1):
+                covered[y][x] += 1
+    assert all(c == 1 for row in covered for c in row)
+
+
+def _text_page(scale=1.0):
+    import cv2
+    import numpy as np
+
+    page = np.full((800, 600, 3), 255, dtype=np.uint8)
+    for y in range(60, 760, 40):
+        cv2.putText(page, "document text 2024", (30, y), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 0), 2)
+    return cv2.resize(page, None, fx=scale, fy=scale, interpolation=cv2.INTER_CUBIC)
+
+
+def test_estimate_text_height_follows_resolution():
+    base = preprocessor.estimate_text_height(_text_page())
+    large = preprocessor.estimate_text_height(_text_page(3.0))
+    assert base and abs(large / base - 3.0) < 0.3
+    blank = _text_page()
+    blank[:] = 255
+    assert preprocessor.estimate_text_height(blank) is None
+
+
+def test_page_resolution_downscales_and_maps_boxes_back(monkeypatch):
+    import numpy as np
+    from app.config import Config
+
+    monkeypatch.setattr(Config, "RESOLUTION_NORMALIZE", True)
+    image = _text_page(3.0)
+    scaled, scale = preprocessor.page_resolution(image)
+    assert scale < 0.6 and scaled.shape[0] == round(image.shape[0] * scale)
+
+    page = preprocessor.PageContext(page_index=0, shape=scaled.shape, mode="detect",
+                                    block_boxes=[(10, 20, 110, 220)], scale=0.5)
+    assert np.allclose(preprocessor.BlockContext(None, page, 0).original_bbox,
+                       [[20, 40], [220, 40], [220, 440], [20, 440]])
+    assert np.allclose(page.to_original([[1, 2], [3, 4]]), [[2, 4], [6, 8]])
+
+
+def test_page_resolution_keeps_ordinary_render(monkeypatch):
+    import cv2
+    from app.config import Config
+    from benchmarks.stages import synthetic_page
+
+    monkeypatch.setattr(Config, "RESOLUTION_NORMALIZE", True)
+    page = synthetic_page()  # A4 при 200 dpi
+    assert preprocessor.page_resolution(page)[1] == 1.0
+
+    large = cv2.resize(page, None, fx=2, fy=2, interpolation=cv2.INTER_CUBIC)
+    scaled, scale = preprocessor.page_resolution(large)
+    assert scale < 1.0 and max(scaled.shape[:2]) >= Config.RESOLUTION_MIN_SIDE
+    height = preprocessor.estimate_text_height(scaled)
+    assert abs(height - Config.RESOLUTION_TEXT_HEIGHT) / Config.RESOLUTION_TEXT_HEIGHT < Config.RESOLUTION_TOLERANCE
+
+
+def test_to_original_undoes_geometry_and_scale():
+    import numpy as np
+
+    geometry = preprocessor.PageGeometry(rotation=90, skew=2.0)
+    original_shape = (400, 300, 3)
+    point = np.array([[50.0, 120.0]])
+    forward = preprocessor.geometry_matrix(original_shape, geometry)
+    corrected = (forward @ [50.0, 120.0, 1.0])[:2] * 0.5
+
+    page = preprocessor.PageContext(page_index=0, shape=(150, 200, 3), mode="detect", geometry=geometry,
+                                    scale=0.5, original_shape=original_shape)
+    assert np.allclose(page.to_original([corrected]), point, atol=1e-3)
+
+
+def test_cleanup_blocks_removes_request_directory(monkeypatch):
+    import os
+
+    monkeypatch.setattr(preprocessor.models, "get_easyocr_reader", _FakeReader)
+    paths = preprocessor.normalize_image(_png_buffer(), in_memory=False)
+    directory = os.path.dirname(paths[0])
+    assert os.path.isdir(directory)
+    preprocessor.cleanup_blocks(paths)
+    assert not os.path.exists(directory)
@@ -20,3 +20,92 @@ def test_extract_text_with_dummy_file(client):
     response = client.post('/extract-text', data=data, content_type='multipart/form-data')
     # Проверка успешного ответа (здесь может быть ошибка, если textract не может обработать dummy)
     assert response.status_code in [200, 500]
+
+def test_health_is_available_immediately(client):
+    response = client.get('/health')
+    assert response.status_code == 200
+    assert response.get_json() == {'status': 'ok'}
+
+def test_ready_reports_models_and_startup(client):
+    response = client.get('/ready')
+    body = response.get_json()
+    assert response.status_code in [200, 503]
+    assert set(body['models']) == {'easyocr', 'docTR', 'shiftlab'}
+    assert 'total_seconds' in body['startup']
+
+def _wait_finished(client, job_id, timeout=5):
+    import time
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        body = client.get(f'/jobs/{job_id}').get_json()
+        if body['status'] in ('done', 'failed'):
+            return body
+        time.sleep(0.02)
+    raise AssertionError('задача не завершилась')
+
+def test_job_lifecycle_with_progress(client, job_manager):
+    def runner(path, progress=None, **params):
+        for page in range(1, 4):
+            progress('normalize', page, 3)
+        progress('ocr', 1, 1)
+        with open(path, 'rb') as f:
+            return {'text': f.read().decode(), 'params': params}
+
+    job_manager._runner = runner
+    data = {'file': (io.BytesIO('Содержимое'.encode()), 'scan.png'), 'profile': 'fast'}
+    response = client.post('/jobs', data=data, content_type='multipart/form-data')
+    assert response.status_code == 202
+    job_id = response.get_json()['job_id']
+
+    status = _wait_finished(client, job_id)
+    assert status['status'] == 'done'
+    assert status['progress']['stages']['normalize'] == {'done': 3, 'total': 3}
+
+    result = client.get(f'/jobs/{job_id}/result')
+    assert result.status_code == 200
+    assert result.get_json() == {'text': 'Содержимое', 'params': {'profile': 'fast'}}
+
+    events = client.get(f'/jobs/{job_id}/events').get_data(as_text=True)
+    assert '"status": "done"' in events
+
+def test_unfinished_jobs_survive_restart(tmp_path):
+    from app.services import jobs
+
+    store = jobs.JobStore(str(tmp_path / 'jobs.sqlite3'))
+    store.insert('interrupted', 'scan.png', str(tmp_path / 'scan.png'), {})
+    store.update('interrupted', status=jobs.RUNNING)
+
+    manager = jobs.JobManager(directory=str(tmp_path), runner=lambda path, progress=None: {'ok': True})
+    assert manager.recover() == 1
+    manager.shutdown()
+    assert manager.get('interrupted')['result'] == {'ok': True}
+
+def test_unknown_job_is_404(client, job_manager):
+    assert client.get('/jobs/missing').status_code == 404
+    assert client.get('/jobs/missing/result').status_code == 404
+
+def test_metrics_exposes_llm_spans(client):
+    from app.services import llm
+
+    llm.chat("Проверка")
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    body = response.get_data(as_text=True)
+    assert 'doc2text_span_seconds_count{span="llm.chat"}' in body
+    assert 'doc2text_process_resident_memory_bytes' in body
+
+def test_finished_jobs_drop_uploads_and_expire(tmp_path):
+    import os
+    from app.services import jobs
+
+    manager = jobs.JobManager(directory=str(tmp_path), runner=lambda path, progress=None: {'ok': True}, ttl=60)
+    job_id = manager.submit(io.BytesIO(b'scan'), 'scan.png')
+    manager.shutdown()
+    job = manager.get(job_id)
+    assert job['status'] == 'done' and not os.path.exists(os.path.dirname(job['path']))
+
+    assert manager.sweep(now=job['updated_at'] + 30) == 0
+    assert manager.sweep(now=job['updated_at'] + 61) == 1
+    assert manager.get(job_id) is None
@@ -0,0 +1,27 @@
+from app.services.textnorm import normalize_text
+
+
+def test_fixes_homoglyphs_inside_cyrillic_words():
+    assert normalize_text("Pоссийская Федерация, п0дпись") == "Российская Федерация, подпись"
+
+
+def test_latin_only_homoglyph_words_follow_line_script():
+    assert normalize_text("Номер A123BC, OOO «Ромашка»") == "Номер А123ВС, ООО «Ромашка»"
+    # В латинской строке такие слова остаются латиницей
+    assert normalize_text("TEXT MAX A123BC") == "TEXT MAX A123BC"
+
+
+def test_keeps_real_latin_numbers_and_addresses():
+    text = "ИНН 7701234567, 2024г, 1990года, Samsung, ivan.petrov@mail.com, www.example.com/Pо"
+    assert normalize_text(text) == text
+
+
+def test_collapses_whitespace_and_keeps_page_breaks():
+    text = "первая  страница   \n\n\n\nабзац\fвторая страница"
+    assert normalize_text(text) == "первая страница\n\nабзац\fвторая страница"
+
+
+def test_quantities_with_units_keep_digits():
+    text = "Количество: 3шт, масса 1кг, 4см, отдел 0МВД, к0мната 6"
+    assert normalize_text(text) == "Количество: 3шт, масса 1кг, 4см, отдел 0МВД, комната 6"
+    assert normalize_text("1990года 15мм слов0") == "1990года 15мм слов0"
@@ -0,0 +1,46 @@
+import pytest
+
+from app.config import Config
+from app.utils import tracing
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    registry = tracing.Registry()
+    monkeypatch.setattr(tracing, "registry", registry)
+    return registry
+
+
+def test_span_records_duration_attrs_and_errors(registry):
+    with tracing.span("normalize", bytes=100) as sp:
+        sp.set(pages=2, kind="pdf")
+    with pytest.raises(ValueError):
+        with tracing.span("normalize", bytes=50):
+            raise ValueError("сбой")
+
+    stats = registry.snapshot()["normalize"]
+    assert stats["count"] == 2
+    assert stats["errors"] == 1
+    assert stats["totals"] == {"bytes": 150, "pages": 2}
+    # Гистограмма накопительная: последняя граница содержит все быстрые участки
+    assert stats["buckets"][-1] == 2
+
+
+def test_span_log_includes_parent(registry, monkeypatch, caplog):
+    monkeypatch.setattr(Config, "TRACE_LOG", True)
+    with caplog.at_level("INFO", logger="doc2text.trace"):
+        with tracing.span("document"):
+            with tracing.span("ocr.docTR", blocks=3):
+                pass
+    assert '"span": "ocr.docTR"' in caplog.text
+    assert '"parent": "document"' in caplog.text
+
+
+def test_render_prometheus(registry):
+    with tracing.span("llm.chat", prompt_chars=10):
+        pass
+    text = tracing.render_prometheus({"doc2text_models_loaded": 0})
+    assert 'doc2text_span_seconds_count{span="llm.chat"} 1' in text
+    assert 'doc2text_span_seconds_bucket{span="llm.chat",le="+Inf"} 1' in text
+    assert 'doc2text_span_prompt_chars_total{span="llm.chat"} 10' in text
+    assert "doc2text_models_loaded 0" in text
@@ -0,0 +1,92 @@
+import time
+
+import numpy as np
+import pytest
+
+from app.services import workers
+from app.services.preprocessor import BlockContext, PageContext
+
+
+def _describe(blocks):
+    # Выполняется в обработчике: блоки пришли через общую память
+    return [(type(block).__name__, int(getattr(block, "image", block).sum()),
+             getattr(getattr(block, "page", None), "page_index", None)) for block in blocks]
+
+
+def test_pack_blocks_keeps_paths_and_contexts():
+    page = PageContext(page_index=2, shape=(10, 10, 3), mode="detect", block_boxes=[(0, 0, 5, 5), (5, 5, 10, 10)])
+    blocks = [BlockContext(np.ones((5, 5, 3), dtype=np.uint8), page, 0), BlockContext("block.png", page, 1)]
+    shm, stripped, layout = workers.pack_blocks(blocks)
+    try:
+        assert [i for i, *_ in layout] == [0]
+        assert stripped[0].image is None and stripped[1].image == "block.png"
+        assert shm.size >= 75
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    monkeypatch.setattr(workers.models, "warm_up", lambda names=None: {})
+    pool = workers.WorkerPool(processes=2)
+    yield pool
+    pool.shutdown()
+
+
+def test_worker_pool_passes_blocks_through_shared_memory(pool):
+    page = PageContext(page_index=1, shape=(4, 4, 3), mode="detect", block_boxes=[(0, 0, 4, 4)])
+    blocks = [BlockContext(np.full((4, 4, 3), 2, dtype=np.uint8), page, 0), np.ones((3, 3), dtype=np.uint8)]
+    future = pool.submit(_describe, blocks)
+    assert future.result(timeout=30) == [("BlockContext", 96, 1), ("ndarray", 9, None)]
+    # Блоки в родителе не изменились (в обработчик ушли копии в общей памяти)
+    assert blocks[0].image.sum() == 96
+
+
+def _crash(blocks):
+    import os
+
+    os._exit(1)
+
+
+def test_dead_worker_marks_pool_broken(pool, monkeypatch):
+    from concurrent.futures.process import BrokenProcessPool
+
+    from app.config import Config
+
+    monkeypatch.setattr(Config, "WORKER_POOL", True)
+    monkeypatch.setattr(workers, "_pool", pool)
+    assert workers.executor() is pool
+
+    with pytest.raises(BrokenProcessPool):
+        pool.submit(_crash, [np.ones((2, 2), dtype=np.uint8)]).result(timeout=30)
+    # Флаг ставит callback будущего; он может выполниться чуть позже result()
+    deadline = time.monotonic() + 5
+    while not pool.broken and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert pool.broken
+    # Дальше обработка в процессе, а не в пуле с мёртвыми обработчиками
+    assert workers.executor() is None
+    with pytest.raises(BrokenProcessPool):
+        pool.submit(_describe, ["block.png"])
+
+
+def test_pool_is_not_created_lazily_or_after_threads_start(monkeypatch):
+    import threading
+
+    from app.config import Config
+
+    monkeypatch.setattr(Config, "WORKER_POOL", True)
+    monkeypatch.setattr(workers, "_pool", None)
+    assert workers.executor() is None
+
+    stop = threading.Event()
+    thread = threading.Thread(target=stop.wait)
+    thread.start()
+    try:
+        with pytest.raises(RuntimeError):
+            workers.start()
+    finally:
+        stop.set()
+        thread.join()
+    assert workers.get_pool() is None